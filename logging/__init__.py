@@ -23,6 +23,7 @@ def addLevelName(level, name):
 class Logger:
 
     level = NOTSET
+    limiter = None  # Optional, decides if records are let through
 
     def __init__(self, name):
         self.name = name
@@ -39,25 +40,47 @@ class Logger:
         self.level = level
 
     def isEnabledFor(self, level):
-        return level >= self.level
+        return level >= self._dest().level
+
+    def _dest(self):
+        dest = self
+        while dest.level == NOTSET and dest.parent:
+            dest = dest.parent
+        return dest
 
     def log(self, level, msg, *args, exc_info=None):
+        # Bail out before any allocation when the level is disabled
+        dest = self._dest()
+        if level < dest.level or not dest.handlers:
+            return
+
+        limiter = self.limiter
+        if limiter is not None:
+            # Also before any allocation, to survive log storms
+            if not limiter.allow(level):
+                return
+
+            # The summary is a WARNING, kept counting till that's enabled
+            if WARNING >= dest.level:
+                suppressed = limiter.take_suppressed()
+                if suppressed:
+                    self._emit(dest, WARNING, "%s records suppressed",
+                               (suppressed,))
+
         if exc_info:
             buf = uio.StringIO()
             sys.print_exception(exc_info, buf)
             msg += "\n" + buf.getvalue()
 
-        dest = self
-        while dest.level == NOTSET and dest.parent:
-            dest = dest.parent
-        if level >= dest.level:
-            record = LogRecord(
-                self.name, level, None, None, msg, args, None, None, None
-            )
+        self._emit(dest, level, msg, args)
 
-            if dest.handlers:
-                for hdlr in dest.handlers:
-                    hdlr.emit(record)
+    def _emit(self, dest, level, msg, args):
+        # One record for all handlers, its message is formatted once
+        record = LogRecord(
+            self.name, level, None, None, msg, args, None, None, None
+        )
+        for hdlr in dest.handlers:
+            hdlr.emit(record)
 
     def debug(self, msg, *args, exc_info=None):
         self.log(DEBUG, msg, *args, exc_info=exc_info)
@@ -187,7 +210,7 @@ class Formatter:
 
     def format(self, record):
         # The message attribute of the record is computed using msg % args.
-        record.message = record.msg % record.args
+        record.message = record.getMessage()
 
         # If the formatting string contains '(asctime)', formatTime() is called to
         # format the event time.
@@ -241,6 +264,17 @@ class LogRecord:
         self.exc_info = exc_info
         self.func = func
         self.sinfo = sinfo
+        self.message = None
+
+    def getMessage(self):
+        # Cached, so handlers sharing the record format it only once
+        message = self.message
+        if message is None:
+            message = str(self.msg)
+            if self.args:
+                message = message % self.args
+            self.message = message
+        return message
 
 
 root = Logger("root")
@@ -12,13 +12,16 @@ from machine import reset
 from sys import print_exception
 from uio import StringIO
 
-from mpy_blox.config import init_config
-from mpy_blox.log_handlers import blox_log_config
+from mpy_blox.boot_graph import BootGraph
+from mpy_blox.boot_timeline import boot_timeline
+from mpy_blox.config import init_settings
+from mpy_blox.log_handlers import blox_log_config, blox_network_log_config
 from mpy_blox.log_handlers.formatter import VTSGRColorFormatter
+from mpy_blox.metrics import init_metrics, init_metrics_publisher
 from mpy_blox.mqtt import MQTTConnectionManager
 from mpy_blox.mqtt.update import MQTTUpdateChannel
 from mpy_blox.network import connect_wlan
-from mpy_blox.time import sync_ntp, scheduled_sync_task
+from mpy_blox.ntp import init_ntp
 from mpy_blox.util import log_vfs_state, log_mem_state
 
 
@@ -32,25 +35,40 @@ def asyncio_exception_handler(loop, context):
                    exc_info=context['exception'])
 
 
-def start_network(config):
-    if config.get('network.disabled', False):
-        logger.info("Networking disabled")
-        return False
+async def start_ntp(settings):
+    # Never returns False: MQTT waiting for the clock has to connect anyway
+    try:
+        return await init_ntp(settings)
+    except Exception as e:
+        logger.warning("MPy-BLOX: NTP sync unavailable", exc_info=e)
+        return None
+
+
+async def connect_mqtt():
+    logger.info("MPy-BLOX: Network available, connecting MQTT")
+    mqtt_conn = MQTTConnectionManager.get_connection()
+    await mqtt_conn.connect()
+    return mqtt_conn
+
 
-    connect_wlan(config)
-    sync_ntp(config)
-    asyncio.create_task(scheduled_sync_task(config))
+async def start_metrics():
+    init_metrics()
 
-    return True
 
+async def start_metrics_publisher(settings, mqtt_conn):
+    if not settings.metrics_interval:
+        logger.info("MPy-BLOX: Metrics publishing disabled")
+        return None
+    return init_metrics_publisher(settings, mqtt_conn)
 
-async def register_updates(config, mqtt_connection):
-    channel = config.get('update.channel')
+
+async def register_updates(settings, mqtt_connection):
+    channel = settings.update_channel
     if not channel:
         logger.info("MPy-BLOX: No update channel configured")
-        return
+        return None
 
-    auto_update = config.get('update.auto_update')
+    auto_update = settings.update_auto_update
     update_channel = MQTTUpdateChannel(channel,
                                        auto_update,
                                        mqtt_connection)
@@ -64,14 +82,65 @@ async def register_updates(config, mqtt_connection):
                 "MPy-BLOX: Update on boot succesful, rebooting with new code")
             reset()
 
+    return update_channel
+
+
+def import_user_main():
+    try:
+        import user_main
+    except ImportError as e:
+        logger.info("Missing user_main, going to REPL")
+        print_exception(e)
+        return None
+    return user_main
+
+
+def boot_graph(settings, user_module) -> BootGraph:
+    """Boot stages, all running in one event loop as soon as they can."""
+    graph = BootGraph()
+    graph.add('log_config', lambda: blox_log_config(settings))
+    graph.add('metrics', start_metrics)
+
+    if settings.network_disabled:
+        logger.info("Networking disabled")
+    else:
+        graph.add('wlan', lambda: connect_wlan(settings))
+        graph.add('ntp', lambda: start_ntp(settings), 'wlan')
+        graph.add('network_log_config',
+                  lambda: blox_network_log_config(
+                      settings, graph.result('log_config')),
+                  'wlan', 'log_config')
+        # TLS certificate dates are checked against the clock, so sync first
+        mqtt_deps = ('wlan',)
+        if settings.mqtt_ssl:
+            mqtt_deps = ('wlan', 'ntp')
+        graph.add('mqtt_connect', connect_mqtt, *mqtt_deps)
+        graph.add('register_updates',
+                  lambda: register_updates(settings,
+                                           graph.result('mqtt_connect')),
+                  'mqtt_connect')
+        graph.add('metrics_publisher',
+                  lambda: start_metrics_publisher(
+                      settings, graph.result('mqtt_connect')),
+                  'mqtt_connect')
+
+    # Optional hardware init of the user app, overlaps with networking
+    user_init = getattr(user_module, 'user_init', None)
+    if user_init:
+        graph.add('user_init', user_init)
+
+    return graph
+
 
 def main():
-    config = init_config()
+    with boot_timeline.phase('config'):
+        settings = init_settings()
 
-    emergency_buf_len = int(config.get('emergency_buf_len', 100))
+    emergency_buf_len = settings.emergency_buf_len
     if emergency_buf_len:
         logger.info("Allocating %s emergency buffer", emergency_buf_len)
-        micropython.alloc_emergency_exception_buf(emergency_buf_len)
+        with boot_timeline.phase('emergency_buf'):
+            micropython.alloc_emergency_exception_buf(emergency_buf_len)
 
     # Register our own asyncio exception handler using logging
     asyncio.get_event_loop().set_exception_handler(asyncio_exception_handler)
@@ -79,8 +148,9 @@ def main():
     # Enable VT mode on serial terminal now
     getLogger().handlers[0].setFormatter(VTSGRColorFormatter())
 
-    network_available = start_network(config)
-    asyncio.run(blox_log_config(config, network_available))
+    user_module = import_user_main()
+    graph = boot_graph(settings, user_module)
+    asyncio.run(graph.run())
 
     # We are booted, no more need for kernel messages
     osdebug(None)
@@ -92,21 +162,15 @@ def main():
     log_mem_state()
     logger.info('Mpy-BLOX: Core succesfully booted')
 
-    if network_available:
-        logger.info("MPy-BLOX: Network available, connecting MQTT")
-        mqtt_conn = MQTTConnectionManager.get_connection()
-        asyncio.run(mqtt_conn.connect())
-        asyncio.run(register_updates(config, mqtt_conn))
+    # Ends up in the replay log and on the node info topic
+    boot_timeline.finish()
+    boot_timeline.log()
+    update_channel = graph.result('register_updates')
+    if update_channel:
+        asyncio.run(update_channel.publish_info())
 
-    # Run GC after starting MQTT
-    gc.collect()
-
-    try:
-        from user_main import user_main
-        asyncio.run(user_main())
-    except ImportError as e:
-        logger.info("Missing user_main, going to REPL")
-        print_exception(e)
+    if user_module:
+        asyncio.run(user_module.user_main())
 
 
 def main_except_reset():
@@ -0,0 +1,68 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import asyncio
+from logging import getLogger
+
+from mpy_blox.boot_timeline import boot_timeline
+
+
+logger = getLogger('system')
+
+
+class BootStage:
+    def __init__(self, name, func, deps):
+        self.name = name
+        self.func = func
+        self.deps = deps
+        self.done = asyncio.Event()
+        self.ok = False
+        self.result = None
+
+
+class BootGraph:
+    """Runs async boot stages concurrently, each once its dependencies are done.
+
+    Stages are coroutine functions without arguments. A stage returning
+    False (e.g. WLAN without credentials) skips the stages depending on
+    it, an exception aborts the whole boot. Dependencies have to be added
+    before their dependents, so the graph can't contain cycles.
+    """
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name, func, *deps):
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError("Unknown boot stage {}".format(dep))
+        self.stages[name] = BootStage(name, func, deps)
+
+    def result(self, name):
+        stage = self.stages.get(name)
+        return stage.result if stage else None
+
+    async def run_stage(self, stage):
+        for dep in stage.deps:
+            dep_stage = self.stages[dep]
+            await dep_stage.done.wait()
+            if not dep_stage.ok:
+                logger.warning("Skipping boot stage %s, %s not available",
+                               stage.name, dep)
+                stage.done.set()
+                return
+
+        with boot_timeline.phase(stage.name):
+            stage.result = await stage.func()
+        stage.ok = stage.result is not False
+        stage.done.set()
+
+    async def run(self):
+        tasks = [asyncio.create_task(self.run_stage(stage))
+                 for stage in self.stages.values()]
+        try:
+            await asyncio.gather(*tasks)
+        except Exception:
+            for task in tasks:
+                task.cancel()
+            raise
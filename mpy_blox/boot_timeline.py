@@ -0,0 +1,90 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from gc import mem_free
+from logging import getLogger
+from utime import ticks_diff, ticks_us
+
+
+logger = getLogger('system')
+
+
+class BootPhase:
+    def __init__(self, timeline, name):
+        self.timeline = timeline
+        self.name = name
+        self.start_us = self.end_us = None
+        self.mem_before = self.mem_after = None
+
+    def __enter__(self):
+        self.mem_before = mem_free()
+        self.start_us = ticks_us()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.end_us = ticks_us()
+        self.mem_after = mem_free()
+        self.timeline.phases.append(self)
+
+    @property
+    def duration_us(self):
+        return ticks_diff(self.end_us, self.start_us)
+
+
+class BootTimeline:
+    """Records the duration and heap use of every boot phase.
+
+    Usage: with boot_timeline.phase('wlan'): ...
+
+    Phases may overlap when they run as concurrent tasks, the heap numbers
+    then include whatever the other tasks allocated meanwhile.
+    """
+    def __init__(self):
+        # ticks_us counts from power on, so this is the time to get here
+        self.start_us = ticks_us()
+        self.end_us = None
+        self.phases = []
+
+    def phase(self, name) -> BootPhase:
+        return BootPhase(self, name)
+
+    def finish(self):
+        self.end_us = ticks_us()
+
+    @property
+    def done(self):
+        return self.end_us is not None
+
+    def as_dict(self):
+        start_us = self.start_us
+        end_us = self.end_us if self.done else ticks_us()
+        return {
+            'pre_main_ms': start_us // 1000,
+            'total_ms': ticks_diff(end_us, start_us) // 1000,
+            'done': self.done,
+            # name, start (ms since main), duration (ms), heap before, after
+            'phases': [
+                (phase.name,
+                 ticks_diff(phase.start_us, start_us) // 1000,
+                 phase.duration_us // 1000,
+                 phase.mem_before, phase.mem_after)
+                for phase in self.phases
+            ]
+        }
+
+    def log(self):
+        start_us = self.start_us
+        for phase in self.phases:
+            logger.info("Boot phase %s: +%sms took %sms, heap free %s -> %s",
+                        phase.name,
+                        ticks_diff(phase.start_us, start_us) // 1000,
+                        phase.duration_us // 1000,
+                        phase.mem_before, phase.mem_after)
+
+        end_us = self.end_us if self.done else ticks_us()
+        logger.info("Boot took %sms (%sms before main)",
+                    ticks_diff(end_us, start_us) // 1000, start_us // 1000)
+
+
+boot_timeline = BootTimeline()
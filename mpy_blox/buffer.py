@@ -35,3 +35,89 @@ class PreAllocatedRingBuffer:
             yield memoryview(self.data[idx])
 
             idx = new_idx
+
+
+class PreAllocatedByteRing:
+    """Variable length records in one preallocated bytearray.
+
+    Every record is prefixed by its total length (2 bytes, little endian),
+    a length of 0 marks the wrap back to the start. When full, the oldest
+    records are dropped to make room.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.data = bytearray(size)
+        self.mv = memoryview(self.data)
+        self.head = self.tail = 0
+        self.count = 0
+        self.dropped = 0  # Total dropped records, tracks iterator positions
+
+    def __len__(self):
+        return self.count
+
+    def _len_at(self, pos):
+        data = self.data
+        if pos > self.size - 2:
+            return 0
+        return data[pos] | (data[pos + 1] << 8)
+
+    def _next_pos(self, pos):
+        pos += self._len_at(pos)
+        if not self._len_at(pos):
+            pos = 0  # Wrapped
+        return pos
+
+    def _write_pos(self, rec_len):
+        head = self.head
+        tail = self.tail
+        if head > tail:
+            if self.size - head >= rec_len:
+                return head
+            if tail >= rec_len:
+                if self.size - head >= 2:
+                    self.data[head] = self.data[head + 1] = 0
+                return 0
+        elif tail - head >= rec_len:
+            return head
+        return None
+
+    def drop_oldest(self):
+        self.count -= 1
+        self.dropped += 1
+        if self.count:
+            self.tail = self._next_pos(self.tail)
+        else:
+            self.head = self.tail = 0
+
+    def append(self, record):
+        rec_len = len(record) + 2
+        if rec_len > self.size - 2:
+            raise ValueError("Record too large")
+
+        pos = self._write_pos(rec_len) if self.count else 0
+        while pos is None:
+            self.drop_oldest()
+            pos = self._write_pos(rec_len) if self.count else 0
+
+        data = self.data
+        data[pos] = rec_len & 0xFF
+        data[pos + 1] = rec_len >> 8
+        self.mv[pos + 2:pos + rec_len] = record
+        self.head = pos + rec_len
+        self.count += 1
+
+    def __iter__(self):
+        # Resumes at the oldest record, if records got dropped in between
+        seq = self.dropped
+        pos = self.tail
+        while True:
+            if seq < self.dropped:
+                seq = self.dropped
+                pos = self.tail
+            if seq >= self.dropped + self.count:
+                return
+
+            rec_len = self._len_at(pos)
+            yield self.mv[pos + 2:pos + rec_len]
+            seq += 1
+            pos = self._next_pos(pos)
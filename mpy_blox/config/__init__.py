@@ -6,9 +6,13 @@ import logging
 
 import os
 from json import load
+
+from mpy_blox.config.schema import compile_settings
+
 logger = logging.getLogger('system')
 
 config = {}
+settings = None  # Compiled by init_config
 try:
     from mpy_blox.config.secure_nvs import SecureNVS
     offers_nvs = True
@@ -75,7 +79,7 @@ def ingest_provision_config(provision_path: str | None = None):
 
 
 def init_config(unix_cwd=False):
-    global config
+    global config, settings
     if unix_cwd:
         config.update(read_settings('.' + SETTINGS_PATH))
         ingest_provision_config('.' + PROVISION_PATH)
@@ -83,4 +87,11 @@ def init_config(unix_cwd=False):
         config.update(read_settings())
         ingest_provision_config()
 
+    settings = compile_settings(config)
     return config
+
+
+def init_settings(unix_cwd=False):
+    """init_config(), returning the compiled settings instead."""
+    init_config(unix_cwd)
+    return settings
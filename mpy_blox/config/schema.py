@@ -0,0 +1,148 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import logging
+from ucollections import namedtuple
+
+
+logger = logging.getLogger('system')
+
+
+def to_bool(value):
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+def to_level(value):
+    if isinstance(value, str) and not value.isdigit():
+        return getattr(logging, value.upper())
+    return int(value)
+
+
+def to_list(value):
+    if isinstance(value, str):
+        return [item.strip() for item in value.split(',') if item.strip()]
+    return list(value)
+
+
+def one_of(*choices):
+    def check(value):
+        return value in choices
+    return check
+
+
+def at_least(minimum):
+    def check(value):
+        return value >= minimum
+    return check
+
+
+# key, type, default(, check): every key becomes an attribute of the
+# compiled settings, dots replaced by underscores.
+SCHEMA = (
+    ('hostname', str, None),
+    ('emergency_buf_len', int, 100, at_least(0)),
+    ('device.suggested_area', str, None),
+
+    ('network.disabled', to_bool, False),
+    ('wlan.ssid', str, None),
+    ('wlan.psk', str, None),
+    ('wlan.fast_connect', to_bool, True),
+    ('wlan.reuse_lease', to_bool, False),
+    ('wlan.connect_timeout_ms', int, 16000, at_least(1000)),
+    ('ntp.host', to_list, ['pool.ntp.org'], len),  # Comma separated
+    ('ntp.min_interval', int, 64, at_least(16)),
+    ('ntp.interval', int, 3600, at_least(16)),  # Maximum, adapts to drift
+
+    ('sleep.deep', to_bool, False),
+    ('sleep.light', to_bool, False),
+    ('sleep.deep_min_ms', int, 60000, at_least(1000)),
+
+    ('mqtt.ssl', to_bool, False),  # Also nested, in the "mqtt" section
+
+    ('metrics.interval', int, 0, at_least(0)),  # Off by default
+    ('metrics.hass', to_bool, False),
+
+    ('update.channel', str, None),
+    ('update.auto_update', to_bool, False),
+
+    ('logging.replay_buffer', to_bool, False),
+    ('logging.replay_buffer.max_records', int, 150, at_least(1)),
+    ('logging.replay_buffer.size', int, None, at_least(64)),
+    ('logging.replay_buffer.persistence', to_bool, False),
+    ('logging.replay_buffer.segment_size', int, 4096, at_least(256)),
+    ('logging.replay_buffer.segments', int, 4, at_least(2)),
+
+    ('logging.syslog.hostname', str, None),
+    ('logging.syslog.level', to_level, logging.ERROR),
+    ('logging.syslog.port', int, 514),
+    ('logging.syslog.protocol', str, 'udp', one_of('udp', 'tcp')),
+    ('logging.syslog.queue_size', int, 32, at_least(1)),
+    ('logging.syslog.rate', int, 20, at_least(1)),
+
+    ('logging.mqtt', to_bool, False),
+    ('logging.mqtt.level', to_level, logging.INFO),
+    ('logging.mqtt.batch_size', int, 1024, at_least(64)),
+    ('logging.mqtt.batch_age_ms', int, 5000, at_least(0)),
+    ('logging.mqtt.spool_size', int, 4096, at_least(256)),
+    ('logging.mqtt.compress', to_bool, True),
+
+    ('logging.remote_terminal.listen_host', str, None),
+    ('logging.remote_terminal.listen_port', int, 8023),
+    ('logging.remote_terminal.max_lines', int, 64, at_least(1)),
+)
+
+# Only these are looked up in the secure config (NVS) first, so plain
+# keys never decrypt anything.
+SECURE_KEYS = ('wlan.ssid', 'wlan.psk')
+
+# The raw config stays reachable for secure, per connection and prefixed keys
+Settings = namedtuple(
+    'Settings',
+    tuple(option[0].replace('.', '_') for option in SCHEMA) + ('raw',))
+
+
+def _lookup(config, key):
+    # Flat "mqtt.ssl" key or "ssl" in a nested "mqtt" section
+    value = dict.get(config, key)  # Skips a secure dict's lookup
+    if value is None and '.' in key:
+        section, section_key = key.split('.', 1)
+        section = dict.get(config, section)
+        if isinstance(section, dict):
+            value = section.get(section_key)
+    return value
+
+
+def compile_settings(config):
+    """Convert and validate config against SCHEMA, once.
+
+    Invalid values are logged and replaced by their default, so a typo in
+    settings.json doesn't stop the device from booting.
+    """
+    secure = config.get('secure')
+    values = []
+    for option in SCHEMA:
+        key, convert, default = option[:3]
+        if secure is not None and key in SECURE_KEYS and key in secure:
+            value = secure[key]
+        else:
+            value = _lookup(config, key)
+
+        if value is None:
+            values.append(default)
+            continue
+
+        try:
+            value = convert(value)
+            if len(option) > 3 and not option[3](value):
+                raise ValueError(value)
+        except (ValueError, TypeError, AttributeError):
+            logger.error("Invalid setting %s: %s, using default %s",
+                         key, value, default)
+            value = default
+        values.append(value)
+
+    values.append(config)
+    return Settings(*values)
@@ -16,88 +16,275 @@ IV_SIZE = const(16)
 MODE_CBC = const(2)
 BLKSIZE = const(16)
 
+# Per key records: encrypted index of key -> [slot, size], every value
+# stored encrypted in its own 'r<slot>' blob, each blob with its own IV.
+# Records are never rewritten in place: changed values go to a free slot,
+# the index is written last and only then old slots are erased. A power
+# loss halfway leaves the previous index with all of its records intact.
+INDEX_KEY = 'index'
+INDEX_SIZE_KEY = 'index_s'
+RECORD_KEY_FORMAT = 'r{}'
+
+# Legacy single blob format, migrated on first read
+LEGACY_IV_KEY = 'iv'
+LEGACY_PAYLOAD_KEY = 'payload'
+LEGACY_PAYLOAD_SIZE_KEY = 'payload_s'
+
 
 class NotInitialised(Exception):
     pass
 
 
+def _not_found(os_e):
+    return os_e.args[0] == ESP_ERR_NVS_NOT_FOUND
+
+
 class SecureNVS(dict):
+    """Encrypted config in NVS, decrypting values only when accessed.
+
+    The dict itself only caches decrypted values, the index knows about
+    all keys. commit() only writes changed records, followed by the index.
+    """
     def __init__(self, namespace, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.nvs = NVS(namespace)
-        self.initialised = self.read()
+        self._key = None
+        self._index = None
+        self._dirty = set()
+        self._removed = []
+        self._index_dirty = False
+        self.initialised = self._has_index() or self._has_legacy()
 
-    def initialise(self):
-        nvs = self.nvs
+    @property
+    def key(self):
+        key = self._key
+        if key is None:
+            key = self._key = sha256(unique_id()).digest()
+        return key
+
+    @staticmethod
+    def unpad(data):
+        return data[0:-data[-1]]
+
+    @staticmethod
+    def pad(data):
+        pad = BLKSIZE - len(data) % BLKSIZE
+        return data + bytes((pad,)) * pad
+
+    def _encrypt(self, data):
         iv = urandom(IV_SIZE)
-        nvs.set_blob('iv', iv)
+        return iv + aes(self.key, MODE_CBC, iv).encrypt(self.pad(data))
 
-        nvs.commit()
-        self.initialised = True
+    def _decrypt(self, blob):
+        cipher = aes(self.key, MODE_CBC, bytes(blob[:IV_SIZE]))
+        return self.unpad(cipher.decrypt(bytes(blob[IV_SIZE:])))
 
-        return iv
+    def _get_blob(self, key, size):
+        # Size may be larger than the blob, see _set_index()
+        blob = bytearray(size)
+        blob_len = self.nvs.get_blob(key, blob)
+        return blob[:blob_len] if blob_len < size else blob
 
-    @property
-    def key(self):
-        return sha256(unique_id()).digest()
+    def _has_index(self):
+        try:
+            self.nvs.get_i32(INDEX_SIZE_KEY)
+            return True
+        except OSError as os_e:
+            if _not_found(os_e):
+                return False
+            raise
 
-    @property
-    def iv(self):
+    def _has_legacy(self):
         try:
-            iv = bytearray(IV_SIZE)
-            self.nvs.get_blob('iv', iv)
+            self.nvs.get_i32(LEGACY_PAYLOAD_SIZE_KEY)
+            return True
         except OSError as os_e:
-            if os_e.args[0] == ESP_ERR_NVS_NOT_FOUND:
-                raise NotInitialised
-        return iv
+            if _not_found(os_e):
+                return False
+            raise
 
-    @staticmethod
-    def unpad(data):
-        return data[0:-data[-1]]
+    @property
+    def index(self):
+        index = self._index
+        if index is None:
+            index = self._index = self._read_index()
+        return index
 
-    def read(self):
+    def _read_index(self):
         nvs = self.nvs
         try:
-            cipher = aes(self.key, MODE_CBC, self.iv)
-        except NotInitialised:
-            return False
+            size = nvs.get_i32(INDEX_SIZE_KEY)
+            return json.loads(self._decrypt(self._get_blob(INDEX_KEY, size)))
+        except OSError as os_e:
+            if not _not_found(os_e):
+                raise
+
+        self._index = {}
+        self._migrate_legacy()
+        return self._index
 
+    def _migrate_legacy(self):
+        nvs = self.nvs
         try:
-            size = nvs.get_i32('payload_s')
-            payload = bytearray(size)
-            nvs.get_blob('payload', payload)
+            iv = self._get_blob(LEGACY_IV_KEY, IV_SIZE)
+            size = nvs.get_i32(LEGACY_PAYLOAD_SIZE_KEY)
+            payload = self._get_blob(LEGACY_PAYLOAD_KEY, size)
         except OSError as os_e:
-            if os_e.args[0] == ESP_ERR_NVS_NOT_FOUND:
-                return False  # Empty
+            if _not_found(os_e):
+                return  # Nothing to migrate
+            raise
 
+        cipher = aes(self.key, MODE_CBC, iv)
         self.update(json.loads(self.unpad(cipher.decrypt(payload))))
-        return True
+        self.commit()
 
-    def clear(self):
-        super().clear()
+        for legacy_key in (LEGACY_IV_KEY, LEGACY_PAYLOAD_KEY,
+                           LEGACY_PAYLOAD_SIZE_KEY):
+            nvs.erase_key(legacy_key)
+        nvs.commit()
+
+    def _load(self, k):
+        slot, size = self.index[k]
+        value = json.loads(self._decrypt(
+            self._get_blob(RECORD_KEY_FORMAT.format(slot), size)))
+        super().__setitem__(k, value)
+        return value
+
+    def __getitem__(self, k):
+        try:
+            return super().__getitem__(k)
+        except KeyError:
+            return self._load(k)  # KeyError when not in the index either
+
+    def get(self, k, default=None):
+        try:
+            return self[k]
+        except KeyError:
+            return default
+
+    def __contains__(self, k):
+        return k in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
 
+    def keys(self):
+        return self.index.keys()
+
+    def items(self):
+        return [(k, self[k]) for k in self.index]
+
+    def values(self):
+        return [self[k] for k in self.index]
+
+    def __setitem__(self, k, v):
+        index = self.index
+        if k not in index:
+            index[k] = [None, 0]  # Slot is taken on commit
+            self._index_dirty = True
+
+        super().__setitem__(k, v)
+        self._dirty.add(k)
+
+    def __delitem__(self, k):
+        slot, _ = self.index.pop(k)
+        if slot is not None:
+            self._removed.append(slot)
+        self._index_dirty = True
+        self._dirty.discard(k)
+        if super().__contains__(k):
+            super().__delitem__(k)
+
+    def update(self, *args, **kwargs):
+        for k, v in dict(*args, **kwargs).items():
+            self[k] = v
+
+    def clear(self):
         nvs = self.nvs
-        nvs.erase_key('iv')
-        nvs.erase_key('payload')
-        nvs.erase_key('payload_s')
+        for slot, _ in self.index.values():
+            if slot is not None:
+                self._removed.append(slot)
+        for slot in self._removed:
+            try:
+                nvs.erase_key(RECORD_KEY_FORMAT.format(slot))
+            except OSError as os_e:
+                if not _not_found(os_e):
+                    raise
+
+        for nvs_key in (INDEX_KEY, INDEX_SIZE_KEY, LEGACY_IV_KEY,
+                        LEGACY_PAYLOAD_KEY, LEGACY_PAYLOAD_SIZE_KEY):
+            try:
+                nvs.erase_key(nvs_key)
+            except OSError as os_e:
+                if not _not_found(os_e):
+                    raise
         nvs.commit()
 
+        super().clear()
+        self._index = {}
+        self._dirty = set()
+        self._removed = []
+        self._index_dirty = False
         self.initialised = False
 
-    @staticmethod
-    def pad(data):
-        pad = BLKSIZE - len(data) % BLKSIZE
-        return data + pad * chr(pad)
+    def _set_index(self, index_blob):
+        # Blob and size are separate keys, order their writes so the stored
+        # size is never smaller than the stored blob
+        nvs = self.nvs
+        try:
+            grows = len(index_blob) > nvs.get_i32(INDEX_SIZE_KEY)
+        except OSError as os_e:
+            if not _not_found(os_e):
+                raise
+            grows = True
+
+        if grows:
+            nvs.set_i32(INDEX_SIZE_KEY, len(index_blob))
+            nvs.set_blob(INDEX_KEY, index_blob)
+        else:
+            nvs.set_blob(INDEX_KEY, index_blob)
+            nvs.set_i32(INDEX_SIZE_KEY, len(index_blob))
 
     def commit(self):
         nvs = self.nvs
-        try:
-            iv = self.iv
-        except NotInitialised:
-            iv = self.initialise()
+        index = self.index
 
-        cipher = aes(self.key, MODE_CBC, iv)
-        payload = cipher.encrypt(self.pad(json.dumps(self).encode()))
-        nvs.set_i32('payload_s', len(payload))
-        nvs.set_blob('payload', payload)
+        # Slots the stored index may still point to stay untouched
+        busy_slots = {slot for slot, _ in index.values()}
+        busy_slots.update(self._removed)
+        stale_slots = self._removed
+        slot = 0
+        for k in self._dirty:
+            record = self._encrypt(json.dumps(super().__getitem__(k)).encode())
+            while slot in busy_slots:
+                slot += 1
+            busy_slots.add(slot)
+            nvs.set_blob(RECORD_KEY_FORMAT.format(slot), record)
+
+            old_slot = index[k][0]
+            if old_slot is not None:
+                stale_slots.append(old_slot)
+            index[k] = [slot, len(record)]
+            self._index_dirty = True
+
+        if self._index_dirty:
+            self._set_index(self._encrypt(json.dumps(index).encode()))
         nvs.commit()
+
+        # New index is in place, old records are no longer referenced
+        if stale_slots:
+            for slot in stale_slots:
+                try:
+                    nvs.erase_key(RECORD_KEY_FORMAT.format(slot))
+                except OSError as os_e:
+                    if not _not_found(os_e):
+                        raise
+            nvs.commit()
+
+        self._dirty = set()
+        self._removed = []
+        self._index_dirty = False
+        self.initialised = True
@@ -8,32 +8,54 @@ from logging import getLogger
 logger = getLogger('system')
 
 
-async def blox_log_config(settings, network_available):
+async def blox_log_config(settings):
+    # Limits go first, so no handler ever sees a log storm
+    from mpy_blox.log_handlers.limiter import init_log_limits
+    try:
+        init_log_limits(settings.raw)
+    except (ValueError, KeyError) as e:
+        logger.warning("Failed to configure log limits", exc_info=e)
+
     replay_buffer = None
-    if settings.get('logging.replay_buffer', False):
+    if settings.logging_replay_buffer:
         from mpy_blox.log_handlers.replay_buffer import init_replay_buffer
         try:
             replay_buffer = init_replay_buffer(settings)
         except Exception as e:
             logger.warning("Failed to initialise replay_buffer", exc_info=e)
 
-    # Network reliant log handlers
-    if network_available:
-        # Rudimentary syslog facility
-        if 'logging.syslog.hostname' in settings:
-            from mpy_blox.log_handlers.syslog import init_syslog
-            try:
-                logger.info("Trying to initialise syslog")
-                init_syslog(settings)
-            except Exception as e:
-                logger.warning("Failed to initialise syslog", exc_info=e)
-
-        # VT100 remote terminal
-        if 'logging.remote_terminal.listen_host' in settings:
-            from mpy_blox.log_handlers.remote_terminal import init_remote_terminal
-            try:
-                logger.info("Trying to initialise remote terminal")
-                await init_remote_terminal(settings, replay_buffer)
-            except Exception as e:
-                logger.warning("Failed to initialise remote terminal",
-                               exc_info=e)
+    return replay_buffer
+
+
+async def blox_network_log_config(settings, replay_buffer):
+    """Network reliant log handlers, once the WLAN is connected."""
+    # Rudimentary syslog facility
+    if settings.logging_syslog_hostname:
+        from mpy_blox.log_handlers.syslog import init_syslog
+        try:
+            logger.info("Trying to initialise syslog")
+            init_syslog(settings)
+        except Exception as e:
+            logger.warning("Failed to initialise syslog", exc_info=e)
+
+    # Batched log shipping over the MQTT connection, spools till connected
+    if settings.logging_mqtt:
+        from mpy_blox.log_handlers.mqtt_log import init_mqtt_log
+        from mpy_blox.mqtt import MQTTConnectionManager
+        try:
+            logger.info("Trying to initialise MQTT log shipping")
+            init_mqtt_log(settings,
+                          MQTTConnectionManager.get_connection())
+        except Exception as e:
+            logger.warning("Failed to initialise MQTT log shipping",
+                           exc_info=e)
+
+    # VT100 remote terminal
+    if settings.logging_remote_terminal_listen_host:
+        from mpy_blox.log_handlers.remote_terminal import init_remote_terminal
+        try:
+            logger.info("Trying to initialise remote terminal")
+            await init_remote_terminal(settings, replay_buffer)
+        except Exception as e:
+            logger.warning("Failed to initialise remote terminal",
+                           exc_info=e)
@@ -28,44 +28,42 @@ def get_sgr_escape(codes):
     return ESC + b';'.join(codes) + END
 
 
+# Prebuilt level tags, avoids building escapes for every record
+LEVEL_TAGS = {
+    DEBUG: get_sgr_escape(FG_GREY) + b'[debug] ',
+    INFO: get_sgr_escape(FG_BLUE) + b'[info] ',
+    WARNING: get_sgr_escape(FG_YELLOW) + b'[warning] ',
+    ERROR: get_sgr_escape(FG_RED) + b'[error] ',
+}
+CRITICAL_TAG = get_sgr_escape((UNDERLINE, FG_RED)) + b'[critical] '
+
+
 class VTSGRColorFormatter:
     def __init__(self, replay_mode=False):
         self.replay_mode = replay_mode
-
-    def format(self, record) -> bytes:
-        # Start with date
-        if self.replay_mode:
-            formatted_msg = get_sgr_escape(FG_GREY) + b'[RP]'
+        if replay_mode:
+            self.time_prefix = get_sgr_escape(FG_GREY) + b'[RP]'
         else:
-            formatted_msg = get_sgr_escape(FG_CYAN)
-        formatted_msg += isotime().encode()
-        formatted_msg += get_sgr_escape(RESET)
-        formatted_msg += b' '
+            self.time_prefix = get_sgr_escape(FG_CYAN)
+        self.time_suffix = get_sgr_escape(RESET) + b' '
+        self.name_tags = {}
 
-        # Log level tag
-        level = record.levelno
-        if level == DEBUG:
-            formatted_msg += get_sgr_escape(FG_GREY)
-            formatted_msg += b'[debug]'
-        elif level == INFO:
-            formatted_msg += get_sgr_escape(FG_BLUE)
-            formatted_msg += b'[info]'
-        elif level == WARNING:
-            formatted_msg += get_sgr_escape(FG_YELLOW)
-            formatted_msg += b'[warning]'
-        elif level == ERROR:
-            formatted_msg += get_sgr_escape(FG_RED)
-            formatted_msg += b'[error]'
-        else:
-            formatted_msg += get_sgr_escape((UNDERLINE, FG_RED))
-            formatted_msg += b'[critical]'
-        formatted_msg += b' '
-        
-        # Logger name tag
-        formatted_msg += get_sgr_escape(FG_GREY)
-        formatted_msg += b'['
-        formatted_msg += record.name
-        formatted_msg += b'] '
+    def name_tag(self, name):
+        name_tag = self.name_tags.get(name)
+        if name_tag is None:
+            name_tag = self.name_tags[name] = (
+                get_sgr_escape(FG_GREY) + b'[' + name.encode() + b'] '
+                + get_sgr_escape(RESET))
+        return name_tag
+
+    def format_fields(self, timestamp, levelno, name, message) -> bytes:
+        return b''.join((
+            self.time_prefix, timestamp.encode(), self.time_suffix,
+            LEVEL_TAGS.get(levelno, CRITICAL_TAG),
+            self.name_tag(name),
+            message.encode()
+        ))
 
-        formatted_msg += get_sgr_escape(RESET)
-        return formatted_msg + (record.msg % record.args).encode()
+    def format(self, record) -> bytes:
+        return self.format_fields(isotime(), record.levelno, record.name,
+                                  record.getMessage())
@@ -0,0 +1,104 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from micropython import const
+
+from logging import ERROR, getLogger
+from utime import ticks_diff, ticks_ms
+
+RATE_PREFIX = 'logging.rate.'
+SAMPLE_PREFIX = 'logging.sample.'
+SUMMARY_INTERVAL_MS = const(10000)
+
+PERIODS_MS = {
+    's': 1000,
+    'min': 60000,
+    'h': 3600000,
+}
+
+
+logger = getLogger('system')
+
+
+def parse_rate(rate):
+    """Parse '10/s', '100/min' or a plain number per second."""
+    if isinstance(rate, str) and '/' in rate:
+        count, period = rate.split('/', 1)
+        return int(count), PERIODS_MS[period.strip()]
+    return int(rate), 1000
+
+
+class LogLimiter:
+    """Rate limit and/or sample the records of a logger.
+
+    Sampling lets 1 in every sample records through, the rate limit at most
+    rate records per period. ERROR and above always pass and don't use up
+    the budget. Suppressed records are counted and summarised at most every
+    SUMMARY_INTERVAL_MS.
+    """
+    def __init__(self, rate=0, period_ms=1000, sample=1):
+        self.rate = rate
+        self.period_ms = period_ms
+        self.sample = sample
+
+        self.seen = 0
+        self.window_start = self.last_summary = ticks_ms()
+        self.window_count = 0
+        self.suppressed = 0
+
+    def allow(self, level):
+        if level >= ERROR:
+            return True
+
+        sample = self.sample
+        if sample > 1:
+            self.seen = seen = (self.seen + 1) % sample
+            if seen != 1:
+                self.suppressed += 1
+                return False
+
+        rate = self.rate
+        if rate:
+            now = ticks_ms()
+            if ticks_diff(now, self.window_start) >= self.period_ms:
+                self.window_start = now
+                self.window_count = 0
+
+            if self.window_count >= rate:
+                self.suppressed += 1
+                return False
+            self.window_count += 1
+
+        return True
+
+    def take_suppressed(self):
+        suppressed = self.suppressed
+        if not suppressed:
+            return 0
+
+        now = ticks_ms()
+        if ticks_diff(now, self.last_summary) < SUMMARY_INTERVAL_MS:
+            return 0
+
+        self.last_summary = now
+        self.suppressed = 0
+        return suppressed
+
+
+def init_log_limits(settings):
+    limits = {}
+    for key in settings:
+        if key.startswith(RATE_PREFIX):
+            name = key[len(RATE_PREFIX):]
+            limits.setdefault(name, {})['rate'] = parse_rate(settings[key])
+        elif key.startswith(SAMPLE_PREFIX):
+            name = key[len(SAMPLE_PREFIX):]
+            limits.setdefault(name, {})['sample'] = int(settings[key])
+
+    for name, limit in limits.items():
+        rate, period_ms = limit.get('rate', (0, 1000))
+        sample = limit.get('sample', 1)
+        logger.info("Limiting logger %s: rate %s/%sms, sample 1/%s",
+                    name, rate, period_ms, sample)
+        getLogger(name).limiter = LogLimiter(rate, period_ms, sample)
@@ -0,0 +1,174 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from micropython import const
+
+import asyncio
+from io import BytesIO
+from sys import print_exception
+from logging import INFO, Handler, LogRecord, getLogger
+
+from mpy_blox.contextlib import suppress
+from mpy_blox.log_handlers.record import LogRecordBuffer, frame
+from mpy_blox.metrics import counter
+from mpy_blox.mqtt.protocol.message import MQTTMessage
+from mpy_blox.time import log_time
+from mpy_blox.zipfile import can_deflate
+
+try:
+    from deflate import DeflateIO, RAW
+except ImportError:
+    DeflateIO = None
+
+
+LOG_TOPIC_FORMAT = 'mpypi/nodes/{}/log'
+BATCH_VERSION = const(1)
+FLAG_DEFLATE = const(0x01)
+DEFAULT_BATCH_SIZE = const(1024)
+DEFAULT_BATCH_AGE_MS = const(5000)
+DEFAULT_SPOOL_SIZE = const(4096)
+RETRY_DELAY_MS = const(5000)
+
+# Debug records of the MQTT publish path itself are never shipped, every
+# batch would log one, spooling the next batch forever.
+TRANSPORT_LOGGERS = ('mqtt', 'mqtt_proto')
+
+batches_sent = counter('log_batches_sent')
+records_sent = counter('log_records_sent')
+
+
+def deflate(data):
+    compressed = BytesIO()
+    deflate_f = DeflateIO(compressed, RAW)
+    deflate_f.write(data)
+    deflate_f.close()
+    return compressed.getvalue()
+
+
+class MQTTLogHandler(Handler):
+    """Ships log records in batches to mpypi/nodes/<id>/log.
+
+    Records are spooled in a binary record ring, a batch is published once
+    it reaches batch_size bytes or its oldest record batch_age_ms. While
+    disconnected, records stay spooled (dropping the oldest when full).
+
+    Batch payload: version byte, flags byte, followed by the (raw deflated
+    when FLAG_DEFLATE is set) length prefixed self-contained records.
+    """
+    def __init__(self, mqtt_conn, level=INFO, batch_size=DEFAULT_BATCH_SIZE,
+                 batch_age_ms=DEFAULT_BATCH_AGE_MS,
+                 spool_size=DEFAULT_SPOOL_SIZE, compress=True):
+        super().__init__()
+        self.mqtt_conn = mqtt_conn
+        self.lvl = level
+        self.batch_size = batch_size
+        self.batch_age_ms = batch_age_ms
+        self.compress = compress and can_deflate()
+
+        self.spool = LogRecordBuffer(spool_size)
+        self.pending_size = 0
+        self.records_available = asyncio.Event()
+        self.batch_full = asyncio.Event()
+
+    @property
+    def topic(self):
+        return LOG_TOPIC_FORMAT.format(self.mqtt_conn.client_id)
+
+    @property
+    def connected(self):
+        return self.mqtt_conn.receive_task is not None
+
+    def emit(self, record: LogRecord):
+        levelno = record.levelno
+        if levelno < self.lvl or (levelno < INFO
+                                  and record.name in TRANSPORT_LOGGERS):
+            return
+
+        self.pending_size += self.spool.append(log_time(), levelno,
+                                               record.name, record.msg,
+                                               record.args)
+        self.records_available.set()
+        if self.pending_size >= self.batch_size:
+            self.batch_full.set()
+
+    def next_batch(self):
+        """Encode the oldest spooled records, returns (payload, count)."""
+        spool = self.spool
+        batch = []
+        batch_len = 0
+        for record in spool.ring:
+            data = frame(spool.persisted(record))
+            if batch and batch_len + len(data) > self.batch_size:
+                break
+
+            batch.append(data)
+            batch_len += len(data)
+
+        body = b''.join(batch)
+        flags = 0
+        if self.compress:
+            body = deflate(body)
+            flags |= FLAG_DEFLATE
+
+        return bytes((BATCH_VERSION, flags)) + body, len(batch)
+
+    async def publish_batch(self):
+        ring = self.spool.ring
+        payload, count = self.next_batch()
+        dropped_before = ring.dropped
+        await self.mqtt_conn.publish(MQTTMessage(self.topic, payload))
+
+        batches_sent.inc()
+        records_sent.inc(count)
+
+        # Records dropped for space meanwhile were part of this batch
+        count -= ring.dropped - dropped_before
+        for _ in range(min(max(count, 0), len(ring))):
+            ring.drop_oldest()
+
+    async def flush_task(self):
+        records_available = self.records_available
+        batch_full = self.batch_full
+        while True:
+            await records_available.wait()
+
+            # Give the batch time to fill up, unless it's full already
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for_ms(batch_full.wait(),
+                                          self.batch_age_ms)
+
+            while len(self.spool):
+                if not self.connected:
+                    await asyncio.sleep_ms(RETRY_DELAY_MS)
+                    continue
+
+                try:
+                    await self.publish_batch()
+                except OSError:
+                    # Keep records spooled and retry later
+                    await asyncio.sleep_ms(RETRY_DELAY_MS)
+                except Exception as e:
+                    # Not via logging, that would feed this handler. Drop
+                    # the oldest record, it may be the one that can't be
+                    # encoded, so the task keeps shipping the others
+                    print_exception(e)
+                    self.spool.ring.drop_oldest()
+                    await asyncio.sleep_ms(RETRY_DELAY_MS)
+
+            records_available.clear()
+            batch_full.clear()
+            self.pending_size = 0
+
+
+def init_mqtt_log(settings, mqtt_conn):
+    handler = MQTTLogHandler(
+        mqtt_conn,
+        level=settings.logging_mqtt_level,
+        batch_size=settings.logging_mqtt_batch_size,
+        batch_age_ms=settings.logging_mqtt_batch_age_ms,
+        spool_size=settings.logging_mqtt_spool_size,
+        compress=settings.logging_mqtt_compress)
+    asyncio.create_task(handler.flush_task())
+    getLogger().addHandler(handler)
+    return handler
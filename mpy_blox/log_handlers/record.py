@@ -0,0 +1,252 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from micropython import const
+
+from struct import calcsize, pack, pack_into, unpack_from
+
+from mpy_blox.buffer import PreAllocatedByteRing
+from mpy_blox.log_handlers.formatter import VTSGRColorFormatter
+from mpy_blox.time import isotime_ms, log_base_ms, log_gen
+
+# Log time (ms since the base of its generation), base generation, level,
+# logger name ID, format string ID, arg count
+RECORD_HEADER = '<qBBHHB'
+RECORD_HEADER_SIZE = calcsize(RECORD_HEADER)
+RECORD_IDS = '<HH'
+RECORD_IDS_OFFSET = calcsize('<qBB')
+
+# Self-contained variant: epoch ms, level, value count, followed by the
+# name, format string and args as values. Used for persistence.
+PERSISTED_HEADER = '<QBB'
+PERSISTED_HEADER_SIZE = calcsize(PERSISTED_HEADER)
+
+INLINE_ID = const(0xFFFF)  # Formatted message stored as only arg
+MAX_STRINGS = const(256)
+MAX_STRING_BYTES = const(4096)
+MAX_INTERN_LEN = const(120)
+MAX_STR_LEN = const(512)
+MAX_ARGS = const(253)  # Persisted value count includes name and format
+
+# Value type tags
+ARG_INT = const(0x69)  # b'i'
+ARG_LONG = const(0x71)  # b'q'
+ARG_FLOAT = const(0x64)  # b'd'
+ARG_STR = const(0x73)  # b's'
+
+
+def format_message(msg, args):
+    msg = str(msg)
+    if not args:
+        return msg
+
+    try:
+        return msg % args
+    except (TypeError, ValueError):
+        return msg + ' ' + repr(args)
+
+
+def pack_values(out, values):
+    for value in values:
+        value_type = type(value)
+        if value_type is int and -0x80000000 <= value < 0x80000000:
+            out.append(ARG_INT)
+            out.extend(pack('<i', value))
+        elif value_type is int and -(1 << 63) <= value < (1 << 63):
+            out.append(ARG_LONG)
+            out.extend(pack('<q', value))
+        elif value_type is float:
+            out.append(ARG_FLOAT)
+            out.extend(pack('<d', value))
+        else:
+            # Anything else is stored as what %s would make of it
+            if value_type is not str:
+                value = str(value)
+            encoded = value[:MAX_STR_LEN].encode()
+            out.append(ARG_STR)
+            out.extend(pack('<H', len(encoded)))
+            out.extend(encoded)
+
+
+def unpack_values(data, offset, count):
+    values = []
+    for _ in range(count):
+        value_type = data[offset]
+        offset += 1
+        if value_type == ARG_INT:
+            values.append(unpack_from('<i', data, offset)[0])
+            offset += 4
+        elif value_type == ARG_LONG:
+            values.append(unpack_from('<q', data, offset)[0])
+            offset += 8
+        elif value_type == ARG_FLOAT:
+            values.append(unpack_from('<d', data, offset)[0])
+            offset += 8
+        elif value_type == ARG_STR:
+            str_len = unpack_from('<H', data, offset)[0]
+            offset += 2
+            values.append(str(data[offset:offset + str_len], 'utf-8'))
+            offset += str_len
+        else:
+            raise ValueError("Unknown value type {}".format(value_type))
+
+    return values, offset
+
+
+def frame(data):
+    # Persisted records are prefixed with their total length
+    return pack('<H', len(data) + 2) + data
+
+
+def encode_persisted(timestamp_ms, levelno, name, msg, args=()):
+    if type(msg) is not str or len(args) > MAX_ARGS:
+        msg = format_message(msg, args)
+        args = ()
+
+    data = bytearray(pack(PERSISTED_HEADER, timestamp_ms, levelno,
+                          len(args) + 2))
+    pack_values(data, (name, msg) + args)
+    return data
+
+
+class LogStringTable:
+    """Interns logger names and format strings to compact IDs.
+
+    Logger names are always interned. Format strings only while there's
+    room (max_strings, max_bytes in total), long or unique messages (e.g.
+    with tracebacks) are stored inline.
+    """
+    def __init__(self, max_strings=MAX_STRINGS, max_bytes=MAX_STRING_BYTES):
+        self.max_strings = max_strings
+        self.max_bytes = max_bytes
+        self.strings = []
+        self.ids = {}
+        self.size = 0
+
+    @property
+    def full(self):
+        return (len(self.strings) >= self.max_strings
+                or self.size >= self.max_bytes)
+
+    def intern(self, string, force=False):
+        str_id = self.ids.get(string)
+        if str_id is not None:
+            return str_id
+
+        strings = self.strings
+        if not force and (len(string) > MAX_INTERN_LEN or self.full
+                          or self.size + len(string) > self.max_bytes):
+            return INLINE_ID
+
+        str_id = self.ids[string] = len(strings)
+        strings.append(string)
+        self.size += len(string)
+        return str_id
+
+
+class LogRecordBuffer:
+    """Binary log records in a preallocated ring, rendered when iterated.
+
+    Iterating renders VT100 lines like VTSGRColorFormatter does for live
+    logging. Use records() for the decoded fields instead.
+
+    Once the string table is full, strings no longer referenced are evicted
+    at most once per turnover of the ring.
+    """
+    def __init__(self, size, formatter=None):
+        self.ring = PreAllocatedByteRing(size)
+        self.strings = LogStringTable()
+        self._compacted_at = 0  # Dropped records count at last compaction
+        self.formatter = formatter or VTSGRColorFormatter(replay_mode=True)
+        self.bases = {}  # Base generation -> epoch ms
+        self._base_gen = None
+
+    def __len__(self):
+        return len(self.ring)
+
+    def append(self, log_ms, levelno, name, msg, args=()):
+        """Store a record at log_ms from mpy_blox.time.log_time(), returns
+        its size in the ring (0 if skipped)."""
+        base_gen = log_gen()
+        if base_gen != self._base_gen:
+            self.bases[base_gen] = log_base_ms()
+            self._base_gen = base_gen
+
+        strings = self.strings
+        if strings.full:
+            strings = self._compact()
+
+        fmt_id = INLINE_ID
+        if type(msg) is str and len(args) <= MAX_ARGS:
+            fmt_id = strings.intern(msg)
+        if fmt_id == INLINE_ID:
+            args = (format_message(msg, args),)
+
+        record = bytearray(pack(RECORD_HEADER, log_ms, base_gen, levelno,
+                                strings.intern(name, True), fmt_id,
+                                len(args)))
+        pack_values(record, args)
+
+        ring = self.ring
+        if len(record) + 4 > ring.size:
+            return 0  # Can't ever fit, skip instead of clearing everything
+
+        ring.append(record)
+        return len(record)
+
+    def _compact(self):
+        # Rebuild the string table from the strings records still refer to
+        ring = self.ring
+        if ring.dropped - self._compacted_at < len(ring):
+            return self.strings  # Mostly the same records as last time
+
+        self._compacted_at = ring.dropped
+        old_strings = self.strings.strings
+        self.strings = strings = LogStringTable(self.strings.max_strings,
+                                                self.strings.max_bytes)
+        for record in ring:
+            name_id, fmt_id = unpack_from(RECORD_IDS, record,
+                                          RECORD_IDS_OFFSET)
+            if fmt_id != INLINE_ID:
+                fmt_id = strings.intern(old_strings[fmt_id], True)
+            pack_into(RECORD_IDS, record, RECORD_IDS_OFFSET,
+                      strings.intern(old_strings[name_id], True), fmt_id)
+
+        return strings
+
+    def append_persisted(self, data):
+        timestamp_ms, levelno, value_count = unpack_from(PERSISTED_HEADER,
+                                                         data)
+        values, _ = unpack_values(data, PERSISTED_HEADER_SIZE, value_count)
+        self.append(timestamp_ms - log_base_ms(), levelno, values[0],
+                    values[1], tuple(values[2:]))
+
+    def decode_fields(self, record):
+        """Decode to (timestamp_ms, levelno, name, msg, args)."""
+        log_ms, base_gen, levelno, name_id, fmt_id, arg_count = unpack_from(
+            RECORD_HEADER, record)
+        timestamp_ms = self.bases[base_gen] + log_ms
+        args, _ = unpack_values(record, RECORD_HEADER_SIZE, arg_count)
+        strings = self.strings.strings
+        if fmt_id == INLINE_ID:
+            return timestamp_ms, levelno, strings[name_id], args[0], ()
+        return (timestamp_ms, levelno, strings[name_id], strings[fmt_id],
+                tuple(args))
+
+    def persisted(self, record) -> bytes:
+        """Self-contained encoding of a record, not relying on string IDs."""
+        return encode_persisted(*self.decode_fields(record))
+
+    def records(self):
+        """Yields (timestamp_ms, levelno, name, message) per record."""
+        for record in self.ring:
+            timestamp_ms, levelno, name, msg, args = self.decode_fields(
+                record)
+            yield timestamp_ms, levelno, name, format_message(msg, args)
+
+    def __iter__(self):
+        format_fields = self.formatter.format_fields
+        for timestamp_ms, levelno, name, message in self.records():
+            yield format_fields(isotime_ms(timestamp_ms), levelno, name,
+                                message)
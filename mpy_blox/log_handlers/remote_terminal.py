@@ -2,23 +2,56 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
+from micropython import const
+
 import asyncio
 from logging import Handler, LogRecord, getLogger
 
+from mpy_blox.contextlib import suppress
 from mpy_blox.log_handlers.formatter import (VTSGRColorFormatter,
                                              FG_GREY, RESET,
                                              get_sgr_escape)
+from mpy_blox.metrics import counter
 
 
 logger = getLogger('remote_vt')
 
+DEFAULT_MAX_LINES = const(64)
+RESTART_DELAY_MIN = const(1)
+RESTART_DELAY_MAX = const(60)
+
+lines_dropped = counter('remote_terminal_lines_dropped')
+
+
+def notice_line(text) -> bytes:
+    return get_sgr_escape(FG_GREY) + text + get_sgr_escape(RESET) + b'\n'
+
 
 class RemoteTerminalConnection:
-    def __init__(self, writer, peername):
+    """A remote terminal with its own bounded line queue.
+
+    When the client can't keep up, the oldest lines are dropped and a
+    marker with the dropped count is shown instead.
+    """
+    def __init__(self, writer, peername, max_lines=DEFAULT_MAX_LINES):
         self.writer = writer
         self.broken = False
         self.peername = peername
 
+        self.max_lines = max_lines
+        self.lines = []
+        self.dropped = 0
+        self.lines_ready = asyncio.Event()
+
+    def queue(self, line):
+        lines = self.lines
+        if len(lines) >= self.max_lines:
+            lines.pop(0)
+            self.dropped += 1
+            lines_dropped.inc()
+        lines.append(line)
+        self.lines_ready.set()
+
     async def write(self, data):
         writer = self.writer
         try:
@@ -37,7 +70,7 @@ class RemoteTerminalConnection:
         drain_buffer = b''
         record_count = 0
         for record in replay_buffer:
-            drain_buffer += record + '\n'
+            drain_buffer += record + b'\n'
             record_count += 1
 
             # Drain every 10 lines
@@ -45,53 +78,56 @@ class RemoteTerminalConnection:
                 await self.write(drain_buffer)
                 drain_buffer = b''
 
-        drain_buffer += (get_sgr_escape(FG_GREY)
-                         + b'--- End of log replay ---'
-                         + get_sgr_escape(RESET) + b'\n');
+        drain_buffer += notice_line(b'--- End of log replay ---')
         await self.write(drain_buffer)
 
+    async def drain_task(self):
+        lines_ready = self.lines_ready
+        while not self.broken:
+            await lines_ready.wait()
+            lines_ready.clear()
+
+            lines = self.lines
+            if not lines and not self.dropped:
+                continue
+
+            # Take the queued lines, new ones queue up while writing
+            self.lines = []
+            if self.dropped:
+                lines.insert(0, notice_line(
+                    '--- {} lines dropped ---'.format(self.dropped).encode()))
+                self.dropped = 0
+            await self.write(b''.join(lines))
+
+        with suppress(Exception):
+            self.writer.close()
+
 
 class RemoteTerminalHandler(Handler):
-    def __init__(self, host, port, replay_buffer = None):
+    def __init__(self, host, port, replay_buffer=None,
+                 max_lines=DEFAULT_MAX_LINES):
         super().__init__()
 
         self.host = host
         self.port = port
+        self.max_lines = max_lines
         self.remote_conns = []
-        self.drain_event = asyncio.Event()
-
-        self.buffer = b''
         self.replay_buffer = replay_buffer
 
     def emit(self, record: LogRecord):
-        if not self.remote_conns:
+        remote_conns = self.remote_conns
+        if not remote_conns:
             return  # NO-OP when nobody is connected
 
-        self.buffer += self.formatter.format(record) + b'\n'
-        self.drain_event.set()
-
-    async def drain_buffer_task(self):
-        drain_event = self.drain_event
-        while True:
-            await drain_event.wait()
-            while self.buffer:  # Loop on buffer, cause it could be refilled
-                # Copy buffer and write out
-                send_buf = self.buffer
-                self.buffer = b''
-                await asyncio.gather(*(remote_conn.write(send_buf)
-                                       for remote_conn in self.remote_conns))
-
-                # Remove any broken terminals
-                self.remote_conns = [remote_conn
-                                     for remote_conn in self.remote_conns
-                                     if not remote_conn.broken]
-
-            # Buffer is now empty, reset event
-            drain_event.clear()
+        # Formatted once, each connection drains its own queue
+        line = self.formatter.format(record) + b'\n'
+        for remote_conn in remote_conns:
+            remote_conn.queue(line)
 
     async def handle_new_client(self, _, writer):
         peername = writer.get_extra_info('peername')
-        remote_conn = RemoteTerminalConnection(writer, peername)
+        remote_conn = RemoteTerminalConnection(writer, peername,
+                                               self.max_lines)
         self.remote_conns.append(remote_conn)
 
         if self.replay_buffer:
@@ -99,18 +135,37 @@ class RemoteTerminalHandler(Handler):
 
         # Log after, so remote conn sees connection established
         logger.info("Remote terminal %s connected", peername)
+        await remote_conn.drain_task()
+
+        self.remote_conns.remove(remote_conn)
+        logger.info("Remote terminal %s disconnected", peername)
+
+    async def server_task(self):
+        # Keeps (re)starting the server, e.g. after network outages
+        delay = RESTART_DELAY_MIN
+        while True:
+            try:
+                server = await asyncio.start_server(self.handle_new_client,
+                                                    self.host, self.port)
+                delay = RESTART_DELAY_MIN
+                await server.wait_closed()
+                logger.warning("Remote terminal server stopped")
+            except OSError as e:
+                logger.warning("Remote terminal server failed: %s", e)
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RESTART_DELAY_MAX)
 
     async def serve(self):
-        asyncio.create_task(self.drain_buffer_task())
-        await asyncio.start_server(self.handle_new_client,
-                                   self.host, self.port)
-        # TODO Handle network outages and cleaning/recreating server
+        asyncio.create_task(self.server_task())
 
 
-async def init_remote_terminal(config, replay_buffer):
-    host = config['logging.remote_terminal.listen_host']
-    port = int(config.get('logging.remote_terminal.listen_port', '8023'))
-    handler = RemoteTerminalHandler(host, port, replay_buffer)
+async def init_remote_terminal(settings, replay_buffer):
+    handler = RemoteTerminalHandler(
+        settings.logging_remote_terminal_listen_host,
+        settings.logging_remote_terminal_listen_port,
+        replay_buffer,
+        settings.logging_remote_terminal_max_lines)
     handler.setFormatter(VTSGRColorFormatter())
-    await handler.serve() 
+    await handler.serve()
     getLogger().addHandler(handler)
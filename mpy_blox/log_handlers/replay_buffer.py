@@ -2,103 +2,237 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
+from micropython import const
+
 import asyncio
-from collections import deque
 from logging import Handler, LogRecord, getLogger
 from os import remove
+from struct import pack, unpack, unpack_from
 
 from mpy_blox.contextlib import suppress
-from mpy_blox.log_handlers.formatter import VTSGRColorFormatter
-from mpy_blox.util import rewrite_file
+from mpy_blox.log_handlers.record import (LogRecordBuffer, encode_persisted,
+                                          frame)
+from mpy_blox.time import log_base_ms, log_time
+
 
+SEGMENT_PATH = 'replay.{}.seg'
+LEGACY_LOG_FILE_PATHS = ('replay.log', 'replay.bin')  # Not reloaded
+AVG_RECORD_SIZE = const(48)
+DEFAULT_SEGMENT_SIZE = const(4096)
+DEFAULT_SEGMENT_COUNT = const(4)
+# Persisted records carry their strings, so are larger than ring records
+RELOAD_FACTOR = const(2)
 
-LOG_FILE_PATH = 'replay.log'
-RS = b'\x1E'  # Record seperator control character
+SEGMENT_MAGIC = b'RPLS'
+SEGMENT_HEADER = '<4sI'  # Magic, sequence number
+SEGMENT_HEADER_SIZE = const(8)
 
 
 logger = getLogger('replay_buffer')
 
 
+def iter_frames(data):
+    """Yields framed records, stops at a truncated one (power loss)."""
+    data_len = len(data)
+    offset = SEGMENT_HEADER_SIZE
+    while offset + 2 <= data_len:
+        rec_len = unpack_from('<H', data, offset)[0]
+        if rec_len < 2 or offset + rec_len > data_len:
+            return
+
+        yield data[offset + 2:offset + rec_len]
+        offset += rec_len
+
+
+class LogSegments:
+    """Append-only log spread over a fixed number of rotating segment files.
+
+    Each segment starts with a header holding a sequence number, records are
+    only ever appended. Rolling over starts a new segment in place of the
+    oldest one, so a crash can at most lose that oldest segment.
+    """
+    def __init__(self, segment_size=DEFAULT_SEGMENT_SIZE,
+                 segment_count=DEFAULT_SEGMENT_COUNT):
+        self.segment_size = segment_size
+        self.segment_count = segment_count
+        self.seqs = [None] * segment_count
+        self.slot = 0
+        self.used = None  # Unknown till the newest segment is loaded
+        self._file = None
+
+        for slot in range(segment_count):
+            with suppress(OSError, ValueError):
+                with open(SEGMENT_PATH.format(slot), 'rb') as seg_f:
+                    magic, seq = unpack(SEGMENT_HEADER,
+                                        seg_f.read(SEGMENT_HEADER_SIZE))
+                if magic == SEGMENT_MAGIC:
+                    self.seqs[slot] = seq
+
+    def ordered_slots(self):
+        """Slots holding a valid segment, oldest first."""
+        seqs = self.seqs
+        return sorted((slot for slot in range(self.segment_count)
+                       if seqs[slot] is not None),
+                      key=lambda slot: seqs[slot])
+
+    def load(self, max_bytes):
+        """Yields persisted records of the newest segments, in time order."""
+        slots = self.ordered_slots()
+        read_count = max_bytes // self.segment_size + 1
+        slots = slots[-read_count:]
+        for slot in slots:
+            with suppress(OSError):
+                with open(SEGMENT_PATH.format(slot), 'rb') as seg_f:
+                    data = memoryview(seg_f.read())
+
+                used = SEGMENT_HEADER_SIZE
+                for record in iter_frames(data):
+                    used += len(record) + 2
+                    yield record
+
+                if slot == slots[-1]:
+                    # Continue in the newest segment, unless its tail is torn
+                    self.slot = slot
+                    self.used = used if used == len(data) else None
+
+    def open(self):
+        slots = self.ordered_slots()
+        if slots and self.used is not None and slots[-1] == self.slot:
+            self._file = open(SEGMENT_PATH.format(self.slot), 'ab')
+        else:
+            self.rollover()
+
+    def rollover(self):
+        if self._file:
+            self._file.close()
+
+        seqs = self.seqs
+        last_seq = max((seq for seq in seqs if seq is not None), default=-1)
+        slots = self.ordered_slots()
+        if len(slots) < self.segment_count:
+            # Use a free slot first
+            self.slot = next(slot for slot in range(self.segment_count)
+                             if seqs[slot] is None)
+        else:
+            self.slot = slots[0]  # Replace the oldest segment
+
+        seq = seqs[self.slot] = last_seq + 1
+        self._file = seg_f = open(SEGMENT_PATH.format(self.slot), 'wb')
+        seg_f.write(pack(SEGMENT_HEADER, SEGMENT_MAGIC, seq))
+        seg_f.flush()
+        self.used = SEGMENT_HEADER_SIZE
+
+    @property
+    def full(self):
+        return self.used >= self.segment_size
+
+    def write(self, data):
+        # Roll over here too, records can come in faster than flushes
+        used = self.used
+        if (used > SEGMENT_HEADER_SIZE
+                and used + len(data) > self.segment_size):
+            self.rollover()
+
+        self._file.write(data)
+        self.used += len(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+def remove_segments(segment_count):
+    for slot in range(segment_count):
+        with suppress(OSError):
+            remove(SEGMENT_PATH.format(slot))
+
+
 class ReplayBufferHandler(Handler):
-    def __init__(self, max_records=150, persistence=False):
+    def __init__(self, max_records=150, persistence=False, size=None,
+                 segment_size=DEFAULT_SEGMENT_SIZE,
+                 segment_count=DEFAULT_SEGMENT_COUNT):
         super().__init__()
 
-        self.processed_count = 0
         self.max_records = max_records
-        self.replay_buffer = deque((), max_records)
+        self.size = size or max_records * AVG_RECORD_SIZE
+        self.replay_buffer = LogRecordBuffer(self.size)
+
+        for legacy_path in LEGACY_LOG_FILE_PATHS:
+            with suppress(OSError):
+                remove(legacy_path)
 
         if persistence:
+            self._segments = LogSegments(segment_size, segment_count)
             self.reload_persisted()
-            self._log_file = open(LOG_FILE_PATH, 'ab')
+            self._segments.open()
             self._flush_needed = asyncio.Event()
             asyncio.create_task(self._flush_task())
             logger.info("Persistence activated")
         else:
-            # Clear log file if it exists
-            with suppress(OSError):
-                remove(file_path)
-                logger.info("Removed old persistence file")
-
-            self._log_file = self._flush_needed = None
+            # Clear persisted segments if they exist
+            remove_segments(segment_count)
+            self._segments = self._flush_needed = None
 
     def reload_persisted(self):
         replay_buffer = self.replay_buffer
-        # For some reason missing clear, assume empty.
-        # https://github.com/micropython/micropython/blame/dd23554591ce80e1fcd47551ba6887de79c3034f/py/objdeque.c#L226-L234
-        # replay_buffer.clear()
-        with suppress(OSError):  # NO-OP if file doesn't exist yet
-            with open(LOG_FILE_PATH, 'rb') as f:
-                replay_buffer.extend(
-                    f.read().rsplit(RS, self.max_records)[1:])
+        for record in self._segments.load(self.size * RELOAD_FACTOR):
+            try:
+                replay_buffer.append_persisted(record)
+            except (ValueError, IndexError):
+                pass  # Skip a corrupted record
 
     def rollover_persistence(self):
-        logger.info("Rolling over persistence file")
-        if not self._log_file:
-            return
-
-        self._log_file.close()
-        rewrite_file(LOG_FILE_PATH, RS.join(self.replay_buffer))
-        self._log_file = open(LOG_FILE_PATH, 'ab')
-
-        # Reset processed count till next rollover treshhold
-        self.processed_count = 0
+        logger.info("Rolling over persistence segment")
+        if self._segments:
+            self._segments.rollover()
 
     async def _flush_task(self):
         try:
             flush_needed = self._flush_needed
-            if not flush_needed or not self._log_file:
+            segments = self._segments
+            if not flush_needed or not segments:
                 return
 
             # Naturally flushes batches outside of sync code when signalled
             while True:
                 await flush_needed.wait()
-                if self.processed_count > self.max_records * 3:
+                segments.flush()
+                if segments.full:
                     self.rollover_persistence()
-                else:
-                    self._log_file.flush()
                 flush_needed.clear()
         except Exception as e:
             logger.error("Persistence task died", exc_info=e)
 
     def emit(self, record: LogRecord):
-        log_file = self._log_file
+        log_ms = log_time()
+        levelno = record.levelno
+        name = record.name
+        msg = record.msg
+        args = record.args
+        self.replay_buffer.append(log_ms, levelno, name, msg, args)
+
+        segments = self._segments
         flush_needed = self._flush_needed
-        record = self.formatter.format(record)
-        if log_file and flush_needed:
-            log_file.write(record + RS)
-            self.processed_count += 1
+        if segments and flush_needed:
+            # Persisted records outlive the base, so store the epoch ms
+            segments.write(frame(encode_persisted(log_base_ms() + log_ms,
+                                                  levelno, name, msg, args)))
 
             # Signals a flush is needed, don't do it now
             flush_needed.set()
 
-        self.replay_buffer.append(record)
-
 
-def init_replay_buffer(config) -> deque:
-    max_records = config.get('logging.replay_buffer.max_records', 150)
-    persistence = config.get('logging.replay_buffer.persistence', False)
-    handler = ReplayBufferHandler(max_records, persistence)
-    handler.setFormatter(VTSGRColorFormatter(replay_mode=True))
+def init_replay_buffer(settings) -> LogRecordBuffer:
+    handler = ReplayBufferHandler(
+        settings.logging_replay_buffer_max_records,
+        settings.logging_replay_buffer_persistence,
+        settings.logging_replay_buffer_size,
+        settings.logging_replay_buffer_segment_size,
+        settings.logging_replay_buffer_segments)
     getLogger().addHandler(handler)
 
     return handler.replay_buffer
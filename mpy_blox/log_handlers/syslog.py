@@ -2,11 +2,17 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
+from micropython import const
+
+import asyncio
 import usocket
+from utime import ticks_diff, ticks_ms
 
 from logging import ERROR, INFO, Handler, getLogger
 
 from mpy_blox.contextlib import suppress
+from mpy_blox.metrics import counter
+from mpy_blox.time import isotime
 
 LOG_USER = 1
 
@@ -18,66 +24,231 @@ LOG_PRIORITIES = {
     "WARNING":  4,
     }
 
+APP_NAME = b'mpy-blox'
+MTU_PAYLOAD = const(1400)  # Keep datagrams/segments below a typical MTU
+DEFAULT_QUEUE_SIZE = const(32)
+DEFAULT_RATE = const(20)  # Records per second
+RECONNECT_DELAY_MIN = const(1)
+RECONNECT_DELAY_MAX = const(60)
+
+msgs_sent = counter('syslog_msgs_sent')
+msgs_dropped = counter('syslog_msgs_dropped')
+
+
 class SyslogHandler(Handler):
-    def __init__(self, hostname, syslog_level=ERROR, split_lines=True):
+    """Queues RFC 5424 messages, sent in batches by a separate task.
+
+    A full queue drops the oldest messages, sending is limited to rate
+    messages per second. Dropped messages are reported once sending
+    catches up again.
+
+    UDP sends a datagram per message (RFC 5426), a batch is sent in one go.
+    TCP uses octet counting framing (RFC 6587) over a stream, reconnecting
+    with a capped backoff while the queue keeps messages (or drops them).
+    """
+    def __init__(self, hostname, syslog_level=ERROR, split_lines=True,
+                 port=514, protocol='udp', local_hostname=None,
+                 queue_size=DEFAULT_QUEUE_SIZE, rate=DEFAULT_RATE):
         super().__init__()
         self.split_lines = split_lines
         self.hostname = hostname
+        self.port = port
         self.lvl = syslog_level
+        self.local_hostname = (local_hostname or '-').encode()
+        self.tcp = protocol == 'tcp'
+        self.rate = rate
+
+        self.queue_size = queue_size
+        self.queue = []  # Small, pop(0) is fine and works on any port
+        self.dropped = 0
+        self.send_needed = asyncio.Event()
+
+        self.sock = self.sock_addr = None
+        self.writer = None
+        self.reconnect_delay = RECONNECT_DELAY_MIN
+        if not self.tcp:
+            try:
+                addr = usocket.getaddrinfo(hostname, port, 0,
+                                           usocket.SOCK_DGRAM)[0]
+            except IndexError:
+                raise RuntimeError("Can't find host {}".format(hostname))
 
-        try:
-            addr = usocket.getaddrinfo(hostname, 514, 0, usocket.SOCK_DGRAM)[0]
-        except IndexError:
-            raise RuntimeError("Can't find host {}".format(hostname))
-
-        self.sock = usocket.socket(addr[0], usocket.SOCK_DGRAM, addr[2]) 
-        self.sock_addr = addr[-1]
+            self.sock = usocket.socket(addr[0], usocket.SOCK_DGRAM, addr[2])
+            self.sock_addr = addr[-1]
 
     def __str__(self):
         return "<{} hostname={}>".format(self.__class__.__name__,
                                          self.hostname)
-    
+
+    def format_header(self, prio, msg_id) -> bytes:
+        # <PRI>VERSION TIMESTAMP HOSTNAME APP-NAME PROCID MSGID SD
+        return b' '.join((
+            b'<' + str(prio).encode() + b'>1',
+            isotime().encode(),
+            self.local_hostname,
+            APP_NAME,
+            b'-',
+            msg_id.encode()[:32] or b'-',
+            b'- '
+        ))
+
     def format_syslog(self, record):
-        prio = (LOG_USER << 3) | LOG_PRIORITIES[record.levelname]
-        sl_prio = "<{}>".format(prio).encode('utf-8')
+        prio = (LOG_USER << 3) | LOG_PRIORITIES.get(record.levelname, 2)
+        header = self.format_header(prio, record.name)
 
         msg = self.formatter.format(record)
         if not self.split_lines:
-            return (sl_prio + msg.encode('utf-8'),)
+            return (header + msg.encode('utf-8'),)
 
         try:
             lines = msg.splitlines()
         except AttributeError:
             lines = msg.split('\n', -1)
 
-        return [sl_prio + line.encode('utf-8') for line in lines]
+        return [header + line.encode('utf-8') for line in lines]
+
+    def enqueue(self, syslog_msg):
+        queue = self.queue
+        if len(queue) >= self.queue_size:
+            queue.pop(0)
+            self.dropped += 1
+            msgs_dropped.inc()
+        queue.append(syslog_msg)
 
     def emit(self, record):
         if record.levelno < self.lvl:
             return
 
-        sock_addr = self.sock_addr
-        for msg in self.format_syslog(record):
-            try:
-                self.sock.sendto(msg, sock_addr)
-            except OSError:
-                print("{}: Unable to send".format(self))
-
+        # Never send from the logging call, the send task does that
+        for syslog_msg in self.format_syslog(record):
+            self.enqueue(syslog_msg)
+        self.send_needed.set()
+
+    def dropped_msg(self):
+        dropped = self.dropped
+        self.dropped = 0
+        prio = (LOG_USER << 3) | LOG_PRIORITIES['WARNING']
+        return (self.format_header(prio, 'syslog')
+                + "{} messages dropped".format(dropped).encode())
+
+    def next_batch(self, max_count):
+        """Take up to max_count messages from the queue, framed to send.
+
+        TCP batches are kept below the MTU.
+        """
+        queue = self.queue
+        batch = []
+        batch_len = 0
+        while queue and len(batch) < max_count:
+            syslog_msg = queue[0]
+            if self.tcp:
+                # Octet counting: MSG-LEN SP SYSLOG-MSG
+                syslog_msg = str(len(syslog_msg)).encode() + b' ' + syslog_msg
+                if batch and batch_len + len(syslog_msg) > MTU_PAYLOAD:
+                    break
+
+            queue.pop(0)
+            batch.append(syslog_msg)
+            batch_len += len(syslog_msg)
+
+        return batch
+
+    async def connect(self):
+        """Single connection attempt, backing off after a failure."""
+        try:
+            _, self.writer = await asyncio.open_connection(self.hostname,
+                                                           self.port)
+            self.reconnect_delay = RECONNECT_DELAY_MIN
+            return True
+        except OSError:
+            await asyncio.sleep(self.reconnect_delay)
+            self.reconnect_delay = min(self.reconnect_delay * 2,
+                                       RECONNECT_DELAY_MAX)
+            return False
+
+    async def send(self, batch):
+        if not self.tcp:
+            sock = self.sock
+            sock_addr = self.sock_addr
+            for syslog_msg in batch:
+                sock.sendto(syslog_msg, sock_addr)
+            return
 
-def init_syslog(config):
-    with suppress(KeyError):
-        syslog_host = config['logging.syslog.hostname']
         try:
-            syslog_level = int(config['logging.syslog.level'])
-        except KeyError:
-            syslog_level = ERROR
-        getLogger().addHandler(SyslogHandler(syslog_host, syslog_level))
+            self.writer.write(b''.join(batch))
+            await self.writer.drain()
+        except OSError:
+            with suppress(OSError):
+                self.writer.close()
+            self.writer = None
+            raise
+
+    async def send_task(self):
+        send_needed = self.send_needed
+        window_start = ticks_ms()
+        window_count = 0
+        while True:
+            await send_needed.wait()
+            send_needed.clear()
+
+            while self.queue or self.dropped:
+                if self.tcp and not self.writer:
+                    # Meanwhile the queue drops (and counts) the oldest
+                    if not await self.connect():
+                        continue
+
+                if ticks_diff(ticks_ms(), window_start) >= 1000:
+                    window_start = ticks_ms()
+                    window_count = 0
+
+                allowed = self.rate - window_count
+                if allowed <= 0:
+                    # Rate limited, wait for the next window
+                    await asyncio.sleep_ms(
+                        1000 - ticks_diff(ticks_ms(), window_start))
+                    continue
+
+                if self.dropped and len(self.queue) < self.queue_size:
+                    self.queue.insert(0, self.dropped_msg())
+
+                batch = self.next_batch(allowed)
+                msg_count = len(batch)
+                window_count += msg_count
+                try:
+                    await self.send(batch)
+                    msgs_sent.inc(msg_count)
+                except OSError:
+                    # Counted as dropped, reported with the next send
+                    self.dropped += msg_count
+                    msgs_dropped.inc(msg_count)
+                    break
+
+
+def init_syslog(settings):
+    handler = SyslogHandler(
+        settings.logging_syslog_hostname,
+        settings.logging_syslog_level,
+        port=settings.logging_syslog_port,
+        protocol=settings.logging_syslog_protocol,
+        local_hostname=settings.hostname,
+        queue_size=settings.logging_syslog_queue_size,
+        rate=settings.logging_syslog_rate)
+    asyncio.create_task(handler.send_task())
+    getLogger().addHandler(handler)
 
 
 def main():
     import logging
-    logging.getLogger().addHandler(SyslogHandler('172.16.3.1', INFO))
+    handler = SyslogHandler('172.16.3.1', INFO)
+    logging.getLogger().addHandler(handler)
     logging.info("Test from MicroPython SyslogHandler")
 
+    async def send():
+        task = asyncio.create_task(handler.send_task())
+        await asyncio.sleep(1)
+        task.cancel()
+
+    asyncio.run(send())
+
 if __name__ == '__main__':
     main()
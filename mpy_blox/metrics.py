@@ -0,0 +1,234 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from micropython import const
+
+import asyncio
+from array import array
+from gc import mem_free
+from logging import ERROR, Handler, getLogger
+from utime import ticks_diff, ticks_ms
+
+
+logger = getLogger('system')
+
+MAX_COUNTERS = const(48)
+LOOP_LAG_INTERVAL_MS = const(1000)
+METRICS_TOPIC_FORMAT = 'mpypi/nodes/{}/metrics'
+HASS_CONFIG_FORMAT = '{}/sensor/{}-{}/config'
+
+# All counters live in one preallocated array, inc() only touches an item
+_counts = array('I', bytes(4 * MAX_COUNTERS))
+_counter_count = 0
+_metrics = {}
+
+
+class Counter:
+    def __init__(self, name):
+        global _counter_count
+        if _counter_count >= MAX_COUNTERS:
+            raise ValueError("Too many counters")
+        self.name = name
+        self.index = _counter_count
+        _counter_count += 1
+
+    def inc(self, n=1):
+        _counts[self.index] += n
+
+    @property
+    def value(self):
+        return _counts[self.index]
+
+
+class Gauge:
+    def __init__(self, name):
+        self.name = name
+        self.value = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_min(self, value):
+        """Keep the lowest value seen, e.g. a low-water mark."""
+        current = self.value
+        if current is None or value < current:
+            self.value = value
+
+
+class Histogram:
+    """Fixed buckets: counts[i] counts values <= bounds[i], the last one
+    everything above the highest bound."""
+    def __init__(self, name, bounds):
+        self.name = name
+        self.bounds = bounds
+        self.counts = array('I', bytes(4 * (len(bounds) + 1)))
+        self.total = 0
+
+    def observe(self, value):
+        self.total += value
+        i = 0
+        for bound in self.bounds:
+            if value <= bound:
+                break
+            i += 1
+        self.counts[i] += 1
+
+    @property
+    def value(self):
+        counts = self.counts
+        return {
+            'le': list(self.bounds),
+            'counts': list(counts),
+            'count': sum(counts),
+            'sum': self.total
+        }
+
+
+def _register(cls, name, *args):
+    metric = _metrics.get(name)
+    if metric is None:
+        metric = _metrics[name] = cls(name, *args)
+    return metric
+
+
+def counter(name) -> Counter:
+    return _register(Counter, name)
+
+
+def gauge(name) -> Gauge:
+    return _register(Gauge, name)
+
+
+def histogram(name, bounds) -> Histogram:
+    return _register(Histogram, name, bounds)
+
+
+def snapshot():
+    return {name: metric.value for name, metric in _metrics.items()}
+
+
+# Timing buckets shared by the latency histograms (ms)
+LATENCY_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000)
+
+heap_free = gauge('heap_free')
+heap_low_water = gauge('heap_low_water')
+loop_lag = histogram('loop_lag_ms', LATENCY_BUCKETS_MS)
+log_records = counter('log_records')
+log_errors = counter('log_errors')
+
+
+class LogMetricsHandler(Handler):
+    """Counts every log record, and those at ERROR or above."""
+    def emit(self, record):
+        log_records.inc()
+        if record.levelno >= ERROR:
+            log_errors.inc()
+
+
+async def loop_lag_task(interval_ms=LOOP_LAG_INTERVAL_MS):
+    """Measures how late the event loop wakes us, samples the heap too."""
+    while True:
+        start = ticks_ms()
+        await asyncio.sleep_ms(interval_ms)
+        loop_lag.observe(ticks_diff(ticks_ms(), start) - interval_ms)
+
+        free = mem_free()
+        heap_free.set(free)
+        heap_low_water.set_min(free)
+
+
+class MetricsPublisher:
+    """Publishes a metrics snapshot every interval_s on
+    mpypi/nodes/<id>/metrics, counters also as a per second rate.
+
+    With hass, Home Assistant diagnostic sensors are announced for all
+    counters and gauges, grouped under the node's device.
+    """
+    def __init__(self, mqtt_conn, interval_s=60, hass=False,
+                 discovery_prefix='homeassistant'):
+        self.mqtt_conn = mqtt_conn
+        self.interval_s = interval_s
+        self.hass = hass
+        self.discovery_prefix = discovery_prefix
+        self.last_counts = None
+        self.last_ticks = None
+
+    @property
+    def topic(self):
+        return METRICS_TOPIC_FORMAT.format(self.mqtt_conn.client_id)
+
+    def payload(self):
+        values = snapshot()
+        now = ticks_ms()
+        last_counts = self.last_counts
+        elapsed_ms = last_counts and ticks_diff(now, self.last_ticks)
+        for name, metric in _metrics.items():
+            if isinstance(metric, Counter):
+                # Same fields every time, the first rate is just 0
+                rate = 0
+                if elapsed_ms:
+                    delta = metric.value - last_counts.get(name, 0)
+                    rate = round(delta * 1000 / elapsed_ms, 2)
+                values[name + '_rate'] = rate
+
+        self.last_counts = {name: metric.value
+                            for name, metric in _metrics.items()
+                            if isinstance(metric, Counter)}
+        self.last_ticks = now
+        return values
+
+    async def publish_hass_configs(self):
+        from mpy_blox.mqtt.protocol.message import MQTTMessage
+        client_id = self.mqtt_conn.client_id
+        for name, metric in _metrics.items():
+            if isinstance(metric, Histogram):
+                continue  # Not a single value
+
+            names = [name]
+            if isinstance(metric, Counter):
+                names.append(name + '_rate')
+
+            for sensor_name in names:
+                await self.mqtt_conn.publish(MQTTMessage(
+                    HASS_CONFIG_FORMAT.format(self.discovery_prefix,
+                                              client_id, sensor_name),
+                    {
+                        'name': sensor_name.replace('_', ' '),
+                        'unique_id': '{}-{}'.format(client_id, sensor_name),
+                        'state_topic': self.topic,
+                        'value_template':
+                            "{{ value_json." + sensor_name + " }}",
+                        'entity_category': 'diagnostic',
+                        'device': {'identifiers': [client_id]}
+                    },
+                    retain=True))
+
+    async def publish_task(self):
+        # Imported late, the MQTT client imports this module for its metrics
+        from mpy_blox.mqtt.protocol.message import MQTTMessage
+        if self.hass:
+            await self.publish_hass_configs()
+
+        while True:
+            await asyncio.sleep(self.interval_s)
+            if self.mqtt_conn.receive_task is None:
+                continue  # Not connected, rates just span longer
+
+            try:
+                await self.mqtt_conn.publish(
+                    MQTTMessage(self.topic, self.payload()))
+            except OSError as e:
+                logger.warning("Failed to publish metrics: %s", e)
+
+
+def init_metrics():
+    asyncio.create_task(loop_lag_task())
+    getLogger().addHandler(LogMetricsHandler())
+
+
+def init_metrics_publisher(settings, mqtt_conn):
+    publisher = MetricsPublisher(mqtt_conn, settings.metrics_interval,
+                                 settings.metrics_hass)
+    asyncio.create_task(publisher.publish_task())
+    return publisher
@@ -10,12 +10,17 @@ from os import uname
 from binascii import hexlify
 
 from mpy_blox.config import config
+from mpy_blox.metrics import counter
 from mpy_blox.mqtt.protocol.client import MQTT5Client
 from mpy_blox.mqtt.protocol.message import MQTTMessage
 
 
 logger = getLogger('mqtt')
 
+connects = counter('mqtt_connects')
+msgs_handled = counter('mqtt_msgs_handled')
+handler_errors = counter('mqtt_handler_errors')
+
 
 class MQTTConnectionManager:
     _connections = {}
@@ -52,6 +57,14 @@ class MQTTConnectionManager:
 
         return _connections[name]
 
+    @classmethod
+    async def disconnect_all(cls):
+        for mqtt_conn in cls._connections.values():
+            try:
+                await mqtt_conn.disconnect()
+            except Exception as e:
+                logger.warning("%s disconnect failed", mqtt_conn, exc_info=e)
+
     def __str__(self):
         return '<MQTTConnectionManager {}>'.format(self.name)
 
@@ -98,7 +111,9 @@ class MQTTConnectionManager:
             async def handle_message(msg, consumer):
                 try:
                     await consumer.handle_msg(msg)
+                    msgs_handled.inc()
                 except Exception as e:
+                    handler_errors.inc()
                     logger.exception(
                         "Processing MQTT message %s to consumer %s failed",
                         msg, consumer, exc_info=e)
@@ -110,6 +125,7 @@ class MQTTConnectionManager:
 
     async def connect(self):
         await self.mqtt_client.connect()
+        connects.inc()
         logger.info("%s Connected", self)
         self.receive_task = asyncio.create_task(self.receive_loop())
         asyncio.create_task(self._delay_wdt_start())
@@ -2,15 +2,19 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
+from micropython import const
+
 import asyncio as asyncio
+import json
 from os import uname
 from logging import getLogger
 from machine import unique_id
-from binascii import hexlify
+from binascii import crc32, hexlify
 
 from mpy_blox.config import config
 from mpy_blox.mqtt import MQTTConsumer
 from mpy_blox.mqtt.protocol.message import MQTTMessage
+from mpy_blox.rtc_state import rtc_state
 from mpy_blox.wheel import pkg_info
 
 
@@ -108,19 +112,30 @@ class MQTTDiscoverable(MQTTConsumer):
     def app_disco_config(self):
         return {}
 
-    async def publish_config(self):
+    async def publish_config(self, force=True):
         topic = '{}/config'.format(self.topic_prefix)
-        logger.info('Sending %s discoverability config to %s',
-                    self.__class__.__name__, topic)
-
         disco_config = self.app_disco_config
         disco_config.update(self.core_disco_config)
+
+        # Retained, so after waking up only changed configs are needed
+        disco_hashes = rtc_state.section('disco')
+        disco_hash = crc32(json.dumps(disco_config).encode())
+        if not force and disco_hashes.get(topic) == disco_hash:
+            logger.debug('Discoverability config %s unchanged', topic)
+            return
+
+        logger.info('Sending %s discoverability config to %s',
+                    self.__class__.__name__, topic)
         await self.mqtt_conn.publish(MQTTMessage(topic, disco_config,
                                                  retain=True))
+        disco_hashes[topic] = disco_hash
+        rtc_state.save()
 
     async def disco_loop(self):
+        force = False
         while True:
-            await self.publish_config()
+            await self.publish_config(force)
+            force = True
             await asyncio.sleep(DISCO_TIME)
 
     async def listen(self):
@@ -8,8 +8,10 @@ import asyncio
 import logging
 from asyncio import TimeoutError, wait_for
 from collections import deque
+from utime import ticks_diff, ticks_us
 
 from mpy_blox.future import Future
+from mpy_blox.metrics import LATENCY_BUCKETS_MS, counter, histogram
 from mpy_blox.mqtt.protocol import (decode_VBI,
                                     decode_control_packet_type,
                                     encode_control_packet_fixed_header,
@@ -29,6 +31,12 @@ logger = logging.getLogger('mqtt_proto')
 MAX_MSGS_WAITING = const(10)
 SYSTEM_ACK_TIMEOUT = const(10)
 
+msgs_out = counter('mqtt_msgs_out')
+bytes_out = counter('mqtt_bytes_out')
+msgs_in = counter('mqtt_msgs_in')
+msgs_dropped = counter('mqtt_msgs_dropped')
+publish_ms = histogram('mqtt_publish_ms', LATENCY_BUCKETS_MS)
+
 
 class MQTT5Client:
     def __init__(self, server, port, client_id,
@@ -98,11 +106,11 @@ class MQTT5Client:
 
             write(encode_control_packet_fixed_header(PINGREQ, 0))
             await drain()
-            logger.info("PINGREQ send")
+            logger.debug("PINGREQ send")
             
             try:
                 await wait_for(ping_wait(), SYSTEM_ACK_TIMEOUT)
-                logger.info("Received PINGRESP")
+                logger.debug("Received PINGRESP")
                 ping_attempt = 0
                 if self.on_pong:
                     self.on_pong()
@@ -317,18 +325,28 @@ class MQTT5Client:
     async def publish(self, msg: MQTTMessage):
         _, writer = self.connection
 
-        logger.info("Publishing %s", msg)
-        writer.write(msg.to_packed())
+        logger.debug("Publishing %s", msg)
+        start = ticks_us()
+        packed = msg.to_packed()
+        writer.write(packed)
         await writer.drain()
 
+        publish_ms.observe(ticks_diff(ticks_us(), start) // 1000)
+        msgs_out.inc()
+        bytes_out.inc(len(packed))
+
         # TODO Non-QOS 0
 
     def _publish_received(self, header, publish_data):
         # Decode msg using MQTTMessage class and let it await processing
         msg = MQTTMessage.from_packed(header, publish_data)
-        logger.info("Received message %s", msg)
+        logger.debug("Received message %s", msg)
+        msgs_in.inc()
 
-        self.msg_deque.appendleft(msg)
+        msg_deque = self.msg_deque
+        if len(msg_deque) >= MAX_MSGS_WAITING:
+            msgs_dropped.inc()  # The deque drops the oldest
+        msg_deque.appendleft(msg)
         self.msg_available.set()
 
     def consume(self):
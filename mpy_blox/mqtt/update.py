@@ -2,17 +2,24 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
+from micropython import const
+
 import asyncio
+import gc
+import json
 from binascii import hexlify
 from hashlib import sha256
 from io import BytesIO
 from logging import getLogger
-from machine import reset
-from os import remove, uname
+from machine import reset, reset_cause
+from os import remove, stat, uname
+from utime import ticks_diff, ticks_ms
 
 
 import mpy_blox.wheel as wheel
+from mpy_blox.boot_timeline import boot_timeline
 from mpy_blox.contextlib import suppress
+from mpy_blox.metrics import counter
 from mpy_blox.mqtt import MQTTConsumer
 from mpy_blox.mqtt.protocol.message import MQTTMessage
 from mpy_blox.wheel.wheelfile import WheelFile
@@ -26,6 +33,86 @@ CHANNEL_PREFIX = PREFIX + 'channels/'
 PACKAGES_PREFIX = PREFIX + 'packages/'
 PRIVATE_PREFIX = PREFIX + 'nodes/'
 
+SRC_HASH_CACHE_PATH = '/.src_hash_cache.json'
+UPDATE_MARKER_PATH = '/.update_pending.json'
+HASH_BUF_SIZE = const(512)
+PROGRESS_INTERVAL_MS = const(1000)
+
+update_lists = counter('update_lists')
+pkgs_installed = counter('update_pkgs_installed')
+update_failures = counter('update_failures')
+
+
+def hash_file(path, buf):
+    # Stream through a fixed buffer instead of reading the file in full
+    mv = memoryview(buf)
+    hasher = sha256()
+    with open(path, 'rb') as src_f:
+        while True:
+            read_len = src_f.readinto(mv)
+            if not read_len:
+                break
+
+            hasher.update(mv[:read_len])
+
+    return hexlify(hasher.digest()).decode()
+
+
+def installed_versions():
+    return {
+        pkg.name: pkg.version
+        for pkg in wheel.list_installed()
+    }
+
+
+class SrcHashCache:
+    """Persistent (size, mtime, sha256) cache of tracked source files.
+
+    Files are only hashed again when their size or mtime changed. Without
+    mtime support from the filesystem (mtime 0) the cache is bypassed.
+    """
+    def __init__(self, path=SRC_HASH_CACHE_PATH):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        self._buf = None
+
+        with suppress(OSError, ValueError):
+            with open(path, 'r') as cache_f:
+                self.entries = json.load(cache_f)
+
+    def sha256(self, path):
+        try:
+            file_stat = stat(path)
+        except OSError:
+            return None  # Missing file
+
+        size = file_stat[6]
+        mtime = file_stat[8]
+        entry = self.entries.get(path)
+        if mtime and entry and entry[0] == size and entry[1] == mtime:
+            return entry[2]
+
+        buf = self._buf
+        if buf is None:
+            buf = self._buf = bytearray(HASH_BUF_SIZE)
+
+        checksum = hash_file(path, buf)
+        self.update(path, checksum, file_stat)
+        return checksum
+
+    def update(self, path, checksum, file_stat=None):
+        file_stat = file_stat or stat(path)
+        self.entries[path] = [file_stat[6], file_stat[8], checksum]
+        self.dirty = True
+
+    def commit(self):
+        if not self.dirty:
+            return
+
+        rewrite_file(self.path, json.dumps(self.entries).encode())
+        self.dirty = False
+
 
 class MQTTUpdateChannel(MQTTConsumer):
     def __init__(self, channel, auto_update, mqtt_connection):
@@ -34,8 +121,11 @@ class MQTTUpdateChannel(MQTTConsumer):
         self.auto_update = auto_update
 
         self.waiting_pkgs = set()
+        self.expected_versions = {}
         self.update_done = asyncio.Event()
         self.pkgs_installed = False 
+        self.src_hash_cache = SrcHashCache()
+        self.progress_ticks = None
 
     @property
     def channel_topic(self):
@@ -53,6 +143,14 @@ class MQTTUpdateChannel(MQTTConsumer):
     def cmd_topic(self):
         return self.private_base + 'cmd'
 
+    @property
+    def progress_topic(self):
+        return self.private_base + 'progress'
+
+    @property
+    def health_topic(self):
+        return self.private_base + 'health'
+
     @property
     def update_available(self):
         return bool(self.waiting_pkgs)
@@ -62,27 +160,31 @@ class MQTTUpdateChannel(MQTTConsumer):
         logger.info("Registering as node %s with update channel: %s",
                      mqtt_conn.client_id, self.channel)
 
+        await self.publish_info()
+        await self.report_health()
+
+        # Subscribe to our private cmd topic + channel topic for updates
+        await self.subscribe(self.cmd_topic)
+        await self.subscribe(self.channel_topic)
+
+    async def publish_info(self):
+        # Republished once booted, to include the complete boot timeline
         unix_name = uname()
         await self.mqtt_conn.publish(
             MQTTMessage(self.info_topic,
                         {
+                            'channel': self.channel,
                             'uname': {
                                 'sysname': unix_name.sysname,
                                 'machine': unix_name.machine,
                                 'version': unix_name.version
                             },
-                            'versions': {
-                                wheel.name: wheel.version
-                                for wheel in wheel.list_installed()
-                            }
+                            'versions': installed_versions(),
+                            'boot': boot_timeline.as_dict()
                         },
                         retain=True)
         )
 
-        # Subscribe to our private cmd topic + channel topic for updates
-        await self.subscribe(self.cmd_topic)
-        await self.subscribe(self.channel_topic)
-
     async def handle_msg(self, msg):
         topic = msg.topic
         if topic in (self.channel_topic, self.cmd_topic):
@@ -94,7 +196,9 @@ class MQTTUpdateChannel(MQTTConsumer):
 
     async def handle_update_list_msg(self, msg, is_commanded):
         logger.info("Received update list from channel: %s", msg.topic)
+        update_lists.inc()
         self.waiting_pkgs.clear()
+        self.expected_versions.clear()
         for entry in msg.payload:
             update_type = entry['type']
             if update_type == 'wheel':
@@ -103,6 +207,7 @@ class MQTTUpdateChannel(MQTTConsumer):
                 self.check_src_update(entry)
             else:
                 logger.warning("Skipping unknown update type %s", update_type)
+        self.src_hash_cache.commit()
 
         if self.update_available:
             auto_update = self.auto_update
@@ -127,17 +232,16 @@ class MQTTUpdateChannel(MQTTConsumer):
 
         # Package needs installation/update
         logger.info("Update available: %s %s -> %s",
-                     name, installed_pkg.version, version)
+                    name, installed_pkg and installed_pkg.version, version)
         self.waiting_pkgs.add('wheel/' + entry['pkg_sha256'])
+        self.expected_versions[name] = version
 
     def check_src_update(self, entry):
         path = entry['path']
         pkg_sha256 = entry['pkg_sha256']
         with suppress(OSError):
-            with open(path, 'rb') as current_src_f:
-                checksum = hexlify(sha256(current_src_f.read()).digest())
-                if checksum == pkg_sha256.encode():
-                    return  # Skip unchanged source
+            if self.src_hash_cache.sha256('/' + path) == pkg_sha256:
+                return  # Skip unchanged source
 
         # Source file needs installation/update
         logger.info("Update available for source file: %s", path)
@@ -159,33 +263,104 @@ class MQTTUpdateChannel(MQTTConsumer):
         if pkg_type == 'src':
             self.handle_src_msg(msg, pkg_id)
         elif pkg_type == 'wheel':
-            self.handle_wheel_msg(msg)
+            await self.handle_wheel_msg(msg)
         else:
             logger.warning("Skipping unknown pkg_type")
             return
 
         self.pkgs_installed = True
+        pkgs_installed.inc()
         if not self.waiting_pkgs:
+            self.mark_update_pending()
             self.update_done.set()
 
+    def mark_update_pending(self):
+        # Checked after the reboot to report whether the update took
+        rewrite_file(UPDATE_MARKER_PATH,
+                     json.dumps({'expected': self.expected_versions}).encode())
+
+    async def report_health(self):
+        try:
+            with open(UPDATE_MARKER_PATH, 'r') as marker_f:
+                expected = json.load(marker_f)['expected']
+        except (OSError, ValueError, KeyError):
+            return  # Not booting from an update
+
+        versions = installed_versions()
+        healthy = all(versions.get(name) == version
+                      for name, version in expected.items())
+        if healthy:
+            logger.info("Update applied successfully")
+        else:
+            update_failures.inc()
+            logger.error("Update incomplete, expected %s", expected)
+
+        await self.mqtt_conn.publish(
+            MQTTMessage(self.health_topic,
+                        {
+                            'status': 'ok' if healthy else 'version_mismatch',
+                            'expected': expected,
+                            'versions': versions,
+                            'reset_cause': reset_cause(),
+                            'mem_free': gc.mem_free()
+                        },
+                        retain=True)
+        )
+        remove(UPDATE_MARKER_PATH)
+
     def handle_src_msg(self, msg, pkg_id):
         pkg_path = '/' + pkg_id.rsplit('/', 1)[0]
         logger.info("Processing src pkg %s", pkg_path)
 
-        rewrite_file(pkg_path, msg.raw_payload)
+        raw_payload = msg.raw_payload
+        rewrite_file(pkg_path, raw_payload)
+
+        src_hash_cache = self.src_hash_cache
+        src_hash_cache.update(pkg_path,
+                              hexlify(sha256(raw_payload).digest()).decode())
+        src_hash_cache.commit()
+
+    async def report_progress(self, pkg_name, done, total, name):
+        logger.debug("Installed %s/%s of %s: %s", done, total, pkg_name, name)
 
-    def handle_wheel_msg(self, msg):
+        # Published inline at most every interval, the first and last always
+        now = ticks_ms()
+        last = self.progress_ticks
+        if (done not in (1, total) and last is not None
+                and ticks_diff(now, last) < PROGRESS_INTERVAL_MS):
+            return
+        self.progress_ticks = now
+
+        await self.mqtt_conn.publish(
+            MQTTMessage(self.progress_topic,
+                        {
+                            'pkg': pkg_name,
+                            'done': done,
+                            'total': total
+                        }))
+
+    async def handle_wheel_msg(self, msg):
         wheel_file = WheelFile(BytesIO(msg.raw_payload))
-        logger.info("Processing wheel pkg %s", wheel_file.pkg_name)
+        pkg_name = wheel_file.pkg_name
+        logger.info("Processing wheel pkg %s", pkg_name)
+
+        async def progress_cb(done, total, name):
+            try:
+                await self.report_progress(pkg_name, done, total, name)
+            except OSError as e:
+                # Progress is informative, the install has to go on
+                logger.warning("Failed to publish progress: %s", e)
 
+        # Installation yields to the loop, keeping MQTT pings and WDT alive
         try:
-            wheel.install(wheel_file)
+            await wheel.install_async(wheel_file, progress_cb=progress_cb)
         except wheel.WheelExistingInstallation as ex_install_exc:
             logger.info("Force upgrading existing installation "
                          "{} -> {}".format(
                              ex_install_exc.existing_pkg.version,
                              wheel_file.package.version))
-            wheel.upgrade(ex_install_exc.existing_pkg, wheel_file)
+            await wheel.upgrade_async(ex_install_exc.existing_pkg, wheel_file,
+                                      progress_cb=progress_cb)
 
     async def perform_update(self):
         self.update_done.clear()
@@ -2,52 +2,206 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
+from micropython import const
+
+import asyncio
+import json
 import logging
 import network
-from utime import sleep
+from binascii import hexlify, unhexlify
+from esp32 import NVS
+from utime import ticks_diff, ticks_ms
+
+from mpy_blox.contextlib import suppress
 
 
 logger = logging.getLogger('system')
 
+ESP_ERR_NVS_NOT_FOUND = const(-4354)
+CACHE_NAMESPACE = 'wlan_cache'
+FAST_CONNECT_TIMEOUT_MS = const(5000)
+POLL_INTERVAL_MS = const(50)
+HOSTNAME_RETRIES = const(10)
 
-def connect_wlan(config):
-    wlan = network.WLAN(network.STA_IF)
-    wlan.active(True)
+STATUS_MESSAGES = {
+    network.STAT_IDLE: "WLAN Idle?",
+    network.STAT_CONNECTING: "WLAN Connecting...",
+    network.STAT_WRONG_PASSWORD: "WLAN Wrong password!",
+    network.STAT_NO_AP_FOUND: "WLAN AP not found!",
+    network.STAT_CONNECT_FAIL: "WLAN connection failed!",
+}
+FAILED_STATUSES = (network.STAT_WRONG_PASSWORD, network.STAT_NO_AP_FOUND,
+                   network.STAT_CONNECT_FAIL)
 
-    sleep(0.1)  # Seems to be needed to activate interface...
-    wlan.config(dhcp_hostname=config.get('hostname', 'espressif'))
 
-    try:
-        secure_cfg = config['secure']
-        ssid = secure_cfg['wlan.ssid']
+class WLANCache:
+    """Last good AP (SSID, BSSID, channel) and IP lease, kept in NVS.
 
-        logger.info("Connecting to SSID %s", ssid)
-        wlan.connect(ssid, secure_cfg['wlan.psk'])
-    except KeyError:
-        logger.warning("Network credentials not found. Device provisioned? "
-                       "Can't boot with network support")
-        return
+    Only written when something changed, so a fast reconnect doesn't wear
+    the flash.
+    """
+    def __init__(self):
+        self.nvs = NVS(CACHE_NAMESPACE)
+        self.entry = None
+
+    def load(self, ssid):
+        nvs = self.nvs
+        try:
+            size = nvs.get_i32('ap_s')
+            blob = bytearray(size)
+            nvs.get_blob('ap', blob)
+            entry = json.loads(blob)
+        except (OSError, ValueError):
+            return None
+
+        self.entry = entry
+        return entry if entry.get('ssid') == ssid else None
+
+    def store(self, entry):
+        if entry == self.entry:
+            return
+
+        blob = json.dumps(entry).encode()
+        nvs = self.nvs
+        nvs.set_blob('ap', blob)
+        nvs.set_i32('ap_s', len(blob))
+        nvs.commit()
+        self.entry = entry
 
-    check_count = 0
+    def clear(self):
+        nvs = self.nvs
+        for key in ('ap', 'ap_s'):
+            try:
+                nvs.erase_key(key)
+            except OSError as os_e:
+                if os_e.args[0] != ESP_ERR_NVS_NOT_FOUND:
+                    raise
+        nvs.commit()
+        self.entry = None
+
+
+async def set_hostname(wlan, hostname):
+    # The interface can take a moment to accept config after activating
+    for _ in range(HOSTNAME_RETRIES):
+        try:
+            wlan.config(dhcp_hostname=hostname)
+            return
+        except OSError:
+            await asyncio.sleep_ms(POLL_INTERVAL_MS)
+    logger.warning("Failed to set WLAN hostname %s", hostname)
+
+
+async def wait_connected(wlan, timeout_ms, fail_fast=False):
+    """Poll till connected, yielding to the loop, False on timeout.
+
+    With fail_fast, a failed status gives up right away instead of
+    waiting for the driver to retry.
+    """
+    start = ticks_ms()
+    last_status = None
     while not wlan.isconnected():
         status = wlan.status()
-        if status == network.STAT_IDLE:
-            logger.info("WLAN Idle?")
-        elif status == network.STAT_CONNECTING:
-            logger.info("WLAN Connecting...")
-        elif status == network.STAT_WONG_PASSWORD:
-            logger.info("WLAN Wrong password!")
-        elif status == network.STAT_NO_AP_FOUND:
-            logger.info("WLAN AP not found!")
-        elif status == network.STAT_CONNECT_FAIL:
-            logger.info("WLAN connection failed!")
-
-        if check_count > 15:
+        if status != last_status:
+            logger.info(STATUS_MESSAGES.get(status) or
+                        "WLAN status {}".format(status))
+            last_status = status
+
+        if fail_fast and status in FAILED_STATUSES:
+            return False
+        if ticks_diff(ticks_ms(), start) > timeout_ms:
+            return False
+
+        await asyncio.sleep_ms(POLL_INTERVAL_MS)
+
+    return True
+
+
+async def scan_best_ap(wlan, ssid):
+    """Full scan, the strongest AP for ssid as (bssid, channel) or None.
+
+    wlan.scan() blocks the whole loop for about 2s, so the other boot
+    stages get a turn before and after it.
+    """
+    await asyncio.sleep_ms(0)
+    aps = wlan.scan()
+    await asyncio.sleep_ms(0)
+
+    ssid_b = ssid.encode()
+    best = None
+    for ap in aps:
+        # (ssid, bssid, channel, RSSI, security, hidden)
+        if ap[0] == ssid_b and (best is None or ap[3] > best[2]):
+            best = (ap[1], ap[2], ap[3])
+
+    return best[:2] if best else None
+
+
+async def fast_connect(wlan, ssid, psk, cached, reuse_lease):
+    lease = cached.get('lease')
+    if reuse_lease and lease:
+        wlan.ifconfig(tuple(lease))  # Skips DHCP
+
+    # Channel is only a hint, not every port accepts it in STA mode
+    with suppress(ValueError, OSError):
+        wlan.config(channel=cached['channel'])
+
+    logger.info("Connecting to SSID %s via cached BSSID %s",
+                ssid, cached['bssid'])
+    wlan.connect(ssid, psk, bssid=unhexlify(cached['bssid']))
+    if await wait_connected(wlan, FAST_CONNECT_TIMEOUT_MS, fail_fast=True):
+        return True
+
+    logger.warning("WLAN fast connect failed, falling back to a scan")
+    wlan.disconnect()
+    if reuse_lease and lease:
+        wlan.ifconfig('dhcp')
+    return False
+
+
+async def connect_wlan(settings):
+    """Connect the station interface, False when not provisioned.
+
+    Tries the cached AP directly first. Only when that isn't possible or
+    fails, a full (loop blocking) scan finds the AP to cache. Without
+    wlan.fast_connect, the driver picks the AP and nothing is scanned.
+    """
+    wlan = network.WLAN(network.STA_IF)
+    wlan.active(True)
+    await set_hostname(wlan, settings.hostname or 'espressif')
+
+    ssid = settings.wlan_ssid
+    psk = settings.wlan_psk
+    if not ssid or psk is None:
+        logger.warning("Network credentials not found. Device provisioned? "
+                       "Can't boot with network support")
+        return False
+
+    cache = WLANCache() if settings.wlan_fast_connect else None
+    cached = cache.load(ssid) if cache else None
+    if cached and await fast_connect(wlan, ssid, psk, cached,
+                                     settings.wlan_reuse_lease):
+        ap = (unhexlify(cached['bssid']), cached['channel'])
+    else:
+        ap = await scan_best_ap(wlan, ssid) if cache else None
+        logger.info("Connecting to SSID %s", ssid)
+        if ap:
+            wlan.connect(ssid, psk, bssid=ap[0])
+        else:
+            wlan.connect(ssid, psk)  # Maybe hidden, let the driver look
+
+        if not await wait_connected(wlan, settings.wlan_connect_timeout_ms):
+            if cache:
+                cache.clear()
             logging.warning("WLAN should be connected by now, rebooting")
             raise RuntimeError("Broken WLAN")
 
-        check_count += 1
-        sleep(1.0)
-    
-    sleep(1.0)  # Seems to be needed to ensure connectivity...
+    if cache and ap:
+        cache.store({
+            'ssid': ssid,
+            'bssid': hexlify(ap[0]).decode(),
+            'channel': ap[1],
+            'lease': list(wlan.ifconfig())
+        })
+
     logger.info('WLAN connected!')
+    return True
@@ -0,0 +1,186 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from micropython import const
+
+import asyncio
+import struct
+import usocket
+from logging import getLogger
+from utime import gmtime, ticks_diff, ticks_ms
+
+from mpy_blox.time import (KEEPALIVE_MS, adjust_drift, drift_ppm, epoch_ms,
+                           log_time, pending_slew_ms, slew_time, step_time)
+
+
+logger = getLogger('system')
+
+NTP_PORT = const(123)
+NTP_PACKET_SIZE = const(48)
+NTP_MODE_CLIENT = const(0x1B)  # LI 0, version 3, mode 3
+NTP_MODE_SERVER = const(4)
+# Seconds between the NTP epoch (1900) and the port's epoch (1970 or 2000)
+NTP_DELTA = 3155673600 if gmtime(0)[0] == 2000 else 2208988800
+
+QUERY_TIMEOUT_MS = const(1000)
+RECV_POLL_MS = const(20)
+STEP_THRESHOLD_MS = const(1000)  # Larger offsets are stepped, not slewed
+STABLE_OFFSET_MS = const(20)  # Below this the interval is doubled
+UNSTABLE_OFFSET_MS = const(100)  # Above this the interval is halved
+MIN_DRIFT_SAMPLE_MS = const(30000)
+DRIFT_GAIN = const(4)  # EMA weight 1/4 for every drift measurement
+RESOLVE_TTL_MS = const(86400000)  # Pools rotate their servers
+
+
+def ntp_to_ms(data, offset):
+    seconds, fraction = struct.unpack_from('!II', data, offset)
+    return (seconds - NTP_DELTA) * 1000 + ((fraction * 1000) >> 32)
+
+
+def ms_to_ntp(timestamp_ms):
+    return struct.pack('!II', timestamp_ms // 1000 + NTP_DELTA,
+                       ((timestamp_ms % 1000) << 32) // 1000)
+
+
+class NTPClient:
+    """Asyncio SNTP client, slewing the clock and estimating its drift.
+
+    Every sync queries all servers and uses the reply with the lowest
+    round trip delay. The first sync or a large offset steps the clock,
+    otherwise the offset is slewed and the residual drift since the last
+    sync feeds an EMA of the clock drift. The interval doubles while the
+    clock stays within STABLE_OFFSET_MS, up to max_interval, and halves
+    when it's off by more than UNSTABLE_OFFSET_MS.
+    """
+    def __init__(self, hosts, min_interval=64, max_interval=3600):
+        self.hosts = hosts
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.addrs = {}
+        self.synced = False
+        self.last_sync_ticks = None
+
+    def addr(self, host):
+        # Resolving blocks, so only once per host till it fails or expires
+        cached = self.addrs.get(host)
+        if cached and ticks_diff(ticks_ms(), cached[1]) < RESOLVE_TTL_MS:
+            return cached[0]
+
+        addr = usocket.getaddrinfo(host, NTP_PORT, 0,
+                                   usocket.SOCK_DGRAM)[0][-1]
+        self.addrs[host] = (addr, ticks_ms())
+        return addr
+
+    async def query(self, host):
+        """Returns (offset_ms, delay_ms) for host or None on failure."""
+        request = bytearray(NTP_PACKET_SIZE)
+        request[0] = NTP_MODE_CLIENT
+
+        sock = usocket.socket(usocket.AF_INET, usocket.SOCK_DGRAM)
+        sock.setblocking(False)
+        try:
+            addr = self.addr(host)
+            t1 = epoch_ms()
+            request[40:48] = ms_to_ntp(t1)  # Echoed back as originate
+            sock.sendto(request, addr)
+
+            start = ticks_ms()
+            while True:
+                try:
+                    data = sock.recv(NTP_PACKET_SIZE)
+                    break
+                except OSError:
+                    pass  # Nothing received yet
+
+                if ticks_diff(ticks_ms(), start) > QUERY_TIMEOUT_MS:
+                    logger.debug("NTP server %s timed out", host)
+                    return None
+                await asyncio.sleep_ms(RECV_POLL_MS)
+            t4 = epoch_ms()
+        except OSError as e:
+            logger.debug("NTP query to %s failed: %s", host, e)
+            return None
+        finally:
+            sock.close()
+
+        if (len(data) < NTP_PACKET_SIZE
+                or data[0] & 0x07 != NTP_MODE_SERVER
+                or data[1] == 0  # Kiss-o'-death
+                or data[24:32] != request[40:48]):
+            logger.debug("Ignoring bad NTP reply from %s", host)
+            return None
+
+        t2 = ntp_to_ms(data, 32)
+        t3 = ntp_to_ms(data, 40)
+        return ((t2 - t1) + (t3 - t4)) // 2, (t4 - t1) - (t3 - t2)
+
+    async def sync(self):
+        best = None
+        for host in self.hosts:
+            sample = await self.query(host)
+            if sample is None:
+                self.addrs.pop(host, None)  # Resolve again next time
+            elif best is None or sample[1] < best[1]:
+                best = sample + (host,)
+
+        if best is None:
+            logger.warning("NTP sync failed, no server replied")
+            return False
+
+        offset, delay, host = best
+        now = ticks_ms()
+        if not self.synced or abs(offset) > STEP_THRESHOLD_MS:
+            step_time(offset)
+            logger.info("Clock stepped %sms via %s (delay %sms)",
+                        offset, host, delay)
+        else:
+            # Whatever the previous slew didn't explain is drift
+            elapsed = ticks_diff(now, self.last_sync_ticks)
+            if elapsed > MIN_DRIFT_SAMPLE_MS:
+                residual_ppm = ((offset - pending_slew_ms()) * 1000000
+                                // elapsed)
+                adjust_drift(residual_ppm // DRIFT_GAIN)
+
+            slew_time(offset)
+            logger.info("Clock slewing %sms via %s (delay %sms), "
+                        "drift %sppm", offset, host, delay, drift_ppm())
+
+        if abs(offset) < STABLE_OFFSET_MS:
+            self.interval = min(self.interval * 2, self.max_interval)
+        elif abs(offset) > UNSTABLE_OFFSET_MS:
+            self.interval = max(self.interval // 2, self.min_interval)
+
+        self.synced = True
+        self.last_sync_ticks = now
+        return True
+
+    async def sync_task(self):
+        while True:
+            # Retry failed syncs sooner, but never hammer the servers
+            interval = self.interval if self.synced else self.min_interval
+            interval_ms = interval * 1000
+            while interval_ms > 0:
+                # Keeps the clock anchored, even when nothing logs for days
+                nap_ms = min(interval_ms, KEEPALIVE_MS)
+                await asyncio.sleep_ms(nap_ms)
+                log_time()
+                interval_ms -= nap_ms
+
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.warning("NTP sync error", exc_info=e)
+
+
+async def init_ntp(settings) -> NTPClient:
+    """First sync, bounded by the query timeouts, then keep syncing."""
+    client = NTPClient(settings.ntp_host, settings.ntp_min_interval,
+                       settings.ntp_interval)
+    logger.info('Synchronising time with %s', ', '.join(client.hosts))
+    if await client.sync():
+        logger.info('NTP time synchronised')
+
+    asyncio.create_task(client.sync_task())
+    return client
@@ -0,0 +1,86 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from micropython import const
+
+import json
+import struct
+from binascii import crc32
+from logging import getLogger
+
+from mpy_blox.time import rtc
+
+
+logger = getLogger('system')
+
+RTC_STATE_MAGIC = b'MBS1'
+RTC_STATE_HEADER = '<4sI'  # Magic, CRC32 of the JSON body
+RTC_MEMORY_SIZE = const(2048)
+
+
+class RTCState:
+    """Small JSON state in RTC memory, kept over deep sleep and soft resets.
+
+    Lost on power loss, so only use it to skip work, e.g. republishing
+    unchanged values or discovery configs after waking up.
+    """
+    def __init__(self):
+        self.sections = None
+
+    def load(self):
+        sections = {}
+        data = rtc.memory()
+        header_size = struct.calcsize(RTC_STATE_HEADER)
+        if len(data) > header_size:
+            magic, crc = struct.unpack_from(RTC_STATE_HEADER, data)
+            body = data[header_size:]
+            if magic == RTC_STATE_MAGIC and crc32(body) == crc:
+                try:
+                    sections = json.loads(body)
+                except ValueError:
+                    pass
+
+        self.sections = sections
+        return sections
+
+    def section(self, name) -> dict:
+        sections = self.sections
+        if sections is None:
+            sections = self.load()
+
+        try:
+            return sections[name]
+        except KeyError:
+            section = sections[name] = {}
+            return section
+
+    def changed(self, key, value):
+        """Remember value for key, True when it differs from the last one."""
+        values = self.section('values')
+        if values.get(key) == value:
+            return False
+
+        values[key] = value
+        return True
+
+    def save(self):
+        if self.sections is None:
+            return  # Nothing loaded, so nothing changed
+
+        body = json.dumps(self.sections).encode()
+        data = struct.pack(RTC_STATE_HEADER, RTC_STATE_MAGIC,
+                           crc32(body)) + body
+        if len(data) > RTC_MEMORY_SIZE:
+            logger.warning("RTC state too large (%s bytes), not saved",
+                           len(data))
+            return
+
+        rtc.memory(data)
+
+    def clear(self):
+        self.sections = {}
+        rtc.memory(b'')
+
+
+rtc_state = RTCState()
@@ -0,0 +1,144 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from micropython import const
+
+import asyncio
+import machine
+from logging import getLogger
+
+from mpy_blox.rtc_state import rtc_state
+from mpy_blox.time import epoch_ms
+
+
+logger = getLogger('system')
+
+DEFAULT_DEEP_SLEEP_MIN_MS = const(60000)  # Below this a reboot costs more
+LIGHT_SLEEP_MIN_MS = const(100)
+
+
+class Job:
+    def __init__(self, name, interval_ms, func, slack_ms):
+        self.name = name
+        self.interval_ms = interval_ms
+        self.func = func
+        self.slack_ms = slack_ms
+        self.next_ms = 0
+
+    def __str__(self):
+        return "<Job {} every {}ms>".format(self.name, self.interval_ms)
+
+
+class DutyCycleScheduler:
+    """Runs periodic jobs and sleeps as deep as possible in between.
+
+    Wakeups are coalesced: the scheduler wakes for the earliest job and
+    also runs every other job that is due within its slack.
+
+    Between jobs it sleeps in the asyncio loop, in light sleep (pauses the
+    loop and networking, so only when light_sleep is set) or, when the
+    next job is at least deep_sleep_min_ms away and deep_sleep is set, in
+    deep sleep. Waking from deep sleep boots again, the job schedule is
+    kept in RTC memory so only the jobs that are due run.
+
+    Usage:
+        scheduler = DutyCycleScheduler.from_settings(settings)
+        scheduler.every('climate', 300, publish_climate)
+        await scheduler.run()
+    """
+    def __init__(self, deep_sleep=False, light_sleep=False,
+                 deep_sleep_min_ms=DEFAULT_DEEP_SLEEP_MIN_MS):
+        self.deep_sleep = deep_sleep
+        self.light_sleep = light_sleep
+        self.deep_sleep_min_ms = deep_sleep_min_ms
+        self.jobs = []
+        self.sleep_hooks = []
+
+        # Only trust the persisted schedule when waking up from deep sleep
+        self.schedule = rtc_state.section('jobs')
+        if machine.reset_cause() != machine.DEEPSLEEP_RESET:
+            self.schedule.clear()
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(settings.sleep_deep, settings.sleep_light,
+                   settings.sleep_deep_min_ms)
+
+    def every(self, name, interval_s, func, slack_s=None):
+        """Run async func every interval_s seconds.
+
+        slack_s (default a tenth of the interval) is how much earlier the
+        job may run to share a wakeup with another job.
+        """
+        interval_ms = interval_s * 1000
+        if slack_s is None:
+            slack_ms = interval_ms // 10
+        else:
+            slack_ms = slack_s * 1000
+
+        job = Job(name, interval_ms, func, slack_ms)
+        job.next_ms = self.schedule.get(name, epoch_ms())
+        self.jobs.append(job)
+        return job
+
+    def add_sleep_hook(self, func):
+        """Async func to run before going into deep sleep."""
+        self.sleep_hooks.append(func)
+
+    def due_jobs(self, now):
+        return [job for job in self.jobs
+                if job.next_ms - job.slack_ms <= now]
+
+    def next_wakeup(self):
+        return min(job.next_ms for job in self.jobs)
+
+    async def run_jobs(self, now):
+        for job in self.due_jobs(now):
+            try:
+                await job.func()
+            except Exception as e:
+                logger.exception("Job %s failed", job, exc_info=e)
+
+            # Keep the cadence, unless we fell behind a whole interval
+            job.next_ms += job.interval_ms
+            if job.next_ms <= now:
+                job.next_ms = now + job.interval_ms
+            self.schedule[job.name] = job.next_ms
+
+    async def enter_deep_sleep(self):
+        for hook in self.sleep_hooks:
+            try:
+                await hook()
+            except Exception as e:
+                logger.warning("Sleep hook %s failed", hook, exc_info=e)
+
+        # Say goodbye to the broker, instead of letting keep alive time out
+        from mpy_blox.mqtt import MQTTConnectionManager
+        await MQTTConnectionManager.disconnect_all()
+
+        # Hooks take time too, so only measure the sleep now
+        sleep_ms = max(self.next_wakeup() - epoch_ms(), 1)
+        logger.info("Deep sleeping for %sms", sleep_ms)
+        rtc_state.save()
+        machine.deepsleep(sleep_ms)
+
+    async def run(self):
+        if not self.jobs:
+            raise ValueError("No jobs scheduled")
+
+        while True:
+            now = epoch_ms()
+            await self.run_jobs(now)
+
+            now = epoch_ms()
+            sleep_ms = self.next_wakeup() - now
+            if sleep_ms <= 0:
+                continue
+
+            if self.deep_sleep and sleep_ms >= self.deep_sleep_min_ms:
+                await self.enter_deep_sleep()
+            elif self.light_sleep and sleep_ms >= LIGHT_SLEEP_MIN_MS:
+                machine.lightsleep(sleep_ms)
+            else:
+                await asyncio.sleep_ms(sleep_ms)
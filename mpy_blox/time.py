@@ -2,43 +2,176 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
-import asyncio
-import ntptime
+from micropython import const
+
 from logging import getLogger
 from machine import RTC
-from uerrno import ETIMEDOUT
+from utime import gmtime, localtime, ticks_diff, ticks_ms, time_ns
 
 
 logger = getLogger('system')
 rtc = RTC()
 
 
+# Wall time anchored to ticks_ms, so timestamps only need integer math.
+# Reanchored every minute, keeping the drift and slew math in small ints.
+# Times are kept relative to a base epoch ms, so log records get a small
+# int (no heap allocation), widened with log_base_ms() when formatting.
+REANCHOR_MS = const(60000)
+REBASE_MS = const(0x10000000)  # ~3 days, well within small int range
+MAX_SLEW_PPM = const(500)  # Corrections are slewed at most 0.5ms/s
+MAX_DRIFT_PPM = const(500)
+# ticks_diff() only covers ~6 days, log_time() has to be called more often.
+# Periodic tasks (e.g. the NTP sync) do so at least every KEEPALIVE_MS.
+KEEPALIVE_MS = const(86400000)
+_base_ms = None
+_base_gen = 0  # Changes with the base, so records know theirs
+_anchor_rel = 0
+_anchor_ticks = 0
+_last_rel = 0
+_drift_ppm = 0
+_slew_ms = 0  # Left to slew from the anchor on
+
+# Cached "YYYY-MM-DDThh:mm:ss." prefix of the last formatted second
+_prefix_second = None
+_prefix = ''
+
+
+def anchor_time():
+    """Anchor RTC wall time to ticks_ms, again after setting the RTC."""
+    global _base_ms, _base_gen, _anchor_rel, _anchor_ticks, _last_rel
+    global _slew_ms
+    _anchor_ticks = ticks_ms()
+    _base_ms = time_ns() // 1000000
+    _base_gen = (_base_gen + 1) & 0xFF
+    _anchor_rel = _last_rel = 0
+    _slew_ms = 0
+
+
+def _applied_slew(elapsed):
+    slew_max = elapsed * MAX_SLEW_PPM // 1000000
+    return max(-slew_max, min(_slew_ms, slew_max))
+
+
+def _clock(now):
+    elapsed = ticks_diff(now, _anchor_ticks)
+    return (_anchor_rel + elapsed + elapsed * _drift_ppm // 1000000
+            + _applied_slew(elapsed))
+
+
+def _reanchor(now):
+    global _base_ms, _base_gen, _anchor_rel, _anchor_ticks, _last_rel
+    global _slew_ms
+    clock_rel = _clock(now)
+    _slew_ms -= _applied_slew(ticks_diff(now, _anchor_ticks))
+    _anchor_rel = clock_rel
+    _anchor_ticks = now
+
+    if clock_rel > REBASE_MS:
+        # Move the base along, keeping times relative to it small
+        _base_ms += clock_rel
+        _base_gen = (_base_gen + 1) & 0xFF
+        _last_rel -= clock_rel
+        _anchor_rel = 0
+
+
+def log_time():
+    """Wall time in ms since log_base_ms(), never going backwards.
+
+    Derived from the ticks anchor, corrected for the estimated drift and
+    slewing towards the last NTP offset. Always a small int, cheap enough
+    for every log record.
+    """
+    global _last_rel
+    if _base_ms is None:
+        anchor_time()
+
+    now = ticks_ms()
+    elapsed = ticks_diff(now, _anchor_ticks)
+    if elapsed < 0:
+        # Not called for days, ticks wrapped. Only the RTC still knows
+        anchor_time()
+        now = _anchor_ticks
+        logger.warning("Clock anchor lost, reanchored to the RTC")
+    elif elapsed > REANCHOR_MS:
+        _reanchor(now)
+
+    rel = _clock(now)
+    if rel < _last_rel:
+        return _last_rel  # Integer rounding of the corrections
+    _last_rel = rel
+    return rel
+
+
+def log_base_ms():
+    """Epoch ms that log_time() is relative to, changes with log_gen()."""
+    if _base_ms is None:
+        anchor_time()
+    return _base_ms
+
+
+def log_gen():
+    return _base_gen
+
+
+def epoch_ms():
+    """Wall time in epoch milliseconds, never going backwards."""
+    rel = log_time()
+    return _base_ms + rel
+
+
+def set_rtc(timestamp_ms):
+    tm = gmtime(timestamp_ms // 1000)
+    rtc.datetime((tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5],
+                  (timestamp_ms % 1000) * 1000))
+
+
+def step_time(offset_ms):
+    """Jump the clock (and RTC) by offset_ms, e.g. on the first sync."""
+    set_rtc(epoch_ms() + offset_ms)
+    anchor_time()
+
+
+def slew_time(offset_ms):
+    """Gradually apply offset_ms, replacing any slew still in progress.
+
+    ESP32 has no adjtime, so the slew happens on this clock; the RTC is
+    set to it, a small correction nobody reading epoch_ms() notices.
+    """
+    global _slew_ms
+    _reanchor(ticks_ms())
+    _slew_ms = offset_ms
+    set_rtc(epoch_ms())
+
+
+def pending_slew_ms():
+    if _base_ms is None:
+        return 0
+    return _slew_ms - _applied_slew(ticks_diff(ticks_ms(), _anchor_ticks))
+
+
+def drift_ppm():
+    return _drift_ppm
+
+
+def adjust_drift(delta_ppm):
+    global _drift_ppm
+    if _base_ms is not None:
+        _reanchor(ticks_ms())
+    _drift_ppm = max(-MAX_DRIFT_PPM,
+                     min(_drift_ppm + delta_ppm, MAX_DRIFT_PPM))
+
+
+def isotime_ms(timestamp_ms):
+    global _prefix_second, _prefix
+    second = timestamp_ms // 1000
+    if second != _prefix_second:
+        _prefix = "{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}.".format(
+            *localtime(second)[0:6])
+        _prefix_second = second
+
+    return "{}{:03d}Z".format(_prefix, timestamp_ms % 1000)
+
+
 def isotime():
-    dt_tup = rtc.datetime()
-    # Making subseconds max 3 long
-    subseconds = str(dt_tup[-1])[:3]
-    return "{}-{}-{}T{}:{}:{}.{:0<3}Z".format(*(dt_tup[0:3] + dt_tup[4:-1] + (subseconds,)))
-
-
-def sync_ntp(config):
-    ntp_host = config.get('ntp.host', 'pool.ntp.org')
-    logger.info('Synchronising time with %s', ntp_host)
-
-    ntptime.host = ntp_host
-    while True:
-        try:
-            ntptime.settime()
-        except OSError as e:
-            if e.args[0] != ETIMEDOUT:
-                raise
-        else:
-            break
-
-    logger.info('NTP time synchronised')
-
-
-async def scheduled_sync_task(config):
-    interval = int(config.get('ntp.interval', '3600'))
-    while True:
-        await asyncio.sleep(interval)
-        sync_ntp(config)
+    return isotime_ms(epoch_ms())
@@ -2,13 +2,15 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
+import asyncio
 import logging
 import re
 import os
 
+from mpy_blox.contextlib import suppress
 from mpy_blox.os import makedirs
 from mpy_blox.wheel.info import WheelPackage
-from mpy_blox.util import rewrite_file
+from mpy_blox.zipfile import CHUNK_SIZE
 
 DIST_INFO_RE = re.compile(
     r"^(((.+?)-(.+?))(-(P\d[^-]*))?.dist-info/?)(RECORD$)?")
@@ -28,12 +30,23 @@ class WheelUpgradeTagMismatch(Exception):
         self.expected_tag = expected_tag
 
 
+def read_metadata_header(metadata_path):
+    # Stop at the header/body boundary, skipping any long description
+    header_lines = []
+    with open(metadata_path, 'rt') as metadata_f:
+        for line in metadata_f:
+            if not line.strip():
+                break
+            header_lines.append(line)
+
+    return ''.join(header_lines)
+
+
 def read_package(dist_info_path):
-    with open(dist_info_path + '/METADATA', 'rt') as metadata_f:
-        pep314_metadata = metadata_f.read()
+    pep314_metadata = read_metadata_header(dist_info_path + '/METADATA')
     with open(dist_info_path + '/WHEEL', 'rt') as wheel_info_f:
         pep314_wheel_info = wheel_info_f.read()
-    with open(dist_info_path + '/RECORD', 'rt') as record_f:
+    with open(dist_info_path + '/RECORD', 'rb') as record_f:
         record_contents = record_f.read()
 
     return WheelPackage(pep314_metadata, pep314_wheel_info, record_contents)
@@ -59,37 +72,60 @@ def pkg_info(name, prefix=None):
             return pkg
 
 
-def install(wheel_file, prefix=None):
-    prefix = prefix or DEFAULT_PREFIX
+def _copy_member(wheel_file, record_entry, output_path, buf):
+    # Stream into a temporary file, output_path is only replaced once the
+    # member passed CRC32 and RECORD validation. Yields after every chunk.
+    tmp_path = output_path + '.tmp'
+    mv = memoryview(buf)
+    try:
+        with wheel_file.open(record_entry) as member_f:
+            with open(tmp_path, 'wb') as output_f:
+                while True:
+                    read_len = member_f.readinto(mv)
+                    if not read_len:
+                        break
+
+                    output_f.write(mv[:read_len])
+                    yield read_len
+    except Exception:
+        with suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+    with suppress(OSError):
+        os.remove(output_path)
+    os.rename(tmp_path, output_path)
+
+
+def _install_steps(wheel_file, prefix):
     existing_pkg = pkg_info(wheel_file.package.name, prefix)
     if existing_pkg:
         raise WheelExistingInstallation(existing_pkg)
 
-    for name, record_entry in wheel_file.wheel_record.items():
+    for idx, (name, record_entry) in enumerate(
+            wheel_file.wheel_record.items()):
         output_path = prefix + name
         logging.info("%s -> %s", name, output_path)
 
         folder = output_path.rsplit('/', 1)[0]
         makedirs(folder)
-        with open(output_path, 'wb') as output_f:
-            output_f.write(wheel_file.read(record_entry))
-
+        yield idx, record_entry, output_path
 
-def upgrade(pkg, wheel_file, prefix=None):
-    prefix = prefix or DEFAULT_PREFIX
 
+def _upgrade_steps(pkg, wheel_file, prefix):
     expected_tag = pkg.wheel_info['Tag']
     if expected_tag != wheel_file.wheel_info['Tag']:
         raise WheelUpgradeTagMismatch(expected_tag)
 
-    processed_names = []
-    for name, new_record_entry in wheel_file.wheel_record.items():
+    processed_names = set()
+    for idx, (name, new_record_entry) in enumerate(
+            wheel_file.wheel_record.items()):
         output_path = prefix + name
         try:
             old_record_entry = pkg.wheel_record[name]
             if old_record_entry == new_record_entry:
                 logging.debug("Skipping unchanged record %s", new_record_entry)
-                processed_names.append(name)
+                processed_names.add(name)
                 continue
         except KeyError:
             # New record, check folders
@@ -97,9 +133,9 @@ def upgrade(pkg, wheel_file, prefix=None):
             makedirs(folder)
 
         logging.info("%s -> %s", name, output_path)
-        rewrite_file(output_path, wheel_file.read(new_record_entry))
+        yield idx, new_record_entry, output_path
 
-        processed_names.append(name)
+        processed_names.add(name)
 
     for old_name in pkg.wheel_record:
         if old_name in processed_names:
@@ -113,3 +149,50 @@ def upgrade(pkg, wheel_file, prefix=None):
         # Remove dist-folder after version upgrade
         os.rmdir(prefix + "{}-{}.dist-info".format(wheel_file.pkg_name,
                                                    pkg.version))
+
+
+def _process(steps, wheel_file, progress_cb):
+    buf = bytearray(CHUNK_SIZE)
+    total = len(wheel_file.wheel_record)
+    for idx, record_entry, output_path in steps:
+        for _ in _copy_member(wheel_file, record_entry, output_path, buf):
+            pass
+
+        if progress_cb:
+            progress_cb(idx + 1, total, record_entry.name)
+
+
+async def _process_async(steps, wheel_file, progress_cb):
+    # progress_cb is a coroutine function here, awaited per member
+    sleep_ms = asyncio.sleep_ms
+    buf = bytearray(CHUNK_SIZE)
+    total = len(wheel_file.wheel_record)
+    for idx, record_entry, output_path in steps:
+        # Give the loop a chance between chunks, e.g. for MQTT keep alive
+        for _ in _copy_member(wheel_file, record_entry, output_path, buf):
+            await sleep_ms(0)
+
+        if progress_cb:
+            await progress_cb(idx + 1, total, record_entry.name)
+
+
+def install(wheel_file, prefix=None, progress_cb=None):
+    prefix = prefix or DEFAULT_PREFIX
+    _process(_install_steps(wheel_file, prefix), wheel_file, progress_cb)
+
+
+async def install_async(wheel_file, prefix=None, progress_cb=None):
+    prefix = prefix or DEFAULT_PREFIX
+    await _process_async(_install_steps(wheel_file, prefix),
+                         wheel_file, progress_cb)
+
+
+def upgrade(pkg, wheel_file, prefix=None, progress_cb=None):
+    prefix = prefix or DEFAULT_PREFIX
+    _process(_upgrade_steps(pkg, wheel_file, prefix), wheel_file, progress_cb)
+
+
+async def upgrade_async(pkg, wheel_file, prefix=None, progress_cb=None):
+    prefix = prefix or DEFAULT_PREFIX
+    await _process_async(_upgrade_steps(pkg, wheel_file, prefix),
+                         wheel_file, progress_cb)
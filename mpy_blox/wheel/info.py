@@ -3,32 +3,43 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 import uhashlib
+from array import array
 from ucollections import OrderedDict
 
-from mpy_blox.base64 import urlsafe_b64decode, urlsafe_b64encode
+from mpy_blox.base64 import urlsafe_b64decode
 
 
 class WheelRecordEntry:
+    __slots__ = ('name', 'checksum_algo', 'encoded_checksum', 'size')
+
     def __init__(self, record_line):
         self.name, checksum_line, size = record_line.rsplit(',', 2)
 
-        self.checksum = self.checksum_algo = None
+        # Checksum is only base64 decoded when validating data
+        self.checksum_algo = self.encoded_checksum = None
         if checksum_line:
-            self.checksum_algo, encoded_checksum = checksum_line.split('=', 1)
-            self.checksum = urlsafe_b64decode(encoded_checksum)
+            (self.checksum_algo,
+             self.encoded_checksum) = checksum_line.split('=', 1)
 
         self.size =  int(size) if size else None
 
+    @property
+    def checksum(self):
+        encoded_checksum = self.encoded_checksum
+        if encoded_checksum is None:
+            return None
+        return urlsafe_b64decode(encoded_checksum)
+
     def __eq__(self, other):
         if not isinstance(other, self.__class__):
             return False
 
-        if self.checksum is None:
+        if self.encoded_checksum is None:
             return False
 
         return (self.name == other.name
                 and self.checksum_algo == other.checksum_algo
-                and self.checksum == other.checksum)
+                and self.encoded_checksum == other.encoded_checksum)
 
     @property
     def checksum_hasher(self):
@@ -40,39 +51,136 @@ class WheelRecordEntry:
                 "{}, checksum_algo={}, checksum={}>".format(
                     self.name,
                     self.checksum_algo,
-                    urlsafe_b64encode(self.checksum) if self.checksum else None
+                    self.encoded_checksum
                 ))
 
 
 class WheelMetadata:
     def __init__(self, pep314_metadata):
-        self.parsed_metadata = OrderedDict()
-        for line in pep314_metadata.splitlines():
-            key, value = line.split(':', 1)
-            self.parsed_metadata[key] = value.strip()
+        # Only the header is parsed, parsing stops at the header/body
+        # boundary so long descriptions are never split up
+        self.parsed_metadata = parsed_metadata = OrderedDict()
+        metadata_len = len(pep314_metadata)
+        pos = 0
+        while pos < metadata_len:
+            end = pep314_metadata.find('\n', pos)
+            if end < 0:
+                end = metadata_len
+
+            line = pep314_metadata[pos:end].rstrip('\r')
+            pos = end + 1
+            if not line:
+                break  # Header/body boundary
+            if line[0] in ' \t':
+                continue  # Folded continuation of a long value
+
+            key, sep, value = line.partition(':')
+            if sep:
+                parsed_metadata[key] = value.strip()
 
     def __getitem__(self, k):
         return self.parsed_metadata[k]
 
 
 class WheelRecord:
+    """RECORD kept as a single buffer plus an offset index.
+
+    Entries are only materialised on access. Lookups go through the hash
+    of the name, falling back to a scan for the rare hash collision.
+    """
     def __init__(self, record_contents):
-        self.parsed_record = parsed_record = OrderedDict()
-        for line in record_contents.splitlines():
-            record_entry = WheelRecordEntry(line)
-            parsed_record[record_entry.name] = record_entry
+        if isinstance(record_contents, str):
+            record_contents = record_contents.encode()
+
+        self.record_contents = record_contents
+        self._starts = starts = array('L')
+        self._ends = ends = array('L')
+        self._name_ends = name_ends = array('L')
+        self._lookup = lookup = {}
+
+        contents_len = len(record_contents)
+        pos = 0
+        while pos < contents_len:
+            end = record_contents.find(b'\n', pos)
+            if end < 0:
+                end = contents_len
+            line_end = end
+            if line_end > pos and record_contents[line_end - 1] == 13:
+                line_end -= 1  # Strip \r
+
+            if line_end > pos:
+                # name,hash,size: the name may contain commas, the rest not
+                hash_end = record_contents.rfind(b',', pos, line_end)
+                name_end = -1
+                if hash_end >= 0:
+                    name_end = record_contents.rfind(b',', pos, hash_end)
+                if name_end < 0:
+                    raise ValueError("Malformed RECORD line: {}".format(
+                        record_contents[pos:line_end]))
+                name_hash = hash(record_contents[pos:name_end])
+                lookup[name_hash] = -1 if name_hash in lookup else len(starts)
+                starts.append(pos)
+                ends.append(line_end)
+                name_ends.append(name_end)
+
+            pos = end + 1
+
+    def _name(self, idx):
+        return self.record_contents[self._starts[idx]:
+                                    self._name_ends[idx]].decode()
+
+    def _entry(self, idx):
+        return WheelRecordEntry(
+            self.record_contents[self._starts[idx]:self._ends[idx]].decode())
+
+    def _index(self, k):
+        encoded_k = k.encode()
+        idx = self._lookup.get(hash(encoded_k))
+        if idx is None:
+            raise KeyError(k)
+
+        record_contents = self.record_contents
+        starts = self._starts
+        name_ends = self._name_ends
+        if idx >= 0:
+            start = starts[idx]
+            if (name_ends[idx] - start == len(encoded_k)
+                    and record_contents.startswith(encoded_k, start)):
+                return idx
+            raise KeyError(k)
+
+        # Hash collision, scan
+        for idx in range(len(starts)):
+            start = starts[idx]
+            if (name_ends[idx] - start == len(encoded_k)
+                    and record_contents.startswith(encoded_k, start)):
+                return idx
+        raise KeyError(k)
 
     def __getitem__(self, k):
-        return self.parsed_record[k]
+        return self._entry(self._index(k))
+
+    def __contains__(self, k):
+        try:
+            self._index(k)
+        except KeyError:
+            return False
+        return True
 
     def __iter__(self):
-        yield from self.parsed_record
+        for idx in range(len(self._starts)):
+            yield self._name(idx)
+
+    def __len__(self):
+        return len(self._starts)
 
     def items(self):
-        yield from self.parsed_record.items()
+        for idx in range(len(self._starts)):
+            entry = self._entry(idx)
+            yield entry.name, entry
 
     def __str__(self):
-        return "<WheelRecord num_entries={}>".format(len(self.parsed_record))
+        return "<WheelRecord num_entries={}>".format(len(self._starts))
 
 
 class WheelPackage:
@@ -3,17 +3,55 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 import logging
+from uhashlib import sha256
 from ucollections import OrderedDict
 
+from mpy_blox.base64 import urlsafe_b64encode
 from mpy_blox.wheel import DIST_INFO_RE
 from mpy_blox.wheel.info import WheelPackage, WheelRecordEntry
-from mpy_blox.zipfile import BadZipFile, ZipFile, ZipInfo
+from mpy_blox.zipfile import (COMP_DEF, BadZipFile, ZipExtFile, ZipFile,
+                              ZipInfo, ZipWriter)
 
 
 class BadWheelFile(BadZipFile):
     pass
 
 
+class WheelExtFile(ZipExtFile):
+    """ZIP member stream also validating the wheel RECORD checksum."""
+    def __init__(self, file_obj, zip_info, record):
+        if record.size is not None and zip_info.size != record.size:
+            raise BadWheelFile("Bad size for file {}".format(record.name))
+
+        super().__init__(file_obj, zip_info)
+        self.record = record
+        hasher = record.checksum_hasher
+        self.hasher = hasher() if hasher else None
+
+    def readinto(self, buf):
+        read_len = super().readinto(buf)
+        hasher = self.hasher
+        if not hasher:
+            return read_len
+
+        if read_len:
+            hasher.update(memoryview(buf)[:read_len])
+        if self.remaining:
+            return read_len
+
+        # Last chunk, digest can only be taken once
+        self.hasher = None
+        record = self.record
+        if hasher.digest() != record.checksum:
+            raise BadWheelFile(
+                "Bad {} for file {}".format(
+                    record.checksum_algo,
+                    record.name
+                ))
+
+        return read_len
+
+
 class WheelFile(ZipFile):
     def __init__(self, file_obj):
         super().__init__(file_obj)
@@ -36,7 +74,7 @@ class WheelFile(ZipFile):
         self.package = package = WheelPackage(
             self.read(dist_info_path + 'METADATA').decode(),
             self.read(dist_info_path + 'WHEEL').decode(),
-            self.read(dist_info_path + 'RECORD').decode())
+            self.read(dist_info_path + 'RECORD'))
 
         logging.debug("Read wheel package: %s", package)
 
@@ -62,7 +100,7 @@ class WheelFile(ZipFile):
         return "<WheelFile pkg_name={}, pkg_version={}>".format(
             self.pkg_name, self.pkg_version)
 
-    def read(self, member):
+    def _resolve(self, member):
         record = None
         if isinstance(member, ZipInfo):
             zip_info = member
@@ -72,13 +110,28 @@ class WheelFile(ZipFile):
         else:
             zip_info = self[member]
 
-        data = super().read(zip_info)
         try:
             if not record:
                 # Check the wheel record for this memeber
                 record = self.wheel_record[zip_info.name]
         except KeyError:
-            return data  # Extra member in ZIP, not part of wheel
+            pass  # Extra member in ZIP, not part of wheel
+
+        return zip_info, record
+
+    def open(self, member):
+        zip_info, record = self._resolve(member)
+        if not record:
+            return super().open(zip_info)
+
+        self._seek_data(zip_info)
+        return WheelExtFile(self.file_obj, zip_info, record)
+
+    def read(self, member):
+        zip_info, record = self._resolve(member)
+        data = super().read(zip_info)
+        if not record:
+            return data
 
         # This member is part of the wheel record, validate against it
         if len(data) != record.size and record.size is not None:
@@ -94,3 +147,60 @@ class WheelFile(ZipFile):
                 ))
 
         return data
+
+
+class WheelWriter(ZipWriter):
+    """Streaming wheel writer, RECORD is collected while writing members.
+
+    METADATA, WHEEL and RECORD are written to the dist-info on close.
+    """
+    def __init__(self, file_obj, pkg_name, pkg_version,
+                 tag='py3-none-any', compress_method=COMP_DEF):
+        super().__init__(file_obj, compress_method)
+        self.pkg_name = pkg_name
+        self.pkg_version = pkg_version
+        self.tag = tag
+        self.dist_info_path = "{}-{}.dist-info/".format(
+            pkg_name.replace('-', '_'), pkg_version)
+        self.record_lines = []
+
+    def open(self, name, compress_method=None):
+        member_f = super().open(name, compress_method)
+        member_f.hasher = sha256()
+        return member_f
+
+    def _close_member(self, member_f):
+        super()._close_member(member_f)
+        if member_f.hasher is None:
+            return  # RECORD itself
+
+        self.record_lines.append("{},sha256={},{}".format(
+            member_f.name,
+            urlsafe_b64encode(member_f.hasher.digest()).decode(),
+            member_f.size))
+
+    def close(self):
+        if self.file_obj is None:
+            return  # Already closed
+        if self._member_f:
+            self._member_f.close()
+
+        dist_info_path = self.dist_info_path
+        self.writestr(dist_info_path + 'METADATA',
+                      "Metadata-Version: 2.1\n"
+                      "Name: {}\n"
+                      "Version: {}\n".format(self.pkg_name,
+                                              self.pkg_version))
+        self.writestr(dist_info_path + 'WHEEL',
+                      "Wheel-Version: 1.0\n"
+                      "Generator: mpy-blox\n"
+                      "Root-Is-Purelib: true\n"
+                      "Tag: {}\n".format(self.tag))
+
+        # RECORD can't contain its own checksum
+        record_lines = self.record_lines
+        record_lines.append(dist_info_path + 'RECORD,,')
+        with ZipWriter.open(self, dist_info_path + 'RECORD') as record_f:
+            record_f.write(('\n'.join(record_lines) + '\n').encode())
+
+        super().close()
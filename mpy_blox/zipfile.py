@@ -4,11 +4,20 @@
 
 import logging
 import struct
+from array import array
 from micropython import const
 from binascii import crc32
-from collections import OrderedDict
+from io import BytesIO, IOBase
+from utime import localtime
 from zlib import decompress
 
+try:
+    from deflate import DeflateIO, RAW
+except ImportError:
+    DeflateIO = None  # No streaming inflate, open() falls back to one-shot
+
+_deflate_compress = None  # Probed on first use, see can_deflate()
+
 # Constants
 SEEK_SET = const(0)
 SEEK_CUR = const(1)
@@ -16,6 +25,14 @@ SEEK_END = const(2)
 ZIP_WBITS = const(-15)
 COMP_NONE = const(0)
 COMP_DEF = const(8)
+CHUNK_SIZE = const(1024)
+MAX_COMMENT_LEN = const(1024)  # Bounds the EOCD scan, ZIP allows 65535
+ZIP64_LIMIT = const(0xFFFFFFFF)
+ZIP64_COUNT_LIMIT = const(0xFFFF)
+ZIP64_EXTRA_ID = const(0x0001)
+FLAG_DATA_DESCRIPTOR = const(0x0008)
+FLAG_UTF8 = const(0x0800)
+ZIP_VERSION = const(20)  # 2.0: Deflate and data descriptors
 
 # ZIP structures
 EOCD_SIG = b'PK\x05\x06'
@@ -24,8 +41,19 @@ EOCD_SIZE = struct.calcsize(EOCD_STRUCT)
 CD_F_H_SIG = b'PK\x01\x02'
 CD_F_H_STRUCT = '<4s4B4H3L5H2L'
 CD_F_H_SIZE = struct.calcsize(CD_F_H_STRUCT)
+LOCAL_F_H_SIG = b'PK\x03\x04'
 LOCAL_F_H_STRUCT = '<4s2B4HL2L2H'
 LOCAL_F_H_SIZE = struct.calcsize(LOCAL_F_H_STRUCT)
+ZIP64_EOCD_SIG = b'PK\x06\x06'
+ZIP64_EOCD_STRUCT = '<4sQ2H2L4Q'
+ZIP64_EOCD_SIZE = struct.calcsize(ZIP64_EOCD_STRUCT)
+ZIP64_EOCD_LOC_SIG = b'PK\x06\x07'
+ZIP64_EOCD_LOC_STRUCT = '<4sLQL'
+ZIP64_EOCD_LOC_SIZE = struct.calcsize(ZIP64_EOCD_LOC_STRUCT)
+DATA_DESCRIPTOR_SIG = b'PK\x07\x08'
+DATA_DESCRIPTOR_STRUCT = '<4s3L'
+EXTRA_F_H_STRUCT = '<2H'
+EXTRA_F_H_SIZE = struct.calcsize(EXTRA_F_H_STRUCT)
 
 
 class BadZipFile(Exception):
@@ -33,26 +61,19 @@ class BadZipFile(Exception):
 
 
 class ZipInfo:
-    def __init__(self, cd_header_data):
-        self.name = ''  # Overriden by ZipFile
-        (sig,
-         _, _, _, _,  # Compressor and min version, we don't care
-         _,  # General purpose bit flag?
-         self.compress_method,
-         self.last_mod_time,
-         self.last_mod_date,
-         self.crc32,
-         self.compressed_size,
-         self.size,
-         self.filename_len,
-         self.extra_field_len,
-         self.comment_len,
-         _,  # Disk number, we only support single part ZIPs
-         _, _,  # File attributes, we don't care
-         self.offset) = struct.unpack(CD_F_H_STRUCT, cd_header_data)
-        if sig != CD_F_H_SIG:
-            raise BadZipFile(
-                "Central directory entry signature mismatch, ZIP corrupt?")
+    # Lightweight view of one central directory entry, built on demand
+    # from the ZipFile index instead of being kept around for every member
+    __slots__ = ('name', 'compress_method', 'crc32', 'compressed_size',
+                 'size', 'offset')
+
+    def __init__(self, name, compress_method, crc32, compressed_size, size,
+                 offset):
+        self.name = name
+        self.compress_method = compress_method
+        self.crc32 = crc32
+        self.compressed_size = compressed_size
+        self.size = size
+        self.offset = offset
 
     @property
     def compressed(self):
@@ -67,49 +88,321 @@ class ZipInfo:
             self.offset)
 
 
+class ZipExtFile:
+    """Read-only stream over a single ZIP member.
+
+    Data is inflated on the fly and CRC32 is updated incrementally, the
+    CRC32 is validated once the last byte of the member has been read.
+    Only one member stream should be used at a time, as the underlying
+    file object is shared with the ZipFile.
+    """
+    def __init__(self, file_obj, zip_info):
+        self.zip_info = zip_info
+        self.remaining = zip_info.size
+        self.crc = 0
+
+        if zip_info.compress_method == COMP_DEF:
+            if DeflateIO:
+                self._stream = DeflateIO(file_obj, RAW)
+            else:
+                self._stream = BytesIO(
+                    decompress(file_obj.read(zip_info.compressed_size),
+                               ZIP_WBITS))
+        elif zip_info.compress_method == COMP_NONE:
+            self._stream = file_obj  # Data was just stored, read through
+        else:
+            raise BadZipFile("Unsupported compression method "
+                             "for file {}".format(zip_info.name))
+
+    def readinto(self, buf):
+        remaining = self.remaining
+        if not remaining:
+            return 0
+
+        mv = memoryview(buf)
+        if len(mv) > remaining:
+            mv = mv[:remaining]
+
+        zip_info = self.zip_info
+        read_len = self._stream.readinto(mv)
+        if not read_len:
+            raise BadZipFile(
+                "Unexpected end of data for file {}".format(zip_info.name))
+
+        self.crc = crc32(mv[:read_len], self.crc)
+        self.remaining = remaining = remaining - read_len
+        if not remaining and self.crc != zip_info.crc32:
+            raise BadZipFile("Bad CRC32 for file {}".format(zip_info.name))
+
+        return read_len
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+
+        buf = bytearray(size)
+        mv = memoryview(buf)
+        read_total = 0
+        while read_total < size:
+            read_total += self.readinto(mv[read_total:])
+
+        return bytes(buf)
+
+    def close(self):
+        self._stream = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, tb):
+        self.close()
+
+
+def _find_eocd(tail):
+    # Scan backwards for an EOCD whose comment runs exactly to the end
+    tail_len = len(tail)
+    pos = tail.rfind(EOCD_SIG)
+    while pos >= 0:
+        if pos + EOCD_SIZE <= tail_len:
+            comment_len = struct.unpack_from('<H', tail, pos + EOCD_SIZE - 2)[0]
+            if pos + EOCD_SIZE + comment_len == tail_len:
+                return pos
+
+        pos = tail.rfind(EOCD_SIG, 0, pos)
+
+    raise BadZipFile("EOCD not found, comment too long or ZIP corrupt?")
+
+
+def _parse_zip64_extra(extra, size, compressed_size, offset):
+    # ZIP64 extra field only holds the values that overflowed, in order
+    unpack_from = struct.unpack_from
+    pos = 0
+    extra_len = len(extra)
+    while pos + EXTRA_F_H_SIZE <= extra_len:
+        header_id, data_len = unpack_from(EXTRA_F_H_STRUCT, extra, pos)
+        pos += EXTRA_F_H_SIZE
+        if header_id == ZIP64_EXTRA_ID:
+            if size == ZIP64_LIMIT:
+                size = unpack_from('<Q', extra, pos)[0]
+                pos += 8
+            if compressed_size == ZIP64_LIMIT:
+                compressed_size = unpack_from('<Q', extra, pos)[0]
+                pos += 8
+            if offset == ZIP64_LIMIT:
+                offset = unpack_from('<Q', extra, pos)[0]
+            return size, compressed_size, offset
+
+        pos += data_len
+
+    raise BadZipFile("Missing ZIP64 extra field, ZIP corrupt?")
+
+
 class ZipFile:
-    def __init__(self, file_obj):
+    def __init__(self, file_obj, max_comment_len=MAX_COMMENT_LEN):
         self.file_obj = file_obj
-        file_obj.seek(-EOCD_SIZE, SEEK_END)
-        (magic_number,
+        self._chunk_buf = None
+
+        # One buffered tail read covers EOCD, comment and ZIP64 locator
+        file_size = file_obj.seek(0, SEEK_END)
+        tail_len = min(file_size,
+                       ZIP64_EOCD_LOC_SIZE + EOCD_SIZE + max_comment_len)
+        file_obj.seek(file_size - tail_len)
+        tail = file_obj.read(tail_len)
+
+        eocd_pos = _find_eocd(tail)
+        (_,  # Magic number, checked by _find_eocd
          num_disks,
          _, _,  # Per disk stuff, we don't care
          central_dir_count,
          central_dir_size,
          central_dir_offset,
-         comment_len) = struct.unpack(EOCD_STRUCT, file_obj.read(EOCD_SIZE))
+         _) = struct.unpack_from(EOCD_STRUCT, tail, eocd_pos)
 
-        if magic_number != EOCD_SIG:
-            raise BadZipFile(
-                "EOCD contains comment or ZIP corrupt?")
         if num_disks:
             raise BadZipFile(
                 "Multipart/disk ZIPs not supported")
 
+        loc_pos = eocd_pos - ZIP64_EOCD_LOC_SIZE
+        self.zip64 = (loc_pos >= 0
+                      and tail[loc_pos:eocd_pos].startswith(ZIP64_EOCD_LOC_SIG))
+        if self.zip64:
+            (central_dir_count,
+             central_dir_size,
+             central_dir_offset) = self._read_zip64_eocd(
+                 tail, loc_pos, file_size - tail_len)
+
         logging.debug("Central dir contains %s entries", central_dir_count)
-        self.entries = OrderedDict()
+        self._read_central_dir(central_dir_offset, central_dir_size,
+                               central_dir_count)
+
+    def _read_zip64_eocd(self, tail, loc_pos, tail_offset):
+        (_,
+         _,  # Disk with ZIP64 EOCD
+         zip64_eocd_offset,
+         num_disks) = struct.unpack_from(ZIP64_EOCD_LOC_STRUCT, tail, loc_pos)
+        if num_disks > 1:
+            raise BadZipFile(
+                "Multipart/disk ZIPs not supported")
+
+        # ZIP64 EOCD is normally right in front of the locator, in the tail
+        rel_offset = zip64_eocd_offset - tail_offset
+        if 0 <= rel_offset and rel_offset + ZIP64_EOCD_SIZE <= loc_pos:
+            zip64_eocd = tail[rel_offset:rel_offset + ZIP64_EOCD_SIZE]
+        else:
+            file_obj = self.file_obj
+            file_obj.seek(zip64_eocd_offset)
+            zip64_eocd = file_obj.read(ZIP64_EOCD_SIZE)
+
+        (sig,
+         _,  # Size of ZIP64 EOCD record
+         _, _,  # Compressor and min version, we don't care
+         _, _,  # Per disk stuff, we don't care
+         _,  # Entries on this disk
+         central_dir_count,
+         central_dir_size,
+         central_dir_offset) = struct.unpack(ZIP64_EOCD_STRUCT, zip64_eocd)
+        if sig != ZIP64_EOCD_SIG:
+            raise BadZipFile("ZIP64 EOCD signature mismatch, ZIP corrupt?")
+
+        return central_dir_count, central_dir_size, central_dir_offset
+
+    def _read_central_dir(self, central_dir_offset, central_dir_size,
+                          central_dir_count):
+        # Compact index: names plus parallel arrays, one slot per member.
+        # Sizes and offsets only widen to 64-bit once a value needs it
+        self.names = names = []
+        self._name_index = name_index = {}
+        self._compress_methods = compress_methods = array('B')
+        self._crc32s = crc32s = array('L')
+        self._compressed_sizes = compressed_sizes = array('L')
+        self._sizes = sizes = array('L')
+        self._offsets = offsets = array('L')
+        wide = False
+
+        # Whole central directory in one read, parsed in place
+        file_obj = self.file_obj
         file_obj.seek(central_dir_offset)
-        for i in range(central_dir_count):
-            logging.debug("Reading CD_F_H %s", i)
-            zi = ZipInfo(file_obj.read(CD_F_H_SIZE))
-            zi.name = file_obj.read(zi.filename_len).decode()
-            self.entries[zi.name] = zi
+        central_dir = memoryview(file_obj.read(central_dir_size))
+        if len(central_dir) != central_dir_size:
+            raise BadZipFile("Central directory truncated, ZIP corrupt?")
+
+        unpack_from = struct.unpack_from
+        pos = 0
+        for idx in range(central_dir_count):
+            if pos + CD_F_H_SIZE > central_dir_size:
+                raise BadZipFile("Central directory truncated, ZIP corrupt?")
+
+            (sig,
+             _, _, _, _,  # Compressor and min version, we don't care
+             _,  # General purpose bit flag?
+             compress_method,
+             _, _,  # Last modification time and date
+             crc,
+             compressed_size,
+             size,
+             filename_len,
+             extra_field_len,
+             comment_len,
+             _,  # Disk number, we only support single part ZIPs
+             _, _,  # File attributes, we don't care
+             offset) = unpack_from(CD_F_H_STRUCT, central_dir, pos)
+            if sig != CD_F_H_SIG:
+                raise BadZipFile(
+                    "Central directory entry signature mismatch, ZIP corrupt?")
+
+            pos += CD_F_H_SIZE
+            name = str(central_dir[pos:pos + filename_len], 'utf8')
+            pos += filename_len
+            if ZIP64_LIMIT in (size, compressed_size, offset):
+                size, compressed_size, offset = _parse_zip64_extra(
+                    central_dir[pos:pos + extra_field_len],
+                    size, compressed_size, offset)
+                if not wide and max(size, compressed_size,
+                                    offset) > ZIP64_LIMIT:
+                    wide = True
+                    self._compressed_sizes = compressed_sizes = array(
+                        'Q', compressed_sizes)
+                    self._sizes = sizes = array('Q', sizes)
+                    self._offsets = offsets = array('Q', offsets)
+            pos += extra_field_len + comment_len
 
-            # Skip to next entry
-            file_obj.seek(zi.extra_field_len + zi.comment_len, SEEK_CUR)
+            names.append(name)
+            name_index[name] = idx
+            compress_methods.append(compress_method)
+            crc32s.append(crc)
+            compressed_sizes.append(compressed_size)
+            sizes.append(size)
+            offsets.append(offset)
 
     def __iter__(self):
-        yield from self.entries
+        yield from self.names
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, k):
+        return k in self._name_index
 
     def __getitem__(self, k):
-        return self.entries[k]
+        idx = self._name_index[k]
+        return ZipInfo(self.names[idx],
+                       self._compress_methods[idx],
+                       self._crc32s[idx],
+                       self._compressed_sizes[idx],
+                       self._sizes[idx],
+                       self._offsets[idx])
 
-    def read(self, member):
-        zip_info = member if isinstance(member, ZipInfo) else self[member]
+    def getinfo(self, member):
+        return member if isinstance(member, ZipInfo) else self[member]
 
-        # Seek to data, skip local file header
-        self.file_obj.seek(zip_info.offset + LOCAL_F_H_SIZE
-                           + zip_info.filename_len + zip_info.extra_field_len)
+    def _seek_data(self, zip_info):
+        # Seek to data, skip local file header. Its extra field can differ
+        # from the central directory one (e.g. ZIP64), so read its lengths
+        file_obj = self.file_obj
+        file_obj.seek(zip_info.offset)
+        local_header = file_obj.read(LOCAL_F_H_SIZE)
+        if not local_header.startswith(LOCAL_F_H_SIG):
+            raise BadZipFile(
+                "Local header signature mismatch for file {}".format(
+                    zip_info.name))
+
+        filename_len, extra_field_len = struct.unpack_from(
+            '<2H', local_header, LOCAL_F_H_SIZE - 4)
+        file_obj.seek(filename_len + extra_field_len, SEEK_CUR)
+
+    def open(self, member):
+        zip_info = self.getinfo(member)
+        self._seek_data(zip_info)
+        return ZipExtFile(self.file_obj, zip_info)
+
+    def extract_to(self, member, out_f, buf=None):
+        """Stream a member into out_f using a fixed size buffer.
+
+        Without an explicit buf a chunk buffer, allocated once per ZipFile,
+        is reused. Peak memory is bounded by the buffer size instead of
+        the member size.
+        """
+        if buf is None:
+            buf = self._chunk_buf
+            if buf is None:
+                buf = self._chunk_buf = bytearray(CHUNK_SIZE)
+
+        mv = memoryview(buf)
+        written = 0
+        with self.open(member) as member_f:
+            while True:
+                read_len = member_f.readinto(mv)
+                if not read_len:
+                    break
+
+                out_f.write(mv[:read_len])
+                written += read_len
+
+        return written
+
+    def read(self, member):
+        zip_info = self.getinfo(member)
+        self._seek_data(zip_info)
 
         # Read actual data, perform decompression if needed
         comp_data = self.file_obj.read(zip_info.compressed_size)
@@ -119,7 +412,7 @@ class ZipFile:
         elif zip_info.compress_method == COMP_NONE:
             uncomp_data = comp_data  # Data was just stored, not compressed
         else:
-            raise BadZipFile("Unsupported compression method"
+            raise BadZipFile("Unsupported compression method "
                              "for file {}".format(zip_info.name))
 
         # Validate CRC32
@@ -127,3 +420,240 @@ class ZipFile:
             raise BadZipFile("Bad CRC32 for file {}".format(zip_info.name))
 
         return uncomp_data
+
+
+def can_deflate():
+    """Check whether this firmware has deflate compression built in."""
+    global _deflate_compress
+    if _deflate_compress is None:
+        _deflate_compress = False
+        if DeflateIO:
+            try:
+                deflate_f = DeflateIO(BytesIO(), RAW)
+                deflate_f.write(b'\x00')
+                deflate_f.close()
+                _deflate_compress = True
+            except (AttributeError, OSError, NotImplementedError,
+                    ValueError):
+                pass  # Decompression only firmware, no write()
+
+    return _deflate_compress
+
+
+def _dos_datetime():
+    year, month, day, hour, minute, second = localtime()[:6]
+    dos_time = (hour << 11) | (minute << 5) | (second // 2)
+    dos_date = (max(year - 1980, 0) << 9) | (month << 5) | day
+    return dos_time, dos_date
+
+
+class _CountingWriter(IOBase):
+    # Stream wrapper so native DeflateIO output is counted as well
+    def __init__(self, zip_writer):
+        self.zip_writer = zip_writer
+        self.count = 0
+
+    def write(self, data):
+        self.zip_writer._write(data)
+        data_len = len(data)
+        self.count += data_len
+        return data_len
+
+
+class ZipWriteFile:
+    """Write-only stream for a single member of a ZipWriter.
+
+    Sizes and CRC32 are not known up front, they follow the data in a
+    data descriptor, so output never needs to be seekable.
+    """
+    def __init__(self, zip_writer, name, compress_method):
+        self.zip_writer = zip_writer
+        self.name = name
+        self.compress_method = compress_method
+        self.crc = 0
+        self.size = 0
+        self.hasher = None  # Optional extra digest over uncompressed data
+
+        self._counter = counter = _CountingWriter(zip_writer)
+        if compress_method == COMP_DEF:
+            self._stream = DeflateIO(counter, RAW)
+        else:
+            self._stream = counter
+
+    @property
+    def compressed_size(self):
+        return self._counter.count
+
+    def write(self, data):
+        self.crc = crc32(data, self.crc)
+        self.size += len(data)
+        if self.hasher:
+            self.hasher.update(data)
+
+        self._stream.write(data)
+        return len(data)
+
+    def close(self):
+        stream = self._stream
+        if stream is None:
+            return  # Already closed
+
+        if stream is not self._counter:
+            stream.close()  # Flush final deflate block
+
+        self._stream = None
+        self.zip_writer._close_member(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, tb):
+        self.close()
+
+
+class ZipWriter:
+    """Streaming ZIP writer, e.g. straight to flash or a socket.
+
+    Members are written one at a time, the central directory is kept as
+    a compact index and written on close. No ZIP64, so archives are
+    limited to 4 GB and 65535 members.
+    """
+    def __init__(self, file_obj, compress_method=COMP_DEF):
+        self.file_obj = file_obj
+        self.compress_method = compress_method
+        self._pos = 0
+        self._member_f = None
+        self._chunk_buf = None
+
+        # Compact central directory index, like ZipFile
+        self.names = []
+        self._compress_methods = array('B')
+        self._crc32s = array('L')
+        self._compressed_sizes = array('L')
+        self._sizes = array('L')
+        self._offsets = array('L')
+        self._dos_datetimes = array('L')
+
+    def _write(self, data):
+        self.file_obj.write(data)
+        self._pos += len(data)
+
+    def open(self, name, compress_method=None):
+        if self._member_f:
+            raise BadZipFile(
+                "Member {} still open".format(self._member_f.name))
+        if self.file_obj is None:
+            raise BadZipFile("ZipWriter already closed")
+        if len(self.names) >= ZIP64_COUNT_LIMIT:
+            raise BadZipFile("Too many members, ZIP64 not supported")
+
+        if compress_method is None:
+            compress_method = self.compress_method
+        if compress_method == COMP_DEF and not can_deflate():
+            compress_method = COMP_NONE  # Store when deflate is unavailable
+        if compress_method not in (COMP_NONE, COMP_DEF):
+            raise BadZipFile("Unsupported compression method "
+                             "for file {}".format(name))
+
+        dos_time, dos_date = _dos_datetime()
+        encoded_name = name.encode()
+        self.names.append(name)
+        self._compress_methods.append(compress_method)
+        self._offsets.append(self._pos)
+        self._dos_datetimes.append((dos_date << 16) | dos_time)
+
+        # Sizes and CRC32 follow in the data descriptor
+        self._write(struct.pack(LOCAL_F_H_STRUCT,
+                                LOCAL_F_H_SIG,
+                                ZIP_VERSION, 0,
+                                FLAG_DATA_DESCRIPTOR | FLAG_UTF8,
+                                compress_method,
+                                dos_time, dos_date,
+                                0, 0, 0,
+                                len(encoded_name), 0))
+        self._write(encoded_name)
+
+        self._member_f = member_f = ZipWriteFile(self, name, compress_method)
+        return member_f
+
+    def _close_member(self, member_f):
+        compressed_size = member_f.compressed_size
+        size = member_f.size
+        if (compressed_size >= ZIP64_LIMIT or size >= ZIP64_LIMIT
+                or self._pos > ZIP64_LIMIT):
+            raise BadZipFile("Member {} too large, ZIP64 not supported".format(
+                member_f.name))
+
+        self._write(struct.pack(DATA_DESCRIPTOR_STRUCT,
+                                DATA_DESCRIPTOR_SIG,
+                                member_f.crc, compressed_size, size))
+        self._crc32s.append(member_f.crc)
+        self._compressed_sizes.append(compressed_size)
+        self._sizes.append(size)
+        self._member_f = None
+
+    def writestr(self, name, data, compress_method=None):
+        if isinstance(data, str):
+            data = data.encode()
+
+        with self.open(name, compress_method) as member_f:
+            member_f.write(data)
+
+    def write(self, path, arcname=None, compress_method=None):
+        # Copy a file through a fixed chunk buffer, reused across members
+        buf = self._chunk_buf
+        if buf is None:
+            buf = self._chunk_buf = bytearray(CHUNK_SIZE)
+
+        mv = memoryview(buf)
+        with open(path, 'rb') as src_f:
+            with self.open(arcname or path.lstrip('/'),
+                           compress_method) as member_f:
+                while True:
+                    read_len = src_f.readinto(mv)
+                    if not read_len:
+                        break
+
+                    member_f.write(mv[:read_len])
+
+    def close(self):
+        if self.file_obj is None:
+            return  # Already closed
+        if self._member_f:
+            self._member_f.close()
+
+        central_dir_offset = self._pos
+        for idx, name in enumerate(self.names):
+            encoded_name = name.encode()
+            dos_datetime = self._dos_datetimes[idx]
+            self._write(struct.pack(CD_F_H_STRUCT,
+                                    CD_F_H_SIG,
+                                    ZIP_VERSION, 0, ZIP_VERSION, 0,
+                                    FLAG_DATA_DESCRIPTOR | FLAG_UTF8,
+                                    self._compress_methods[idx],
+                                    dos_datetime & 0xFFFF,
+                                    dos_datetime >> 16,
+                                    self._crc32s[idx],
+                                    self._compressed_sizes[idx],
+                                    self._sizes[idx],
+                                    len(encoded_name), 0, 0,
+                                    0, 0,  # Disk number, internal attributes
+                                    0,  # External attributes
+                                    self._offsets[idx]))
+            self._write(encoded_name)
+
+        central_dir_count = len(self.names)
+        self._write(struct.pack(EOCD_STRUCT,
+                                EOCD_SIG,
+                                0, 0,  # Single disk
+                                central_dir_count, central_dir_count,
+                                self._pos - central_dir_offset,
+                                central_dir_offset,
+                                0))
+        self.file_obj = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, tb):
+        self.close()
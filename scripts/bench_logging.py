@@ -0,0 +1,116 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+# Compares records per second of the previous VTSGRColorFormatter against
+# the prebuilt escape fast path, plus the cost of disabled log calls and
+# timestamping.
+# Run on device: mpremote mount . run scripts/mount_enforcer.py \
+#                run scripts/bench_logging.py
+
+import gc
+import logging
+from logging import DEBUG, INFO, WARNING, ERROR
+from utime import ticks_diff, ticks_ms
+
+from mpy_blox.log_handlers.formatter import (FG_BLUE, FG_CYAN, FG_GREY,
+                                             FG_RED, FG_YELLOW, RESET,
+                                             UNDERLINE, VTSGRColorFormatter,
+                                             get_sgr_escape)
+from mpy_blox.time import isotime, rtc
+
+RECORD_COUNT = 200
+
+
+def legacy_isotime():
+    # Replica of isotime before the ticks anchored cache
+    dt_tup = rtc.datetime()
+    subseconds = str(dt_tup[-1])[:3]
+    return "{}-{}-{}T{}:{}:{}.{:0<3}Z".format(
+        *(dt_tup[0:3] + dt_tup[4:-1] + (subseconds,)))
+
+
+class LegacyVTSGRColorFormatter:
+    """Replica of the formatter before the fast path, as baseline."""
+    def format(self, record) -> bytes:
+        formatted_msg = get_sgr_escape(FG_CYAN)
+        formatted_msg += legacy_isotime().encode()
+        formatted_msg += get_sgr_escape(RESET)
+        formatted_msg += b' '
+
+        level = record.levelno
+        if level == DEBUG:
+            formatted_msg += get_sgr_escape(FG_GREY)
+            formatted_msg += b'[debug]'
+        elif level == INFO:
+            formatted_msg += get_sgr_escape(FG_BLUE)
+            formatted_msg += b'[info]'
+        elif level == WARNING:
+            formatted_msg += get_sgr_escape(FG_YELLOW)
+            formatted_msg += b'[warning]'
+        elif level == ERROR:
+            formatted_msg += get_sgr_escape(FG_RED)
+            formatted_msg += b'[error]'
+        else:
+            formatted_msg += get_sgr_escape((UNDERLINE, FG_RED))
+            formatted_msg += b'[critical]'
+        formatted_msg += b' '
+
+        formatted_msg += get_sgr_escape(FG_GREY)
+        formatted_msg += b'['
+        formatted_msg += record.name.encode()
+        formatted_msg += b'] '
+
+        formatted_msg += get_sgr_escape(RESET)
+        return formatted_msg + (record.msg % record.args).encode()
+
+
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        self.formatter.format(record)
+
+
+def bench(name, handler_count, formatter_cls, level=INFO):
+    logger = logging.Logger('bench')
+    logger.setLevel(INFO)
+    for _ in range(handler_count):
+        handler = NullHandler()
+        handler.setFormatter(formatter_cls())
+        logger.addHandler(handler)
+
+    # Keep GC out of the measurement, so mem_alloc shows all allocations
+    gc.collect()
+    gc.disable()
+    alloc_start = gc.mem_alloc()
+    start = ticks_ms()
+    for idx in range(RECORD_COUNT):
+        logger.log(level, "Received message %s on %s", idx, 'bench/topic')
+    duration = ticks_diff(ticks_ms(), start)
+    total_alloc = gc.mem_alloc() - alloc_start
+    gc.enable()
+
+    logging.info("%s: %s records/s, %s bytes alloc/record", name,
+                 RECORD_COUNT * 1000 // max(duration, 1),
+                 total_alloc // RECORD_COUNT)
+
+
+def bench_timestamps(name, isotime_func):
+    start = ticks_ms()
+    for _ in range(RECORD_COUNT):
+        isotime_func()
+    duration = ticks_diff(ticks_ms(), start)
+    logging.info("%s: %s timestamps/s", name,
+                 RECORD_COUNT * 1000 // max(duration, 1))
+
+
+def main():
+    bench_timestamps('legacy isotime', legacy_isotime)
+    bench_timestamps('anchored isotime', isotime)
+    bench('legacy, 1 handler', 1, LegacyVTSGRColorFormatter)
+    bench('fast path, 1 handler', 1, VTSGRColorFormatter)
+    bench('legacy, 3 handlers', 3, LegacyVTSGRColorFormatter)
+    bench('fast path, 3 handlers', 3, VTSGRColorFormatter)
+    bench('disabled level', 1, VTSGRColorFormatter, DEBUG)
+
+
+main()
@@ -0,0 +1,59 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+# Compares one-shot ZipFile.read against streaming ZipFile.extract_to
+# Run on device: mpremote mount . run scripts/mount_enforcer.py \
+#                run scripts/bench_zipfile.py
+
+import gc
+import logging
+from utime import ticks_diff, ticks_ms
+
+from mpy_blox.zipfile import ZipFile
+
+logging.basicConfig(level=logging.INFO)
+
+ZIP_PATH = '/dist/mpy_blox-latest-mpy6-bytecode-esp32.whl'
+
+
+class NullWriter:
+    def write(self, data):
+        return len(data)
+
+
+def bench(name, zip_file, extract):
+    # Keep GC out of the measurement, so mem_alloc shows all allocations
+    gc.collect()
+    gc.disable()
+    alloc_start = gc.mem_alloc()
+    peak_alloc = 0
+    total_size = 0
+    start = ticks_ms()
+    for member in zip_file:
+        member_alloc = gc.mem_alloc()
+        total_size += extract(member)
+        peak_alloc = max(peak_alloc, gc.mem_alloc() - member_alloc)
+    duration = ticks_diff(ticks_ms(), start)
+    total_alloc = gc.mem_alloc() - alloc_start
+    gc.enable()
+    gc.collect()
+
+    logging.info("%s: %s bytes in %s ms (%s kB/s), "
+                 "max alloc/member %s bytes, total alloc %s bytes",
+                 name, total_size, duration,
+                 total_size // max(duration, 1),
+                 peak_alloc, total_alloc)
+
+
+def main():
+    null_writer = NullWriter()
+    with open(ZIP_PATH, 'rb') as f:
+        zip_file = ZipFile(f)
+        bench('read', zip_file,
+              lambda member: len(zip_file.read(member)))
+        bench('extract_to', zip_file,
+              lambda member: zip_file.extract_to(member, null_writer))
+
+
+main()
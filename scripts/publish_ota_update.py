@@ -5,94 +5,374 @@
 import argparse
 import json
 import logging
-import subprocess
+import os
+import threading
+import time
 from hashlib import sha256
 from pathlib import Path
 from tomllib import load
 from typing import cast
 
-PACKAGES_PREFIX = 'mpypi/packages/'
-
-logging.basicConfig(level=logging.INFO)
-
-# Argument parser setup
-parser = argparse.ArgumentParser(
-    description="Publish OTA update to remote device via MQTT")
-parser.add_argument('--device-ids', required=True, nargs='+',
-                    help="List of remote device IDs")
-parser.add_argument('--version', required=False, nargs='?',
-                    default='latest', type=str,
-                    help="Wheel version to deploy")
-parser.add_argument('--extra-src-files', required=False, nargs='*',
-                    default=(), type=Path,
-                    help="List of extra source files")
-parser.add_argument('--dev', action='store_true',
-                    help="Include 'dev' in the version string")
-args = parser.parse_args()
-
-version = cast(str, args.version)
-if version == 'latest':
+import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+PREFIX = 'mpypi/'
+CHANNEL_PREFIX = PREFIX + 'channels/'
+PACKAGES_PREFIX = PREFIX + 'packages/'
+PKG_INFO_PREFIX = PREFIX + 'package_info/'
+NODES_PREFIX = PREFIX + 'nodes/'
+PUBLISHERS_PREFIX = PREFIX + 'publishers/'
+
+PKG_EXPIRY_INTERVAL = 86400  # Keep update files for 24h
+PROBE_TIMEOUT = 10.0  # Seconds for the retained check to round trip
+
+
+def pyproject_version(dev=False) -> str:
     # Grab version from pyproject and append dev when developing
     with open('pyproject.toml', 'rb') as pyproject_f:
         version = load(pyproject_f)['tool']['poetry']['version']
 
-    if args.dev:
-            version += 'dev'
-
-# Calculate the SHA256 checksum of the package
-pkg_path = Path(f'./dist/mpy_blox-{args.version}-mpy6-bytecode-esp32.whl')
-pkg_sha256 = sha256(pkg_path.read_bytes()).hexdigest()
-files_to_publish = [(f'wheel/{pkg_sha256}', pkg_path)]
-
-# Create the JSON structure with the update information
-update_payload = [
-    {
-      'name': 'mpy-blox',
-      'version': version,
-      'type': 'wheel',
-      'pkg_sha256': pkg_sha256
-    }
-]
-
-src_path: Path
-for src_path in args.extra_src_files:
+    if dev:
+        version += 'dev'
+    return version
+
+
+def build_update(version: str, pkg_path: Path, extra_src_files=()):
+    """Build the update list and the package files it refers to."""
     pkg_sha256 = sha256(pkg_path.read_bytes()).hexdigest()
-    rel_path = src_path.relative_to('.')
-    files_to_publish.append((f'src/{rel_path}/{pkg_sha256}',
-                             src_path))
-    update_payload.append({
-        'path': str(rel_path),
-        'type': 'src',
-        'pkg_sha256': pkg_sha256
-    })
-
-# We publish the MQTT messages for this update using mqttx-cli
-# First we send the files, so they are available when the JSON arrives
-for pkg_id, pkg_path in files_to_publish:
-    logging.info("Publishing %s (%s)", pkg_path, pkg_id)
-    with pkg_path.open('rb') as pkg_f:
-        subprocess.run(
-            [
-                'mqttx-cli',
-                'pub', '-t', PACKAGES_PREFIX + pkg_id,
-                '--retain', '--stdin',
-                '--message-expiry-interval', '86400'  # Keep update file for 24h
-            ],
-            stdin=pkg_f
-        )
-
-# Then we distribute the update information to all device IDs
-update_json_bytes = json.dumps(update_payload).encode()
-device_id: str
-for device_id in args.device_ids:
-    logging.info("Commanding device %s", device_id)
-    subprocess.run(
-        [
-            'mqttx-cli',
-            'pub', '-t', f"mpypi/nodes/{device_id}/cmd",
-            '--stdin',
-        ],
-        input=update_json_bytes
-    )
-
-# TODO Add update channels
+    files_to_publish = [(f'wheel/{pkg_sha256}', pkg_path)]
+    update_payload = [
+        {
+          'name': 'mpy-blox',
+          'version': version,
+          'type': 'wheel',
+          'pkg_sha256': pkg_sha256
+        }
+    ]
+
+    src_path: Path
+    for src_path in extra_src_files:
+        src_sha256 = sha256(src_path.read_bytes()).hexdigest()
+        rel_path = src_path.relative_to('.')
+        files_to_publish.append((f'src/{rel_path}/{src_sha256}', src_path))
+        update_payload.append({
+            'path': str(rel_path),
+            'type': 'src',
+            'pkg_sha256': src_sha256
+        })
+
+    return update_payload, files_to_publish
+
+
+class NodeTracker:
+    """Follows node info, install progress and health topics of all nodes."""
+    def __init__(self):
+        self.infos: dict[str, dict] = {}
+        self.progress: dict[str, dict] = {}
+        self.health: dict[str, dict] = {}
+        self.changed = threading.Condition()
+
+    def handle_msg(self, node_id: str, kind: str, payload: dict):
+        with self.changed:
+            if kind == 'info':
+                self.infos[node_id] = payload
+            elif kind == 'progress':
+                self.progress[node_id] = payload
+                logging.info("%s: installing %s %s/%s", node_id,
+                             payload.get('pkg'), payload.get('done'),
+                             payload.get('total'))
+            elif kind == 'health':
+                self.health[node_id] = payload
+            else:
+                return
+
+            self.changed.notify_all()
+
+    def channel_nodes(self, channel: str) -> set[str]:
+        with self.changed:
+            return {node_id for node_id, info in self.infos.items()
+                    if info.get('channel') == channel}
+
+    def has_versions(self, node_id: str, versions: dict[str, str]) -> bool:
+        node_versions = self.infos.get(node_id, {}).get('versions', {})
+        return all(node_versions.get(name) == version
+                   for name, version in versions.items())
+
+    def wait_for_versions(self, node_ids, versions, timeout) -> set[str]:
+        """Wait until nodes report versions, returns the nodes that didn't."""
+        deadline = time.monotonic() + timeout
+        with self.changed:
+            while True:
+                pending = {node_id for node_id in node_ids
+                           if not self.has_versions(node_id, versions)}
+                remaining = deadline - time.monotonic()
+                if not pending or remaining <= 0:
+                    return pending
+
+                self.changed.wait(remaining)
+
+
+class OTAPublisher:
+    """Single persistent MQTT connection for publishing OTA updates."""
+    def __init__(self, host, port, username=None, password=None, tls=False,
+                 client_id=None):
+        self.tracker = NodeTracker()
+        self.published_pkgs: set[str] = set()
+        self._connected = threading.Event()
+        self._probe_received = threading.Event()
+        self._subacks = threading.Condition()
+        self._subacked: set[int] = set()
+
+        client_id = client_id or f'mpypi-publisher-{os.getpid()}'
+        self.probe_topic = f'{PUBLISHERS_PREFIX}{client_id}/probe'
+        self.client = client = mqtt.Client(
+            mqtt.CallbackAPIVersion.VERSION2, client_id=client_id,
+            protocol=mqtt.MQTTv5)
+        if username:
+            client.username_pw_set(username, password)
+        if tls:
+            client.tls_set()
+
+        client.on_connect = self._on_connect
+        client.on_message = self._on_message
+        client.on_subscribe = self._on_subscribe
+        self.host = host
+        self.port = port
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            logging.error("MQTT connection refused: %s", reason_code)
+            return
+
+        logging.info("Connected to %s:%s", self.host, self.port)
+        client.subscribe(NODES_PREFIX + '+/info')
+        client.subscribe(NODES_PREFIX + '+/progress')
+        client.subscribe(NODES_PREFIX + '+/health')
+        self._connected.set()
+
+    def _on_subscribe(self, client, userdata, mid, reason_codes, properties):
+        with self._subacks:
+            self._subacked.add(mid)
+            self._subacks.notify_all()
+
+    def _on_message(self, client, userdata, msg):
+        topic = msg.topic
+        if topic == self.probe_topic:
+            self._probe_received.set()
+            return
+
+        if topic.startswith(PKG_INFO_PREFIX):
+            pkg_id = topic[len(PKG_INFO_PREFIX):]
+            try:
+                info = json.loads(msg.payload) if msg.payload else {}
+            except ValueError:
+                info = {}
+            # The package ID ends with its hash, the info has to match it
+            if msg.retain and pkg_id.endswith('/' + info.get('sha256', '')):
+                self.published_pkgs.add(pkg_id)
+            return
+
+        try:
+            node_id, kind = topic[len(NODES_PREFIX):].split('/', 1)
+            # An empty payload clears a retained message
+            payload = json.loads(msg.payload) if msg.payload else {}
+        except ValueError:
+            logging.warning("Skipping malformed message on %s", topic)
+            return
+
+        self.tracker.handle_msg(node_id, kind, payload)
+
+    def connect(self, timeout=10.0):
+        self.client.connect(self.host, self.port)
+        self.client.loop_start()
+        if not self._connected.wait(timeout):
+            raise TimeoutError(f"Couldn't connect to {self.host}:{self.port}")
+
+    def disconnect(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def _publish(self, topic, payload, retain=False, properties=None):
+        msg_info = self.client.publish(topic, payload, qos=1, retain=retain,
+                                       properties=properties)
+        msg_info.wait_for_publish()
+
+    def _subscribe(self, topics, timeout=PROBE_TIMEOUT):
+        _, mid = self.client.subscribe([(topic, 1) for topic in topics])
+        with self._subacks:
+            if not self._subacks.wait_for(lambda: mid in self._subacked,
+                                          timeout):
+                raise TimeoutError("Subscription wasn't acknowledged")
+
+    def sync_retained(self, topics=()):
+        """Subscribe to topics, returning once their retained messages and
+        those of earlier subscriptions are received, False on a timeout.
+
+        Retained messages are sent right after the SUBACK and the broker
+        handles our packets in order, so they're all in once our own
+        probe message comes back.
+        """
+        topics = list(topics) + [self.probe_topic]
+        self._probe_received.clear()
+        self._subscribe(topics)
+        self._publish(self.probe_topic, b'probe')
+        try:
+            return self._probe_received.wait(PROBE_TIMEOUT)
+        finally:
+            self.client.unsubscribe(topics)
+
+    def find_published_pkgs(self, pkg_ids):
+        """Check which packages the broker still retains, by their small
+        info messages instead of downloading the packages themselves."""
+        pkg_ids = set(pkg_ids)
+        if not self.sync_retained(PKG_INFO_PREFIX + pkg_id
+                                  for pkg_id in pkg_ids):
+            logging.warning("Retained check timed out, publishing all")
+            return set()
+
+        return self.published_pkgs.intersection(pkg_ids)
+
+    def publish_packages(self, files_to_publish, skip_published=False):
+        skip_pkgs = set()
+        if skip_published:
+            skip_pkgs = self.find_published_pkgs(
+                pkg_id for pkg_id, _ in files_to_publish)
+
+        expiry = Properties(PacketTypes.PUBLISH)
+        expiry.MessageExpiryInterval = PKG_EXPIRY_INTERVAL
+        for pkg_id, pkg_path in files_to_publish:
+            if pkg_id in skip_pkgs:
+                logging.info("Skipping %s (%s), already on broker",
+                             pkg_path, pkg_id)
+                continue
+
+            logging.info("Publishing %s (%s)", pkg_path, pkg_id)
+            pkg_data = pkg_path.read_bytes()
+            self._publish(PACKAGES_PREFIX + pkg_id, pkg_data,
+                          retain=True, properties=expiry)
+
+            # Expires together with the package
+            pkg_info = {'sha256': sha256(pkg_data).hexdigest(),
+                        'size': len(pkg_data)}
+            self._publish(PKG_INFO_PREFIX + pkg_id,
+                          json.dumps(pkg_info).encode(),
+                          retain=True, properties=expiry)
+
+    def publish_channel(self, channel, update_payload):
+        logging.info("Publishing update list to channel %s", channel)
+        self._publish(CHANNEL_PREFIX + channel,
+                      json.dumps(update_payload).encode(), retain=True)
+
+    def clear_health(self, device_ids):
+        """Drop retained health reports, so only fresh ones are seen."""
+        for device_id in device_ids:
+            self._publish(f'{NODES_PREFIX}{device_id}/health', b'',
+                          retain=True)
+
+    def command_devices(self, device_ids, update_payload):
+        update_json_bytes = json.dumps(update_payload).encode()
+        for device_id in device_ids:
+            logging.info("Commanding device %s", device_id)
+            self._publish(f'{NODES_PREFIX}{device_id}/cmd', update_json_bytes)
+
+
+def add_connection_args(parser):
+    parser.add_argument('--host', default='localhost',
+                        help="MQTT broker hostname")
+    parser.add_argument('--port', default=1883, type=int,
+                        help="MQTT broker port")
+    parser.add_argument('--username', help="MQTT username")
+    parser.add_argument('--password',
+                        default=os.environ.get('MQTT_PASSWORD'),
+                        help="MQTT password, defaults to $MQTT_PASSWORD")
+    parser.add_argument('--tls', action='store_true',
+                        help="Connect using TLS")
+
+
+def add_update_args(parser):
+    parser.add_argument('--version', required=False, nargs='?',
+                        default='latest', type=str,
+                        help="Wheel version to deploy")
+    parser.add_argument('--extra-src-files', required=False, nargs='*',
+                        default=(), type=Path,
+                        help="List of extra source files")
+    parser.add_argument('--dev', action='store_true',
+                        help="Include 'dev' in the version string")
+    parser.add_argument('--skip-published', action='store_true',
+                        help="Skip packages the broker still retains with "
+                             "the same hash, whole packages are still sent")
+
+
+def publisher_from_args(args) -> OTAPublisher:
+    publisher = OTAPublisher(args.host, args.port,
+                             args.username, args.password, args.tls)
+    publisher.connect()
+    return publisher
+
+
+def update_from_args(args):
+    version = cast(str, args.version)
+    if version == 'latest':
+        version = pyproject_version(args.dev)
+
+    pkg_path = Path(f'./dist/mpy_blox-{version}-mpy6-bytecode-esp32.whl')
+    return build_update(version, pkg_path, args.extra_src_files)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(
+        description="Publish OTA update to remote devices via MQTT")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--device-ids', nargs='+',
+                        help="List of remote device IDs to command")
+    target.add_argument('--channel',
+                        help="Update channel to publish the update list to")
+    add_update_args(parser)
+    add_connection_args(parser)
+    parser.add_argument('--wait', default=0, type=float,
+                        help="Seconds to track nodes reporting the update")
+    args = parser.parse_args()
+
+    update_payload, files_to_publish = update_from_args(args)
+    publisher = publisher_from_args(args)
+    try:
+        node_ids = args.device_ids
+        if args.wait and args.channel:
+            # Retained node info tells which nodes listen to the channel
+            if not publisher.sync_retained():
+                logging.warning("Node info may be incomplete, sync timed out")
+            node_ids = publisher.tracker.channel_nodes(args.channel)
+            if not node_ids:
+                logging.error("No nodes known on channel %s to wait for",
+                              args.channel)
+                raise SystemExit(1)
+
+        # First we send the files, so they are available when the list arrives
+        publisher.publish_packages(files_to_publish, args.skip_published)
+
+        if args.channel:
+            publisher.publish_channel(args.channel, update_payload)
+        else:
+            publisher.command_devices(args.device_ids, update_payload)
+
+        if args.wait:
+            versions = {entry['name']: entry['version']
+                        for entry in update_payload
+                        if entry['type'] == 'wheel'}
+            logging.info("Waiting for %s node(s) to report %s",
+                         len(node_ids), versions)
+            pending = publisher.tracker.wait_for_versions(
+                node_ids, versions, args.wait)
+            for node_id in sorted(pending):
+                logging.error("%s did not report the update", node_id)
+            if pending:
+                raise SystemExit(1)
+    finally:
+        publisher.disconnect()
+
+
+if __name__ == '__main__':
+    main()
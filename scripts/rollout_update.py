@@ -0,0 +1,132 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import argparse
+import logging
+import time
+
+from publish_ota_update import (NodeTracker, add_connection_args,
+                                add_update_args, publisher_from_args,
+                                update_from_args)
+
+
+def waves(node_ids, canary, concurrency):
+    """Split nodes in a canary wave followed by waves of concurrency size."""
+    if canary:
+        yield node_ids[:canary]
+        node_ids = node_ids[canary:]
+
+    for idx in range(0, len(node_ids), concurrency):
+        yield node_ids[idx:idx + concurrency]
+
+
+def wait_for_wave(tracker: NodeTracker, node_ids, versions, timeout):
+    """Wait for health reports of a wave, returns (healthy, failed) nodes."""
+    deadline = time.monotonic() + timeout
+    healthy = set()
+    failed = set()
+    with tracker.changed:
+        while True:
+            for node_id in set(node_ids) - healthy - failed:
+                status = tracker.health.get(node_id, {}).get('status')
+                if status is None:
+                    continue  # No fresh report yet
+
+                if status == 'ok' and tracker.has_versions(node_id, versions):
+                    logging.info("%s: updated and healthy", node_id)
+                    healthy.add(node_id)
+                else:
+                    logging.error("%s: reported unhealthy: %s", node_id,
+                                  tracker.health[node_id])
+                    failed.add(node_id)
+
+            remaining = deadline - time.monotonic()
+            if len(healthy) + len(failed) == len(node_ids):
+                return healthy, failed
+            if remaining <= 0:
+                for node_id in set(node_ids) - healthy - failed:
+                    logging.error("%s: no health report within %ss",
+                                  node_id, timeout)
+                return healthy, set(node_ids) - healthy
+
+            tracker.changed.wait(remaining)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(
+        description="Roll out an OTA update to remote devices in waves")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--device-ids', nargs='+',
+                        help="List of remote device IDs to update")
+    target.add_argument('--channel',
+                        help="Update all nodes registered on this channel, "
+                             "publishes the update list to it on success")
+    add_update_args(parser)
+    add_connection_args(parser)
+    parser.add_argument('--concurrency', default=5, type=int,
+                        help="Number of nodes to update at once")
+    parser.add_argument('--canary', default=1, type=int,
+                        help="Size of the first wave, 0 to disable")
+    parser.add_argument('--timeout', default=600, type=float,
+                        help="Seconds to wait for each wave to report back")
+    parser.add_argument('--max-failures', default=0, type=int,
+                        help="Halt the rollout after more failed nodes")
+    args = parser.parse_args()
+
+    update_payload, files_to_publish = update_from_args(args)
+    versions = {entry['name']: entry['version']
+                for entry in update_payload
+                if entry['type'] == 'wheel'}
+
+    publisher = publisher_from_args(args)
+    tracker = publisher.tracker
+    try:
+        # Collect retained node info first, to know who's out there
+        if not publisher.sync_retained():
+            logging.warning("Node info may be incomplete, sync timed out")
+        node_ids = args.device_ids or tracker.channel_nodes(args.channel)
+        pending_ids = []
+        for node_id in sorted(node_ids):
+            if tracker.has_versions(node_id, versions):
+                logging.info("%s: already up to date", node_id)
+            else:
+                pending_ids.append(node_id)
+
+        logging.info("Rolling out %s to %s node(s)", versions,
+                     len(pending_ids))
+        if pending_ids:
+            publisher.publish_packages(files_to_publish, args.skip_published)
+
+        failures = set()
+        for wave_idx, wave in enumerate(
+                waves(pending_ids, args.canary, args.concurrency)):
+            logging.info("Wave %s: %s", wave_idx, ', '.join(wave))
+            publisher.clear_health(wave)
+            publisher.command_devices(wave, update_payload)
+            _, failed = wait_for_wave(tracker, wave, versions, args.timeout)
+            failures |= failed
+            if len(failures) > args.max_failures:
+                not_updated = pending_ids[pending_ids.index(wave[-1]) + 1:]
+                logging.error("Halting rollout after %s failure(s), "
+                              "%s node(s) not updated: %s", len(failures),
+                              len(not_updated), ', '.join(not_updated))
+                raise SystemExit(1)
+
+        if args.channel:
+            # Nodes joining later pick up the update from the channel
+            publisher.publish_channel(args.channel, update_payload)
+
+        if failures:
+            logging.warning("Rollout finished with failed node(s): %s",
+                            ', '.join(sorted(failures)))
+        else:
+            logging.info("Rollout finished")
+    finally:
+        publisher.disconnect()
+
+
+if __name__ == '__main__':
+    main()
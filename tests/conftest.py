@@ -0,0 +1,285 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+# Minimal fakes of the MicroPython/ESP32 modules, so the pure Python
+# parts of mpy_blox can be tested on CPython.
+
+import asyncio
+import builtins
+import collections
+import gc
+import hashlib
+import io
+import socket
+import sys
+import time
+import traceback
+import zlib
+from calendar import timegm
+from types import ModuleType
+
+import pytest
+
+
+def fake_module(name, **attrs):
+    module = ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+# MicroPython extras of builtin modules
+sys.print_exception = lambda e, file=None: traceback.print_exception(
+    e, file=file)
+gc.mem_free = lambda: 100000
+gc.mem_alloc = lambda: 50000
+asyncio.sleep_ms = lambda ms: asyncio.sleep(ms / 1000)
+asyncio.wait_for_ms = lambda aw, ms: asyncio.wait_for(aw, ms / 1000)
+
+
+# micropython
+fake_module('micropython', const=lambda x: x, viper=lambda f: f,
+            native=lambda f: f)
+
+
+# utime, with a fake ticks clock tests can advance
+TICKS_MAX = 0x3FFFFFFF
+
+
+class FakeClock:
+    ticks = 1000
+    epoch_ms = 1767225600000  # 2026-01-01 00:00:00 UTC at ticks 0
+
+
+def ticks_ms():
+    return FakeClock.ticks & TICKS_MAX
+
+
+def ticks_diff(a, b):
+    d = (a - b) & TICKS_MAX
+    return d - TICKS_MAX - 1 if d & 0x20000000 else d
+
+
+fake_module('utime', gmtime=time.gmtime, localtime=time.gmtime,
+            ticks_ms=ticks_ms, ticks_diff=ticks_diff,
+            ticks_us=lambda: (FakeClock.ticks * 1000) & TICKS_MAX,
+            time=lambda: (FakeClock.epoch_ms + FakeClock.ticks) // 1000,
+            time_ns=lambda: (FakeClock.epoch_ms
+                             + FakeClock.ticks) * 1000000,
+            sleep_ms=lambda ms: None)
+
+
+# machine
+class RTC:
+    def datetime(self, dt):
+        year, month, day, _, hour, minute, second, us = dt
+        FakeClock.epoch_ms = (
+            timegm((year, month, day, hour, minute, second)) * 1000
+            + us // 1000 - FakeClock.ticks)
+
+    def memory(self, *args):
+        if args:
+            RTC.mem = bytes(args[0])
+        return getattr(RTC, 'mem', b'')
+
+
+fake_module('machine', RTC=RTC, WDT=object, DEEPSLEEP_RESET=4,
+            unique_id=lambda: b'\x84\x0d\x8e\xd2\x97\x60',
+            reset=lambda: None, reset_cause=lambda: 0)
+
+
+# esp32 NVS, one shared store so a new instance sees committed data
+ESP_ERR_NVS_NOT_FOUND = -4354
+ESP_ERR_NVS_INVALID_LENGTH = -4364
+
+
+class NVS:
+    store = {}
+
+    def __init__(self, namespace):
+        self.data = NVS.store.setdefault(namespace, {})
+
+    def _get(self, key):
+        try:
+            return self.data[key]
+        except KeyError:
+            raise OSError(ESP_ERR_NVS_NOT_FOUND)
+
+    def get_i32(self, key):
+        return self._get(key)
+
+    def set_i32(self, key, value):
+        self.data[key] = value
+
+    def get_blob(self, key, buf):
+        value = self._get(key)
+        if len(value) > len(buf):
+            raise OSError(ESP_ERR_NVS_INVALID_LENGTH)
+        buf[:len(value)] = value
+        return len(value)
+
+    def set_blob(self, key, value):
+        assert len(key) <= 15
+        self.data[key] = bytes(value)
+
+    def erase_key(self, key):
+        self._get(key)
+        del self.data[key]
+
+    def commit(self):
+        pass
+
+
+fake_module('esp32', NVS=NVS)
+
+
+# network, a station interface connecting to the APs tests set up
+STAT_IDLE, STAT_CONNECTING, STAT_WRONG_PASSWORD = 1000, 1001, 202
+STAT_NO_AP_FOUND, STAT_CONNECT_FAIL, STAT_GOT_IP = 201, 203, 1010
+
+
+class WLAN:
+    aps = []  # Scan results: (ssid, bssid, channel, RSSI, security, hidden)
+    reachable = None  # BSSIDs that can be connected to, None for any
+    instance = None
+
+    def __init__(self, interface):
+        self.connected = False
+        self._status = STAT_IDLE
+        self._ifconfig = ('10.0.0.2', '255.255.255.0', '10.0.0.1',
+                          '10.0.0.1')
+        self.connects = []
+        self.scans = 0
+        WLAN.instance = self
+
+    def active(self, *args):
+        return True
+
+    def config(self, *args, **kwargs):
+        pass
+
+    def scan(self):
+        self.scans += 1
+        return list(WLAN.aps)
+
+    def connect(self, ssid, psk, bssid=None):
+        self.connects.append((ssid, bssid))
+        reachable = WLAN.reachable
+        if bssid and reachable is not None and bssid not in reachable:
+            self._status = STAT_NO_AP_FOUND
+        else:
+            self.connected = True
+            self._status = STAT_GOT_IP
+
+    def disconnect(self):
+        self.connected = False
+        self._status = STAT_IDLE
+
+    def isconnected(self):
+        return self.connected
+
+    def status(self):
+        return self._status
+
+    def ifconfig(self, *args):
+        if args and args[0] != 'dhcp':
+            self._ifconfig = args[0]
+        return self._ifconfig
+
+
+fake_module('network', WLAN=WLAN, STA_IF=0, STAT_IDLE=STAT_IDLE,
+            STAT_CONNECTING=STAT_CONNECTING,
+            STAT_WRONG_PASSWORD=STAT_WRONG_PASSWORD,
+            STAT_NO_AP_FOUND=STAT_NO_AP_FOUND,
+            STAT_CONNECT_FAIL=STAT_CONNECT_FAIL, STAT_GOT_IP=STAT_GOT_IP)
+
+
+# ucryptolib, a reversible stand-in for AES-CBC
+class aes:
+    def __init__(self, key, mode, iv):
+        self.mask = key[0] ^ iv[0]
+
+    def encrypt(self, data):
+        if isinstance(data, str):
+            data = data.encode('latin1')
+        return bytes(b ^ self.mask for b in data)
+
+    decrypt = encrypt
+
+
+fake_module('ucryptolib', aes=aes)
+
+
+# deflate, raw streams only, over zlib
+class DeflateIO:
+    def __init__(self, stream, fmt):
+        self.stream = stream
+        self._inflate = zlib.decompressobj(fmt)
+        self._deflate = None
+        self._pending = b''
+
+    def readinto(self, buf):
+        while not self._pending and not self._inflate.eof:
+            data = self.stream.read(64)
+            if not data:
+                break
+            self._pending = self._inflate.decompress(data)
+
+        read_len = min(len(buf), len(self._pending))
+        buf[:read_len] = self._pending[:read_len]
+        self._pending = self._pending[read_len:]
+        return read_len
+
+    def write(self, data):
+        if self._deflate is None:
+            self._deflate = zlib.compressobj(wbits=-15)
+        self.stream.write(self._deflate.compress(bytes(data)))
+        return len(data)
+
+    def close(self):
+        if self._deflate:
+            self.stream.write(self._deflate.flush())
+
+
+fake_module('deflate', DeflateIO=DeflateIO, RAW=-15)
+fake_module('uhashlib', sha256=hashlib.sha256)
+fake_module('ucollections', deque=collections.deque,
+            namedtuple=collections.namedtuple,
+            OrderedDict=collections.OrderedDict)
+fake_module('uio', BytesIO=io.BytesIO, StringIO=io.StringIO)
+fake_module('usocket', **{name: getattr(socket, name)
+                          for name in ('socket', 'getaddrinfo', 'AF_INET',
+                                       'SOCK_DGRAM', 'SOCK_STREAM')})
+
+# Viper pointer annotations
+builtins.ptr8 = builtins.ptr16 = builtins.ptr32 = object
+
+# The MQTT client doesn't compile on CPython, tests don't need a broker
+fake_module('mpy_blox.mqtt.protocol.client', MQTT5Client=object)
+
+# Repo root, for mpy_blox and the bundled logging package
+sys.path.insert(0, __file__.rsplit('/', 2)[0])
+for name in [name for name in sys.modules
+             if name == 'logging' or name.startswith('logging.')]:
+    del sys.modules[name]
+
+
+@pytest.fixture
+def nvs_store():
+    NVS.store.clear()
+    yield NVS.store
+    NVS.store.clear()
+
+
+@pytest.fixture
+def clock():
+    yield FakeClock
+
+
+@pytest.fixture
+def wlan():
+    WLAN.aps = []
+    WLAN.reachable = None
+    WLAN.instance = None
+    yield WLAN
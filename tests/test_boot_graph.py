@@ -0,0 +1,94 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import asyncio
+
+import pytest
+
+from mpy_blox.boot_graph import BootGraph
+from mpy_blox.boot_timeline import BootTimeline
+
+
+def stage(events, name, result=None, delay=0):
+    async def run():
+        events.append(name + ' start')
+        await asyncio.sleep(delay)
+        events.append(name + ' end')
+        return result
+    return run
+
+
+def test_dependencies_first_others_concurrent():
+    events = []
+    graph = BootGraph()
+    graph.add('wlan', stage(events, 'wlan', 'wlan_if', 0.01))
+    graph.add('hw', stage(events, 'hw'))
+    graph.add('mqtt', stage(events, 'mqtt', 'conn'), 'wlan')
+    asyncio.run(graph.run())
+
+    assert events.index('mqtt start') > events.index('wlan end')
+    assert events.index('hw end') < events.index('wlan end')  # Overlapped
+    assert graph.result('mqtt') == 'conn'
+    assert graph.result('missing') is None
+
+
+def test_false_skips_dependents():
+    events = []
+    graph = BootGraph()
+    graph.add('wlan', stage(events, 'wlan', False))
+    graph.add('ntp', stage(events, 'ntp'), 'wlan')
+    graph.add('mqtt', stage(events, 'mqtt'), 'wlan', 'ntp')
+    graph.add('hw', stage(events, 'hw'))
+    asyncio.run(graph.run())
+
+    assert events == ['wlan start', 'hw start', 'wlan end', 'hw end']
+    assert not graph.stages['mqtt'].ok
+
+
+def test_none_result_is_ok():
+    events = []
+    graph = BootGraph()
+    graph.add('ntp', stage(events, 'ntp', None))
+    graph.add('mqtt', stage(events, 'mqtt'), 'ntp')
+    asyncio.run(graph.run())
+    assert 'mqtt end' in events
+
+
+def test_exception_aborts_boot():
+    events = []
+
+    async def fail():
+        raise RuntimeError("no flash")
+
+    graph = BootGraph()
+    graph.add('config', fail)
+    graph.add('slow', stage(events, 'slow', delay=1))
+    graph.add('after', stage(events, 'after'), 'config')
+    with pytest.raises(RuntimeError):
+        asyncio.run(graph.run())
+    assert 'slow end' not in events and 'after start' not in events
+
+
+def test_unknown_dependency():
+    graph = BootGraph()
+    with pytest.raises(ValueError):
+        graph.add('mqtt', stage([], 'mqtt'), 'wlan')
+
+
+def test_timeline(clock):
+    timeline = BootTimeline()
+    clock.ticks += 5
+    with timeline.phase('config'):
+        clock.ticks += 20
+    with timeline.phase('wlan'):
+        clock.ticks += 300
+    assert not timeline.done
+    timeline.finish()
+
+    timeline_dict = timeline.as_dict()
+    assert timeline_dict['done']
+    assert timeline_dict['total_ms'] == 325
+    assert [phase[:3] for phase in timeline_dict['phases']] == [
+        ('config', 5, 20), ('wlan', 25, 300)]
+    assert timeline_dict['phases'][0][3:] == (100000, 100000)  # Heap free
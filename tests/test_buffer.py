@@ -0,0 +1,55 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import pytest
+
+from mpy_blox.buffer import PreAllocatedByteRing
+
+
+def test_wraparound_drops_oldest():
+    ring = PreAllocatedByteRing(32)
+    for idx in range(10):
+        ring.append(bytes([idx]) * 6)  # 8 bytes with length prefix
+
+    # Four records fill the ring exactly
+    records = [bytes(record) for record in ring]
+    assert records == [bytes([idx]) * 6 for idx in range(6, 10)]
+    assert ring.dropped == 6
+    assert len(ring) == 4
+
+
+def test_variable_lengths_wrap():
+    ring = PreAllocatedByteRing(64)
+    written = []
+    for idx in range(50):
+        record = bytes([idx]) * (1 + idx % 13)
+        ring.append(record)
+        written.append(record)
+
+        records = [bytes(record) for record in ring]
+        assert records == written[len(written) - len(records):]
+        assert records[-1] == record
+
+
+def test_oversize_record():
+    ring = PreAllocatedByteRing(16)
+    ring.append(b'keep')
+    with pytest.raises(ValueError):
+        ring.append(bytes(15))
+    assert [bytes(record) for record in ring] == [b'keep']
+
+    ring.append(bytes(12))  # Exactly fits, with length and wrap marker
+    assert len(ring) == 1
+
+
+def test_iterator_resumes_after_drops():
+    ring = PreAllocatedByteRing(32)
+    for idx in range(3):
+        ring.append(bytes([idx]) * 6)
+
+    records = iter(ring)
+    assert bytes(next(records)) == bytes(6)
+    for idx in range(3, 6):
+        ring.append(bytes([idx]) * 6)  # Drops 0 and the unread 1
+    assert [bytes(record)[0] for record in records] == [2, 3, 4, 5]
@@ -0,0 +1,69 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from logging import ERROR, WARNING, Handler, getLogger
+
+from mpy_blox.log_handlers.limiter import SUMMARY_INTERVAL_MS, LogLimiter
+
+
+class ListHandler(Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record.levelno, record.msg % record.args))
+
+
+def limited_logger(name, level):
+    logger = getLogger(name)
+    logger.setLevel(level)
+    logger.limiter = LogLimiter(rate=1, period_ms=60000)
+    logger.handlers = [ListHandler()]
+    return logger
+
+
+def test_summary_respects_level(clock):
+    # Limited, but above WARNING so the summary can't be emitted yet
+    level = WARNING + 5
+    logger = limited_logger('limited_high', level)
+    for _ in range(5):
+        logger.log(level, "storm")
+    clock.ticks += SUMMARY_INTERVAL_MS + 61000
+    logger.log(level, "after")
+
+    records = logger.handlers[0].records
+    assert records == [(level, "storm"), (level, "after")]
+    assert logger.limiter.suppressed == 4  # Kept till it can be reported
+
+    logger.setLevel(WARNING)
+    clock.ticks += 61000
+    logger.log(level, "lowered")
+    assert records[2:] == [(WARNING, "4 records suppressed"),
+                           (level, "lowered")]
+
+
+def test_errors_always_pass(clock):
+    logger = limited_logger('limited_error', WARNING)
+    logger.limiter.sample = 3
+    for _ in range(5):
+        logger.error("storm")
+    logger.warning("first")
+    logger.warning("second")
+
+    assert logger.handlers[0].records == [(ERROR, "storm")] * 5 + [
+        (WARNING, "first")]
+    assert logger.limiter.suppressed == 1
+
+
+def test_summary_at_warning(clock):
+    logger = limited_logger('limited_warning', WARNING)
+    for _ in range(3):
+        logger.warning("storm")
+    clock.ticks += SUMMARY_INTERVAL_MS + 61000
+    logger.warning("after")
+
+    assert logger.handlers[0].records == [
+        (WARNING, "storm"), (WARNING, "2 records suppressed"),
+        (WARNING, "after")]
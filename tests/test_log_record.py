@@ -0,0 +1,57 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from mpy_blox.log_handlers.record import (INLINE_ID, MAX_INTERN_LEN,
+                                          LogRecordBuffer, LogStringTable)
+from mpy_blox.time import anchor_time, log_time
+
+
+def messages(buffer):
+    return [(name, message) for _, _, name, message in buffer.records()]
+
+
+def test_records_wrap(clock):
+    anchor_time()
+    buffer = LogRecordBuffer(128)
+    for idx in range(20):
+        buffer.append(log_time(), 20, 'app', "value %s", (idx,))
+
+    assert messages(buffer)[-1] == ('app', "value 19")
+    assert len(buffer) < 20
+    assert buffer.ring.dropped == 20 - len(buffer)
+
+
+def test_oversize_record_skipped(clock):
+    anchor_time()
+    buffer = LogRecordBuffer(64)
+    buffer.append(log_time(), 20, 'app', "kept")
+    assert buffer.append(log_time(), 40, 'app', "%s", ('x' * 100,)) == 0
+    assert messages(buffer) == [('app', "kept")]
+
+
+def test_string_table_limits():
+    strings = LogStringTable(max_strings=4, max_bytes=10)
+    assert strings.intern("abcd") == 0
+    assert strings.intern("efgh") == 1
+    assert strings.intern("ijkl") == INLINE_ID  # Over the byte budget
+    assert strings.intern("x" * (MAX_INTERN_LEN + 1)) == INLINE_ID
+    assert strings.intern("name", True) == 2  # Names always interned
+    assert strings.full
+
+
+def test_string_table_evicts_unused(clock):
+    anchor_time()
+    buffer = LogRecordBuffer(256)
+    buffer.strings = LogStringTable(max_strings=8, max_bytes=200)
+    for idx in range(200):
+        buffer.append(log_time(), 20, 'app', "unique message %s" % idx)
+        assert buffer.strings.size <= 200 + len('app')
+
+    # Older messages got evicted to intern recent ones
+    strings = buffer.strings.strings
+    assert "unique message 0" not in strings
+    assert "unique message 199" in strings or len(strings) > 2
+    assert messages(buffer) == [
+        ('app', "unique message %s" % idx)
+        for idx in range(200 - len(buffer), 200)]
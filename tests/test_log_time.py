@@ -0,0 +1,81 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import mpy_blox.time as blox_time
+from mpy_blox.log_handlers.record import LogRecordBuffer
+from mpy_blox.time import (REBASE_MS, anchor_time, epoch_ms, log_base_ms,
+                           log_gen, log_time, step_time)
+
+SMALL_INT_MAX = (1 << 30) - 1  # MicroPython small int on 32-bit ports
+
+
+def advance(clock, ms):
+    # Stay within a reanchor interval per step, like a busy device would
+    while ms > 0:
+        step = min(ms, blox_time.REANCHOR_MS)
+        clock.ticks += step
+        ms -= step
+        log_time()
+
+
+def test_log_time_stays_small(clock):
+    anchor_time()
+    start_ms = epoch_ms()
+    gen = log_gen()
+
+    advance(clock, 2 * REBASE_MS)
+    assert 0 <= log_time() <= SMALL_INT_MAX
+    assert log_gen() != gen  # Rebased along the way
+    assert epoch_ms() - start_ms == 2 * REBASE_MS
+
+
+def test_records_keep_their_base(clock):
+    anchor_time()
+    buffer = LogRecordBuffer(1024)
+    first_ms = epoch_ms()
+    buffer.append(log_time(), 20, 'app', "before %s", ('rebase',))
+
+    advance(clock, REBASE_MS + 1000)
+    second_ms = epoch_ms()
+    buffer.append(log_time(), 20, 'app', "after %s", ('rebase',))
+
+    step_time(3600000)  # New base, like the first NTP sync
+    buffer.append(log_time(), 30, 'app', "stepped")
+
+    timestamps = [record[0] for record in buffer.records()]
+    assert timestamps[:2] == [first_ms, second_ms]
+    assert timestamps[2] == log_base_ms()
+
+
+def test_persisted_roundtrip(clock):
+    anchor_time()
+    buffer = LogRecordBuffer(1024)
+    buffer.append(log_time(), 40, 'app', "value %s", (1,))
+    persisted = buffer.persisted(next(iter(buffer.ring)))
+
+    reloaded = LogRecordBuffer(1024)
+    reloaded.append_persisted(persisted)
+    assert list(reloaded.records()) == list(buffer.records())
+
+
+def test_keepalive_across_ticks_wrap(clock):
+    anchor_time()
+    start_ms = epoch_ms()
+
+    # Two weeks with only the periodic keepalive calling log_time()
+    days = 14
+    for _ in range(days):
+        clock.ticks += blox_time.KEEPALIVE_MS
+        log_time()
+
+    assert clock.ticks > 0x3FFFFFFF  # ticks_ms wrapped
+    assert epoch_ms() - start_ms == days * blox_time.KEEPALIVE_MS
+
+
+def test_long_gap_reanchors_to_rtc(clock):
+    anchor_time()
+    log_time()
+    clock.ticks += 7 * blox_time.KEEPALIVE_MS  # ticks_diff() turns negative
+    rtc_ms = clock.epoch_ms + clock.ticks
+    assert epoch_ms() == rtc_ms
@@ -0,0 +1,32 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from mpy_blox.metrics import MetricsPublisher, counter, histogram
+
+
+class FakeConnection:
+    client_id = 'node'
+
+
+def test_rates_always_present(clock):
+    reads = counter('test_reads')
+    publisher = MetricsPublisher(FakeConnection())
+
+    first = publisher.payload()
+    assert first['test_reads_rate'] == 0  # Same fields from the start
+
+    reads.inc(10)
+    clock.ticks += 2000
+    second = publisher.payload()
+    assert second['test_reads'] == first['test_reads'] + 10
+    assert second['test_reads_rate'] == 5
+    assert set(second) == set(first)
+
+
+def test_histogram_buckets():
+    read_ms = histogram('test_read_ms', (10, 100))
+    for value in (5, 10, 50, 500):
+        read_ms.observe(value)
+    assert read_ms.value == {'le': [10, 100], 'counts': [2, 1, 1],
+                             'count': 4, 'sum': 565}
@@ -0,0 +1,77 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import asyncio
+from logging import DEBUG, getLogger
+
+from mpy_blox.log_handlers import mqtt_log
+from mpy_blox.log_handlers.mqtt_log import MQTTLogHandler
+
+
+def test_transport_debug_not_spooled():
+    handler = MQTTLogHandler(None, level=DEBUG)
+    for name in ('mqtt_proto', 'mqtt', 'app'):
+        logger = getLogger(name)
+        logger.setLevel(DEBUG)
+        logger.addHandler(handler)
+        try:
+            logger.debug("Publishing %s", 'msg')
+        finally:
+            logger.handlers.remove(handler)
+
+    assert [record[2] for record in handler.spool.records()] == ['app']
+
+
+def test_transport_warnings_spooled():
+    handler = MQTTLogHandler(None, level=DEBUG)
+    logger = getLogger('mqtt_proto')
+    logger.addHandler(handler)
+    try:
+        logger.warning("Connection lost")
+    finally:
+        logger.handlers.remove(handler)
+
+    assert len(handler.spool.ring) == 1
+
+
+class FailingConn:
+    client_id = 'node'
+    receive_task = True
+
+    def __init__(self, failures):
+        self.failures = list(failures)
+        self.published = []
+
+    async def publish(self, msg):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.published.append(msg)
+
+
+def test_flush_task_survives_errors(monkeypatch):
+    monkeypatch.setattr(mqtt_log, 'RETRY_DELAY_MS', 1)
+    conn = FailingConn([OSError(), ValueError("bug")])
+    handler = MQTTLogHandler(conn, level=DEBUG, batch_age_ms=1,
+                             compress=False)
+    logger = getLogger('flush')
+    logger.setLevel(DEBUG)
+    logger.addHandler(handler)
+    try:
+        for msg in ("dropped", "shipped"):
+            logger.warning(msg)
+    finally:
+        logger.handlers.remove(handler)
+
+    async def run():
+        task = asyncio.create_task(handler.flush_task())
+        for _ in range(100):
+            await asyncio.sleep(0.001)
+            if conn.published:
+                break
+        task.cancel()
+
+    asyncio.run(run())
+    # OSError retried, the unexpected error dropped the oldest record only
+    assert len(conn.published) == 1
+    assert not len(handler.spool.ring)
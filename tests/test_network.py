@@ -0,0 +1,86 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import asyncio
+
+import pytest
+
+from mpy_blox import network as blox_network
+from mpy_blox.config.schema import compile_settings
+from mpy_blox.network import WLANCache, connect_wlan, scan_best_ap
+
+SETTINGS = {'hostname': 'node', 'wlan.ssid': 'home', 'wlan.psk': 'secret'}
+APS = [
+    (b'home', b'\x00\x00\x00\x00\x00\x01', 1, -70, 3, False),
+    (b'other', b'\x00\x00\x00\x00\x00\x02', 6, -30, 3, False),
+    (b'home', b'\x00\x00\x00\x00\x00\x03', 11, -50, 3, False),
+]
+
+
+def connect(**settings):
+    return asyncio.run(connect_wlan(compile_settings(dict(SETTINGS,
+                                                          **settings))))
+
+
+def test_scan_best_ap(wlan):
+    wlan.aps = APS
+    assert asyncio.run(scan_best_ap(wlan(0), 'home')) == (APS[2][1], 11)
+    assert asyncio.run(scan_best_ap(wlan(0), 'missing')) is None
+
+
+def test_first_boot_scans_and_caches(wlan, nvs_store):
+    wlan.aps = APS
+    assert connect()
+    assert wlan.instance.scans == 1
+    assert wlan.instance.connects == [('home', APS[2][1])]
+    assert WLANCache().load('home')['channel'] == 11
+
+
+def test_cached_ap_skips_scan(wlan, nvs_store):
+    wlan.aps = APS
+    connect()
+
+    assert connect()
+    assert wlan.instance.scans == 0
+    assert wlan.instance.connects == [('home', APS[2][1])]
+
+
+def test_stale_cache_falls_back_to_scan(wlan, nvs_store):
+    wlan.aps = APS
+    connect()
+
+    # Cached AP is gone, another one of the network took over
+    wlan.aps = APS[:2]
+    wlan.reachable = {APS[0][1]}
+    assert connect()
+    assert wlan.instance.scans == 1
+    assert wlan.instance.connects == [('home', APS[2][1]),
+                                      ('home', APS[0][1])]
+    assert WLANCache().load('home')['bssid'] == '000000000001'
+
+
+def test_without_fast_connect_no_scan(wlan, nvs_store):
+    wlan.aps = APS
+    assert connect(**{'wlan.fast_connect': False})
+    assert wlan.instance.scans == 0
+    assert wlan.instance.connects == [('home', None)]
+
+
+def test_returns_once_connected(wlan, nvs_store, monkeypatch):
+    # No settle sleep after connecting, only yields and status polls
+    sleeps = []
+    sleep_ms = asyncio.sleep_ms
+
+    def record_sleep(ms):
+        sleeps.append(ms)
+        return sleep_ms(0)
+    monkeypatch.setattr(blox_network.asyncio, 'sleep_ms', record_sleep)
+
+    wlan.aps = APS
+    assert connect()
+    assert max(sleeps, default=0) <= blox_network.POLL_INTERVAL_MS
+
+
+def test_not_provisioned(wlan):
+    assert connect(**{'wlan.ssid': None}) is False
@@ -0,0 +1,106 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import asyncio
+
+import pytest
+
+from mpy_blox import ntp
+from mpy_blox import time as blox_time
+from mpy_blox.ntp import (DRIFT_GAIN, RESOLVE_TTL_MS, STEP_THRESHOLD_MS,
+                          NTPClient)
+
+
+@pytest.fixture
+def client(clock, monkeypatch):
+    blox_time.anchor_time()
+    monkeypatch.setattr(blox_time, '_drift_ppm', 0)
+    client = NTPClient(['a.pool', 'b.pool'], min_interval=64,
+                       max_interval=1024)
+    client.samples = {}
+
+    async def query(host):
+        return client.samples.get(host)
+    client.query = query
+    return client
+
+
+def sync(client, **samples):
+    client.samples = samples
+    return asyncio.run(client.sync())
+
+
+def test_first_sync_steps(client):
+    before_ms = blox_time.epoch_ms()
+    assert sync(client, **{'a.pool': (500, 40), 'b.pool': (300, 10)})
+    # Lowest delay wins, even with a small offset the first sync steps
+    assert blox_time.epoch_ms() - before_ms == 300
+    assert blox_time.pending_slew_ms() == 0
+    assert client.synced
+
+
+def test_small_offsets_slew_large_ones_step(client, clock):
+    sync(client, **{'a.pool': (0, 10)})
+    before_ms = blox_time.epoch_ms()
+    sync(client, **{'a.pool': (50, 10)})
+    assert blox_time.pending_slew_ms() == 50
+    assert blox_time.epoch_ms() == before_ms  # Not jumped
+
+    sync(client, **{'a.pool': (STEP_THRESHOLD_MS + 1, 10)})
+    assert blox_time.pending_slew_ms() == 0
+    assert blox_time.epoch_ms() - before_ms == STEP_THRESHOLD_MS + 1
+
+
+def test_drift_ema(client, clock):
+    sync(client, **{'a.pool': (0, 10)})
+
+    # Clock fell 100ms behind in 100s, 1000ppm, with nothing left to slew
+    clock.ticks += 100000
+    sync(client, **{'a.pool': (100, 10)})
+    assert blox_time.drift_ppm() == 1000 // DRIFT_GAIN
+
+    # The slew explains the offset, so no further drift correction
+    clock.ticks += 1000
+    sync(client, **{'a.pool': (blox_time.pending_slew_ms(), 10)})
+    assert blox_time.drift_ppm() == 1000 // DRIFT_GAIN
+
+
+def test_interval_adapts(client):
+    sync(client, **{'a.pool': (0, 10)})
+    assert client.interval == 128
+    for _ in range(5):
+        sync(client, **{'a.pool': (0, 10)})
+    assert client.interval == 1024  # Capped
+    sync(client, **{'a.pool': (200, 10)})
+    assert client.interval == 512
+
+
+def test_failed_sync(client):
+    assert not sync(client)
+    assert not client.synced
+
+
+def test_resolve_again(clock, monkeypatch):
+    resolved = []
+
+    def getaddrinfo(host, port, *args):
+        resolved.append(host)
+        return [(None, None, None, None, (host, port))]
+    monkeypatch.setattr(ntp.usocket, 'getaddrinfo', getaddrinfo)
+
+    client = NTPClient(['a.pool'])
+    assert client.addr('a.pool') == ('a.pool', 123)
+    client.addr('a.pool')
+    assert resolved == ['a.pool']  # Cached
+
+    clock.ticks += RESOLVE_TTL_MS
+    client.addr('a.pool')
+    assert resolved == ['a.pool'] * 2  # Expired
+
+    async def query(host):
+        return None
+    client.query = query
+    asyncio.run(client.sync())
+    client.addr('a.pool')
+    assert resolved == ['a.pool'] * 3  # Failed, so resolved again
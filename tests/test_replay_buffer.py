@@ -0,0 +1,92 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import asyncio
+import os
+from logging import INFO, getLogger
+
+import pytest
+
+from mpy_blox.log_handlers.record import frame
+from mpy_blox.log_handlers.replay_buffer import (SEGMENT_PATH, LogSegments,
+                                                 ReplayBufferHandler)
+
+
+@pytest.fixture
+def seg_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def write_records(segments, count, size=20):
+    for idx in range(count):
+        segments.write(frame(bytes([idx]) * (size - 2)))
+    segments.flush()
+
+
+def test_rollover_on_write(seg_dir):
+    segments = LogSegments(segment_size=64, segment_count=3)
+    segments.open()
+    write_records(segments, 10)  # No flush task in between
+    segments.close()
+
+    sizes = [os.path.getsize(SEGMENT_PATH.format(slot)) for slot in range(3)]
+    assert max(sizes) <= 64
+    assert sorted(segments.seqs) == [2, 3, 4]  # Two records per segment
+
+
+def test_recover_on_boot(seg_dir):
+    segments = LogSegments(segment_size=64, segment_count=3)
+    segments.open()
+    write_records(segments, 7)
+    segments.close()
+
+    # Newest segments in time order, appending continues where it was
+    segments = LogSegments(segment_size=64, segment_count=3)
+    records = [bytes(record)[0] for record in segments.load(1000)]
+    assert records == [2, 3, 4, 5, 6]
+    segments.open()
+    assert segments.seqs[segments.slot] == 3
+    write_records(segments, 1)
+    segments.close()
+    assert len(list(LogSegments(64, 3).load(1000))) == 6
+
+
+def test_recover_torn_segment(seg_dir):
+    segments = LogSegments(segment_size=64, segment_count=3)
+    segments.open()
+    write_records(segments, 2)
+    segments.close()
+    with open(SEGMENT_PATH.format(segments.slot), 'ab') as seg_f:
+        seg_f.write(b'\x30\x00torn')  # Power loss mid record
+
+    segments = LogSegments(segment_size=64, segment_count=3)
+    assert len(list(segments.load(1000))) == 2
+    segments.open()  # Not appended after the torn record
+    assert segments.seqs[segments.slot] == 1
+
+
+def test_handler_reloads_persisted(seg_dir, clock):
+    logger = getLogger('replay_test')
+    logger.setLevel(INFO)
+
+    async def log_and_reload():
+        handler = ReplayBufferHandler(persistence=True, segment_size=256)
+        logger.addHandler(handler)
+        try:
+            for idx in range(20):
+                logger.info("record %s", idx)
+            await asyncio.sleep(0)  # Let the flush task run
+        finally:
+            logger.handlers.remove(handler)
+            handler._segments.close()
+
+        return ReplayBufferHandler(persistence=True, segment_size=256)
+
+    reloaded = asyncio.run(log_and_reload())
+    messages = [message for _, _, _, message
+                in reloaded.replay_buffer.records()]
+    assert messages[-1] == "record 19"
+    assert messages == ["record %s" % idx
+                        for idx in range(20 - len(messages), 20)]
@@ -0,0 +1,82 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import asyncio
+
+import pytest
+
+from mpy_blox.mqtt.hass.disco import MQTTDiscoverable
+from mpy_blox.rtc_state import RTC_MEMORY_SIZE, RTCState, rtc_state
+from mpy_blox.time import rtc
+
+
+@pytest.fixture
+def state():
+    rtc.memory(b'')
+    rtc_state.sections = None
+    yield RTCState()
+    rtc.memory(b'')
+    rtc_state.sections = None
+
+
+def test_roundtrip(state):
+    assert state.changed('temp', 21.5)
+    assert not state.changed('temp', 21.5)
+    state.section('jobs')['climate'] = 1234
+    state.save()
+
+    loaded = RTCState()
+    assert loaded.section('jobs') == {'climate': 1234}
+    assert not loaded.changed('temp', 21.5)
+    assert loaded.changed('temp', 22)
+
+
+@pytest.mark.parametrize('corrupt', [
+    lambda data: data[:-1] + bytes([data[-1] ^ 1]),  # Body, CRC mismatch
+    lambda data: b'XXXX' + data[4:],  # Magic
+    lambda data: data[:6],  # Truncated
+])
+def test_corrupt_state_ignored(state, corrupt):
+    state.changed('temp', 21.5)
+    state.save()
+    rtc.memory(corrupt(rtc.memory()))
+
+    loaded = RTCState()
+    assert loaded.load() == {}
+    assert loaded.changed('temp', 21.5)
+
+
+def test_too_large_not_saved(state):
+    state.changed('blob', 'x' * RTC_MEMORY_SIZE)
+    state.save()
+    assert rtc.memory() == b''
+
+
+class FakeConnection:
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, msg):
+        self.published.append(msg.topic)
+
+
+class Sensor(MQTTDiscoverable):
+    component_type = 'sensor'
+
+
+def test_disco_skips_unchanged_config(state, monkeypatch):
+    monkeypatch.setattr(MQTTDiscoverable, '_dev_registry',
+                        {'name': 'node', 'identifiers': ['node']})
+    mqtt_conn = FakeConnection()
+    sensor = Sensor('temperature', mqtt_conn)
+
+    asyncio.run(sensor.publish_config(force=False))
+    assert len(mqtt_conn.published) == 1
+
+    # After waking up the hash in RTC memory says it's still retained
+    rtc_state.sections = None
+    asyncio.run(sensor.publish_config(force=False))
+    assert len(mqtt_conn.published) == 1
+    asyncio.run(sensor.publish_config(force=True))
+    assert len(mqtt_conn.published) == 2
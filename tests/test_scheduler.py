@@ -0,0 +1,84 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import asyncio
+
+import machine
+import pytest
+
+from mpy_blox.rtc_state import rtc_state
+from mpy_blox.scheduler import DutyCycleScheduler
+from mpy_blox.time import anchor_time, epoch_ms
+
+
+@pytest.fixture
+def scheduler(clock):
+    anchor_time()
+    rtc_state.clear()
+    return DutyCycleScheduler()
+
+
+def make_job(runs, name):
+    async def job():
+        runs.append(name)
+    return job
+
+
+def test_due_within_slack(scheduler):
+    now = epoch_ms()
+    runs = []
+    fast = scheduler.every('fast', 60, make_job(runs, 'fast'))
+    slow = scheduler.every('slow', 600, make_job(runs, 'slow'))
+    asyncio.run(scheduler.run_jobs(now))
+    assert runs == ['fast', 'slow']  # Both due right away
+    assert (fast.next_ms, slow.next_ms) == (now + 60000, now + 600000)
+
+    # Slow joins a wakeup once it's within its slack, a tenth of 600s
+    assert scheduler.due_jobs(now + 539999) == [fast]
+    assert scheduler.due_jobs(now + 540000) == [fast, slow]
+    assert scheduler.next_wakeup() == now + 60000
+
+
+def test_cadence_and_falling_behind(scheduler):
+    now = epoch_ms()
+    job = scheduler.every('job', 10, make_job([], 'job'), slack_s=0)
+
+    # A late run keeps the cadence
+    job.next_ms = now - 3000
+    asyncio.run(scheduler.run_jobs(now))
+    assert job.next_ms == now + 7000
+
+    # More than an interval behind starts over from now
+    job.next_ms = now - 30000
+    asyncio.run(scheduler.run_jobs(now))
+    assert job.next_ms == now + 10000
+    assert rtc_state.section('jobs') == {'job': now + 10000}
+
+
+def test_failing_job_is_rescheduled(scheduler):
+    async def fail():
+        raise RuntimeError("sensor gone")
+
+    now = epoch_ms()
+    job = scheduler.every('fail', 10, fail)
+    asyncio.run(scheduler.run_jobs(now))
+    assert job.next_ms == now + 10000
+
+
+def test_schedule_trusted_after_deep_sleep(scheduler, monkeypatch):
+    now = epoch_ms()
+    scheduler.every('job', 60, make_job([], 'job'))
+    asyncio.run(scheduler.run_jobs(now))
+    rtc_state.save()
+
+    rtc_state.sections = None  # Like a fresh boot
+    monkeypatch.setattr(machine, 'reset_cause',
+                        lambda: machine.DEEPSLEEP_RESET)
+    woken = DutyCycleScheduler()
+    assert woken.every('job', 60, None).next_ms == now + 60000
+
+    rtc_state.sections = None
+    monkeypatch.setattr(machine, 'reset_cause', lambda: 0)
+    rebooted = DutyCycleScheduler()
+    assert rebooted.every('job', 60, None).next_ms == epoch_ms()
@@ -0,0 +1,43 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from mpy_blox.config.schema import compile_settings
+
+
+class TrackingDict(dict):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.looked_up = []
+
+    def __contains__(self, k):
+        self.looked_up.append(k)
+        return super().__contains__(k)
+
+
+def test_defaults_and_conversion():
+    settings = compile_settings({'logging.syslog.port': '1514',
+                                 'logging.syslog.protocol': 'sctp',
+                                 'ntp.host': 'a.example, b.example'})
+    assert settings.logging_syslog_port == 1514
+    assert settings.logging_syslog_protocol == 'udp'  # Invalid, default
+    assert settings.ntp_host == ['a.example', 'b.example']
+    assert settings.sleep_deep is False
+
+
+def test_only_secure_keys_use_secure_config():
+    secure = TrackingDict({'wlan.ssid': 'secure-ssid', 'hostname': 'x'})
+    config = {'secure': secure, 'wlan.ssid': 'plain-ssid',
+              'wlan.psk': 'plain-psk', 'hostname': 'node'}
+
+    settings = compile_settings(config)
+    assert settings.wlan_ssid == 'secure-ssid'
+    assert settings.wlan_psk == 'plain-psk'
+    assert settings.hostname == 'node'
+    assert set(secure.looked_up) == {'wlan.ssid', 'wlan.psk'}
+
+
+def test_nested_section():
+    assert compile_settings({'mqtt': {'ssl': True}}).mqtt_ssl is True
+    assert compile_settings({'mqtt.ssl': 'yes'}).mqtt_ssl is True
+    assert compile_settings({'mqtt': {'server': 'broker'}}).mqtt_ssl is False
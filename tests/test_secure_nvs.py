@@ -0,0 +1,82 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from mpy_blox.config.secure_nvs import SecureNVS
+
+
+def test_roundtrip(nvs_store):
+    nvs = SecureNVS('test')
+    nvs.update({'a': 1, 'b': {'c': 'd'}})
+    nvs.commit()
+
+    nvs = SecureNVS('test')
+    assert nvs.initialised
+    assert dict(nvs.items()) == {'a': 1, 'b': {'c': 'd'}}
+
+
+def test_reused_slot_survives_commit(nvs_store):
+    nvs = SecureNVS('test')
+    nvs.update({'a': 1, 'b': 2})
+    nvs.commit()
+
+    del nvs['a']
+    nvs['c'] = 3  # Slot of 'a' is only freed after the new index
+    nvs.commit()
+
+    nvs = SecureNVS('test')
+    assert dict(nvs.items()) == {'b': 2, 'c': 3}
+
+
+class PowerLoss(Exception):
+    pass
+
+
+def cut_power_at(monkeypatch, nvs, writes):
+    # Fail the writes after the first few, like a power loss would
+    calls = []
+
+    def fail(orig):
+        def write(*args):
+            calls.append(args[0])
+            if len(calls) > writes:
+                raise PowerLoss
+            return orig(*args)
+        return write
+
+    for name in ('set_blob', 'set_i32', 'erase_key'):
+        monkeypatch.setattr(nvs.nvs, name, fail(getattr(nvs.nvs, name)))
+    return calls
+
+
+def test_commit_power_loss(nvs_store, monkeypatch):
+    nvs = SecureNVS('test')
+    nvs.update({'a': 'short', 'b': 2})
+    nvs.commit()
+
+    # Every prefix of the writes leaves either the old or the new state
+    states = ({'a': 'short', 'b': 2}, {'a': 'a much longer value', 'c': 3})
+    writes = 0
+    while True:
+        store = {ns: dict(data) for ns, data in nvs_store.items()}
+        nvs = SecureNVS('test')
+        calls = cut_power_at(monkeypatch, nvs, writes)
+        nvs['a'] = 'a much longer value'
+        del nvs['b']
+        nvs['c'] = 3
+        try:
+            nvs.commit()
+            done = True
+        except PowerLoss:
+            done = False
+        monkeypatch.undo()
+
+        assert dict(SecureNVS('test').items()) in states
+        if done:
+            break
+        nvs_store.clear()
+        nvs_store.update(store)
+        writes += 1
+
+    assert len(calls) > 4  # Records, index size and blob, erasures
+    assert sorted(nvs_store['test']) == ['index', 'index_s', 'r2', 'r3']
@@ -0,0 +1,96 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import asyncio
+from calendar import timegm
+
+from mpy_blox.log_handlers import syslog
+from mpy_blox.log_handlers.syslog import APP_NAME, SyslogHandler
+from mpy_blox.time import anchor_time, isotime_ms
+
+
+def test_isotime_zero_padded():
+    timestamp_ms = timegm((2026, 1, 5, 3, 4, 5)) * 1000 + 7
+    assert isotime_ms(timestamp_ms) == '2026-01-05T03:04:05.007Z'
+
+
+def test_header_timestamp_rfc3339(clock):
+    clock.epoch_ms = timegm((2026, 1, 5, 3, 4, 5)) * 1000 - clock.ticks
+    anchor_time()
+
+    handler = SyslogHandler('collector', protocol='tcp',
+                            local_hostname='node')
+    assert handler.format_header(11, 'app') == (
+        b'<11>1 2026-01-05T03:04:05.000Z node ' + APP_NAME + b' - app - ')
+
+
+class FakeSocket:
+    def __init__(self):
+        self.datagrams = []
+
+    def sendto(self, data, addr):
+        self.datagrams.append(data)
+
+
+class FakeWriter:
+    def __init__(self):
+        self.data = b''
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+
+def run_send_task(handler, until):
+    async def run():
+        task = asyncio.create_task(handler.send_task())
+        handler.send_needed.set()
+        for _ in range(200):
+            await asyncio.sleep(0.001)
+            if until():
+                break
+        task.cancel()
+
+    asyncio.run(run())
+
+
+def test_udp_datagram_per_message(clock):
+    handler = SyslogHandler('127.0.0.1', rate=2)
+    handler.sock = sock = FakeSocket()
+    for msg in (b'one', b'two', b'three'):
+        handler.enqueue(msg)
+
+    run_send_task(handler, lambda: not handler.queue)
+    assert sock.datagrams == [b'one', b'two']  # Rate limited
+    clock.ticks += 1000
+    run_send_task(handler, lambda: not handler.queue)
+    assert sock.datagrams == [b'one', b'two', b'three']
+
+
+def test_tcp_reconnect_backoff(clock, monkeypatch):
+    writer = FakeWriter()
+    attempts = []
+
+    async def open_connection(host, port):
+        attempts.append(host)
+        if len(attempts) < 3:
+            raise OSError(111)
+        return None, writer
+    monkeypatch.setattr(syslog.asyncio, 'open_connection', open_connection)
+    monkeypatch.setattr(syslog, 'RECONNECT_DELAY_MAX', 0.004)
+
+    handler = SyslogHandler('collector', protocol='tcp', queue_size=2,
+                            local_hostname='node')
+    handler.reconnect_delay = 0.001
+    for msg in (b'one', b'two', b'three'):
+        handler.enqueue(msg)
+
+    run_send_task(handler, lambda: writer.data)
+    assert len(attempts) == 3
+    assert handler.reconnect_delay == syslog.RECONNECT_DELAY_MIN  # Reset
+    # Oldest dropped while connecting, reported once there's room
+    assert writer.data.startswith(b'3 two5 three')
+    assert writer.data.endswith(b' 1 messages dropped')
@@ -0,0 +1,41 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import asyncio
+
+from mpy_blox.mqtt import update
+from mpy_blox.mqtt.update import MQTTUpdateChannel
+
+
+class FakeConnection:
+    client_id = 'node'
+
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, msg):
+        self.published.append(msg.payload['done'])
+
+
+def test_progress_throttled(clock):
+    mqtt_conn = FakeConnection()
+    channel = MQTTUpdateChannel('test', False, mqtt_conn)
+
+    async def install(total):
+        for done in range(1, total + 1):
+            clock.ticks += 10
+            await channel.report_progress('pkg', done, total, 'member')
+
+    asyncio.run(install(250))
+    # First, one per second of the 2.5s and the last one
+    assert mqtt_conn.published == [1, 101, 201, 250]
+
+
+def test_new_package_update(monkeypatch):
+    monkeypatch.setattr(update.wheel, 'pkg_info', lambda name: None)
+    channel = MQTTUpdateChannel('test', False, FakeConnection())
+    channel.check_wheel_update({'name': 'mpy-demo', 'version': '1.0',
+                                'pkg_sha256': 'abc'})
+    assert channel.waiting_pkgs == {'wheel/abc'}
+    assert channel.expected_versions == {'mpy-demo': '1.0'}
@@ -0,0 +1,24 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import pytest
+
+from mpy_blox.wheel.info import WheelRecord
+
+
+def test_lookup():
+    record = WheelRecord('a/b.py,sha256=abc,12\r\n'
+                         'odd,name.py,sha256=def,3\n'
+                         'pkg.dist-info/RECORD,,\n')
+    assert list(record) == ['a/b.py', 'odd,name.py', 'pkg.dist-info/RECORD']
+    assert record['a/b.py'].size == 12
+    assert record['odd,name.py'].encoded_checksum == 'def'
+    assert record['pkg.dist-info/RECORD'].checksum is None
+
+
+@pytest.mark.parametrize('line', ['no_separator.py', 'one,separator.py'])
+def test_malformed_line(line):
+    # A later well-formed line must not hide the missing separators
+    with pytest.raises(ValueError):
+        WheelRecord(line + '\na/b.py,sha256=abc,12\n')
@@ -0,0 +1,45 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import io
+
+import pytest
+
+from mpy_blox.wheel.wheelfile import BadWheelFile, WheelFile, WheelWriter
+
+
+def write_wheel(members):
+    out_f = io.BytesIO()
+    with WheelWriter(out_f, 'mpy-demo', '1.2.3') as wheel_writer:
+        for name, data in members.items():
+            wheel_writer.writestr(name, data)
+    out_f.seek(0)
+    return out_f
+
+
+def test_writer_roundtrip():
+    members = {'mpy_demo/__init__.py': b'VERSION = 1\n',
+               'mpy_demo/data.bin': bytes(range(256)) * 10}
+    wheel_f = WheelFile(write_wheel(members))
+    assert wheel_f.pkg_name == 'mpy_demo'
+    assert wheel_f.pkg_version == '1.2.3'
+    assert wheel_f.metadata['Name'] == 'mpy-demo'
+
+    record = wheel_f.wheel_record
+    assert record['mpy_demo/data.bin'].size == 2560
+    assert record['mpy_demo-1.2.3.dist-info/RECORD'].checksum is None
+    for name, data in members.items():
+        assert wheel_f.read(name) == data
+        with wheel_f.open(name) as member_f:
+            assert member_f.read() == data
+
+
+def test_record_mismatch():
+    wheel_f = WheelFile(write_wheel({'mpy_demo/a.py': b'A' * 64}))
+    record = wheel_f.wheel_record['mpy_demo/a.py']
+    record.encoded_checksum = record.encoded_checksum[::-1]
+    with pytest.raises(BadWheelFile):
+        wheel_f.read(record)
+    with pytest.raises(BadWheelFile):
+        wheel_f.open(record).read()
@@ -0,0 +1,161 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import io
+import struct
+
+import pytest
+
+from mpy_blox.zipfile import (COMP_DEF, COMP_NONE, MAX_COMMENT_LEN,
+                              ZIP64_LIMIT, BadZipFile, ZipFile, ZipWriter)
+
+MEMBERS = {
+    'empty.txt': b'',
+    'small.txt': b'hello zip',
+    'pkg/large.bin': bytes(range(256)) * 40,  # Spans several chunks
+}
+
+
+def write_zip(members, compress_method=COMP_DEF):
+    out_f = io.BytesIO()
+    with ZipWriter(out_f, compress_method) as zip_writer:
+        for name, data in members.items():
+            zip_writer.writestr(name, data)
+    out_f.seek(0)
+    return out_f
+
+
+@pytest.mark.parametrize('compress_method', [COMP_NONE, COMP_DEF])
+def test_writer_roundtrip(compress_method):
+    zip_f = ZipFile(write_zip(MEMBERS, compress_method))
+    assert list(zip_f) == list(MEMBERS)
+    for name, data in MEMBERS.items():
+        assert zip_f[name].compress_method == compress_method
+        assert zip_f[name].size == len(data)
+        assert zip_f.read(name) == data
+
+        out_f = io.BytesIO()
+        assert zip_f.extract_to(name, out_f, bytearray(100)) == len(data)
+        assert out_f.getvalue() == data
+
+
+def test_writer_output_readable_by_cpython():
+    import zipfile
+    with zipfile.ZipFile(write_zip(MEMBERS)) as zip_f:
+        assert zip_f.testzip() is None
+        assert {name: zip_f.read(name) for name in zip_f.namelist()} == MEMBERS
+
+
+def test_writer_rejects_zip64_sizes():
+    zip_writer = ZipWriter(io.BytesIO(), COMP_NONE)
+    member_f = zip_writer.open('huge.bin')
+    member_f.size = ZIP64_LIMIT + 1  # Past the limit, not only at it
+    with pytest.raises(BadZipFile):
+        member_f.close()
+
+
+def cpython_zip(members, comment=b'', compression=COMP_DEF):
+    import zipfile
+    out_f = io.BytesIO()
+    with zipfile.ZipFile(out_f, 'w', compression) as zip_f:
+        for name, data in members.items():
+            zip_f.writestr(name, data)
+        zip_f.comment = comment
+    out_f.seek(0)
+    return out_f
+
+
+def zip64_zip(members, fake_offset=None):
+    # Stored members, every size and offset in ZIP64 extras, ZIP64 EOCD
+    from binascii import crc32
+    out = bytearray()
+    central_dir = bytearray()
+    for name, data in members.items():
+        offset = len(out)
+        encoded = name.encode()
+        out += struct.pack('<4s2B4HL2L2H', b'PK\x03\x04', 45, 0, 0, 0, 0, 0,
+                           crc32(data), len(data), len(data), len(encoded), 0)
+        out += encoded + data
+        extra = struct.pack('<2H3Q', 0x0001, 24, len(data), len(data),
+                            fake_offset or offset)
+        central_dir += struct.pack('<4s4B4H3L5H2L', b'PK\x01\x02',
+                                   45, 0, 45, 0, 0, 0, 0, 0, crc32(data),
+                                   0xFFFFFFFF, 0xFFFFFFFF, len(encoded),
+                                   len(extra), 0, 0, 0, 0, 0xFFFFFFFF)
+        central_dir += encoded + extra
+
+    cd_offset = len(out)
+    out += central_dir
+    zip64_eocd_offset = len(out)
+    out += struct.pack('<4sQ2H2L4Q', b'PK\x06\x06', 44, 45, 45, 0, 0,
+                       len(members), len(members), len(central_dir),
+                       cd_offset)
+    out += struct.pack('<4sLQL', b'PK\x06\x07', 0, zip64_eocd_offset, 1)
+    out += struct.pack('<4s4H2LH', b'PK\x05\x06', 0, 0, 0xFFFF, 0xFFFF,
+                       0xFFFFFFFF, 0xFFFFFFFF, 0)
+    return io.BytesIO(bytes(out))
+
+
+def test_central_dir_index():
+    zip_f = ZipFile(cpython_zip(MEMBERS))
+    assert len(zip_f) == len(MEMBERS)
+    assert list(zip_f) == list(MEMBERS)
+    assert 'small.txt' in zip_f
+    assert 'missing.txt' not in zip_f
+    with pytest.raises(KeyError):
+        zip_f['missing.txt']
+
+    zip_info = zip_f.getinfo('pkg/large.bin')
+    assert zip_info.compressed
+    assert zip_info.size == len(MEMBERS['pkg/large.bin'])
+    assert zip_f.getinfo(zip_info) is zip_info
+
+
+def test_streaming_member():
+    zip_f = ZipFile(cpython_zip(MEMBERS))
+    data = MEMBERS['pkg/large.bin']
+    with zip_f.open('pkg/large.bin') as member_f:
+        chunks = [member_f.read(1000) for _ in range(len(data) // 1000 + 1)]
+        assert member_f.read() == b''
+    assert b''.join(chunks) == data
+
+
+def test_streaming_member_bad_crc():
+    zip_data = bytearray(
+        cpython_zip({'a.txt': b'abcdef'}, compression=COMP_NONE).getvalue())
+    zip_data[zip_data.find(b'abcdef')] ^= 1
+    zip_f = ZipFile(io.BytesIO(bytes(zip_data)))
+    with pytest.raises(BadZipFile):
+        zip_f.open('a.txt').read()
+
+
+@pytest.mark.parametrize('comment', [
+    b'short', b'PK\x05\x06 looks like an EOCD' + b'.' * 40,
+    b'x' * MAX_COMMENT_LEN])
+def test_eocd_with_comment(comment):
+    zip_f = ZipFile(cpython_zip(MEMBERS, comment))
+    assert zip_f.read('small.txt') == MEMBERS['small.txt']
+
+
+def test_eocd_comment_too_long():
+    zip_f = cpython_zip(MEMBERS, b'x' * 2 * MAX_COMMENT_LEN)
+    with pytest.raises(BadZipFile):
+        ZipFile(zip_f)
+    assert ZipFile(zip_f, max_comment_len=2 * MAX_COMMENT_LEN)
+
+
+def test_zip64():
+    import zipfile
+    zip_f = ZipFile(zip64_zip(MEMBERS))
+    assert zip_f.zip64
+    assert {name: zip_f.read(name) for name in zip_f} == MEMBERS
+    assert zip_f._offsets.typecode == 'L'  # All values fit 32-bit
+    assert zipfile.ZipFile(zip64_zip(MEMBERS)).testzip() is None
+
+
+def test_zip64_wide_values():
+    zip_f = ZipFile(zip64_zip({'a.txt': b'a', 'b.txt': b'b'},
+                              fake_offset=5 << 32))
+    assert zip_f._offsets.typecode == 'Q'
+    assert [zip_f[name].offset for name in zip_f] == [5 << 32] * 2